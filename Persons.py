@@ -1,12 +1,345 @@
-from datetime import date
+from datetime import date, timedelta
 import uuid
 from math import floor
+from bisect import bisect_left
+import io
 import re
+import os
 import csv
 import json
+import threading
+import polars as pl
+
+# Reference data files read by Person.diet_rqmts
+REFERENCE_FILES = [
+    "data/energy.csv",
+    "data/rda.csv",
+    "data/tul.csv",
+    "data/proteins.csv",
+    "data/kcal_per_gram.csv",
+    "data/energy_dist_lower.csv",
+    "data/energy_dist_upper.csv",
+    "data/nutrient_keys.tsv",
+]
+# Contents of data files held in memory (e.g. attached from shared memory, see shared.py), used instead of reading them from disk
+data_files = {}
+# Store of existing users (see users.UserStore) that new usernames and uids must not clash with, if in use
+user_store = None
+
+
+def shared_data_paths():
+    """
+    Returns the paths of the data files Person reads: the reference data files, and the requirements bundle if there is one.
+    """
+    return REFERENCE_FILES + ([REQUIREMENTS_BUNDLE] if os.path.exists(REQUIREMENTS_BUNDLE) else [])
+
+
+def preload_data_files():
+    """
+    Reads the data files Person reads into data_files, so long running processes don't read them from disk for every person.
+    """
+    for path in shared_data_paths():
+        with open(path, "rb") as file:
+            data_files[path] = file.read()
+
+
+def open_data(path):
+    """
+    Returns an open text file for a data file, using its in-memory copy in data_files if there is one.
+    The copy (bytes, or a memoryview of shared memory) is decoded directly, without copying it first.
+    """
+    if path in data_files:
+        return io.StringIO(str(data_files[path], "utf-8"), newline="")
+    return open(path)
+
+
+# Columns identifying the rows of the reference tables, and the types of their values ("none" is read as None)
+ENERGY_KEYS = ["min_age", "sex", "maternity", "stage", "PAL", "min_BMI"]
+AGE_SEX_MATERNITY_KEYS = ["min_age", "sex", "maternity"]
+KEY_TYPES = {"min_age": float, "min_BMI": float, "stage": int}
+# Energy distribution columns, and the macronutrient whose kcal/g converts them to grams
+ENERGY_SOURCES = {
+    "Total Fat": "Total Fat",
+    "n-6 linoleic acid": "Total Fat",
+    "n-3 a-linolenic Acid (ALA)": "Total Fat",
+    "Total Carbohydrates": "Total Carbohydrates",
+    "Total Protein": "Total Protein",
+    "LC-PUFAs": "Total Fat",
+}
+# Every table Person.diet_rqmts reads, with its key columns
+REQUIREMENT_TABLES = {
+    "data/energy.csv": ENERGY_KEYS,
+    "data/rda.csv": AGE_SEX_MATERNITY_KEYS,
+    "data/tul.csv": AGE_SEX_MATERNITY_KEYS,
+    "data/proteins.csv": AGE_SEX_MATERNITY_KEYS,
+    "data/kcal_per_gram.csv": ["name"],
+    "data/energy_dist_lower.csv": ["min_age"],
+    "data/energy_dist_upper.csv": ["min_age"],
+}
+# Precompiled copy of all the tables, written by acquisitions.extract_requirements_bundle
+REQUIREMENTS_BUNDLE = "data/requirements.parquet"
+# Bump when the bundle's layout changes, so bundles written by older versions are ignored
+BUNDLE_VERSION = 2
+BUNDLE_SCHEMA = {
+    "version": pl.UInt16,
+    # Sizes and modification times of the data files the bundle was compiled from (see source_stamp)
+    "sources": pl.Utf8,
+    "table": pl.Utf8,
+    "min_age": pl.Float64,
+    "sex": pl.Utf8,
+    "maternity": pl.Utf8,
+    "stage": pl.Int64,
+    "PAL": pl.Utf8,
+    "min_BMI": pl.Float64,
+    "name": pl.Utf8,
+    "column": pl.Utf8,
+    "value": pl.Float64,
+    "unit": pl.Utf8,
+    "nutrient_nbr": pl.List(pl.Int64),
+    "nutrient_id": pl.List(pl.Int64),
+}
+# Reference tables compiled by reference_table, by path and key columns
+reference_tables = {}
+
+
+# Dates are given as yyyy-mm-dd, by single persons and batches alike
+ISO_DATE = r"\d{4}-\d{2}-\d{2}"
+
+
+def normalise_name(name):
+    """
+    Returns a username as it's stored and looked up: stripped, with each run of letters lower cased but for its first letter,
+    which is upper cased (e.g. "Mary-Jane O'Neil"). The same as normalise_names, for single persons and the user store.
+    """
+    return re.sub(r"[^\W\d_]+", lambda word: word.group().lower()[0].upper() + word.group().lower()[1:], name.strip())
+
+
+def normalise_names(names):
+    """
+    Returns an expression normalising a column of usernames like normalise_name. polars' title casing only starts words after whitespace,
+    so a marker and a space are inserted after every other character that isn't a letter, and removed once the words are title cased.
+    """
+    return (
+        names.str.strip()
+        .str.replace_all(r"([^\p{L}\p{M}\s])", "${1}\u0001 ")
+        .str.to_titlecase()
+        .str.replace_all("\u0001 ", "", literal=True)
+    )
+
+
+def parse_date(text):
+    """
+    Returns the date of a yyyy-mm-dd string. Raises ValueError for other formats and invalid dates.
+    """
+    if not re.fullmatch(ISO_DATE, text):
+        raise ValueError(f"Not a yyyy-mm-dd date: {text}")
+    return date.fromisoformat(text)
+
+
+def parse_dates(dates):
+    """
+    Returns an expression parsing a column of dates as the Person setters do: keeping only digits and '-', then reading yyyy-mm-dd,
+    with null for other formats and invalid dates.
+    """
+    dates = dates.str.replace_all(r"[^0-9\-]", "")
+    return pl.when(dates.str.contains(f"^{ISO_DATE}$")).then(dates.str.strptime(pl.Date, "%Y-%m-%d", strict=False))
+
+
+def str_to_float(s):
+    try:
+        return float(s)
+    except (ValueError, TypeError):
+        return 0
+
+
+def compile_reference_table(path, key_columns):
+    """
+    Reads a reference data file into (rows, bands):
+    - rows: each row's other columns as floats, keyed by a tuple of its typed key_columns values.
+    - bands: the sorted distinct lower bounds of each numeric key column (e.g. min_age), for band().
+    """
+    rows = {}
+    with open_data(path) as csvfile:
+        for row in csv.DictReader(csvfile):
+            key = []
+            for column in key_columns:
+                value = row.pop(column)
+                if value == "none":
+                    value = None
+                elif column in KEY_TYPES:
+                    value = KEY_TYPES[column](value)
+                key.append(value)
+            rows[tuple(key)] = {i: str_to_float(value) for i, value in row.items()}
+    return rows, bands(rows, key_columns)
+
+
+def bands(rows, key_columns):
+    """
+    Returns the sorted distinct lower bounds of each numeric key column of rows.
+    """
+    return {
+        column: sorted({key[i] for key in rows if key[i] is not None})
+        for i, column in enumerate(key_columns)
+        if column in KEY_TYPES
+    }
+
+
+def compile_nutrient_keys():
+    """
+    Reads nutrient_keys.tsv into a dictionary of each nutrient's unit, nutrient_nbr and nutrient_id lists, by name.
+    """
+    with open_data("data/nutrient_keys.tsv") as tsvfile:
+        return {
+            row["name"]: {
+                "unit": row["unit"],
+                "nutrient_nbr": json.loads(row["nutrient_nbr"]),
+                "nutrient_id": json.loads(row["nutrient_id"]),
+            }
+            for row in csv.DictReader(tsvfile, dialect="excel-tab")
+        }
+
+
+def reference_table(path, key_columns):
+    """
+    Returns a reference table compiled once per process (see compile_reference_table),
+    loading all of them from the requirements bundle in one read if there is one.
+    """
+    if not reference_tables:
+        load_requirements_bundle()
+    if (path, tuple(key_columns)) not in reference_tables:
+        reference_tables[(path, tuple(key_columns))] = compile_reference_table(path, key_columns)
+    return reference_tables[(path, tuple(key_columns))]
+
+
+def nutrient_keys():
+    """
+    Returns the nutrient keys compiled once per process (see compile_nutrient_keys).
+    """
+    if not reference_tables:
+        load_requirements_bundle()
+    if ("data/nutrient_keys.tsv", ()) not in reference_tables:
+        reference_tables[("data/nutrient_keys.tsv", ())] = compile_nutrient_keys()
+    return reference_tables[("data/nutrient_keys.tsv", ())]
+
+
+def requirements_bundle():
+    """
+    Returns all the reference tables compiled from the data files as one dataframe, to write as the requirements bundle.
+    Each row holds one value: the table's path, its typed key columns (null where unused), the column name and the value as a float.
+    Nutrient keys are rows with their unit and nutrient_nbr and nutrient_id lists instead.
+    """
+    records = []
+    for path, key_columns in REQUIREMENT_TABLES.items():
+        rows, _ = compile_reference_table(path, key_columns)
+        for key, values in rows.items():
+            for column, value in values.items():
+                records.append(
+                    {"table": path, **dict(zip(key_columns, key)), "column": column, "value": value}
+                )
+    for name, keys in compile_nutrient_keys().items():
+        records.append({"table": "data/nutrient_keys.tsv", "name": name, **keys})
+    sources = source_stamp()
+    for record in records:
+        record["version"] = BUNDLE_VERSION
+        record["sources"] = sources
+    return pl.from_dicts(records, schema=BUNDLE_SCHEMA)
+
+
+def source_stamp():
+    """
+    Returns the size and modification time of each reference data file, as a JSON string.
+    The requirements bundle is stamped with it, so a bundle compiled before the files changed isn't used. Only the files' metadata is read.
+    """
+    stamp = {}
+    for path in REFERENCE_FILES:
+        try:
+            stat = os.stat(path)
+            stamp[path] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            stamp[path] = None
+    return json.dumps(stamp, sort_keys=True)
+
+
+def load_requirements_bundle(path=REQUIREMENTS_BUNDLE):
+    """
+    Fills reference_tables from the requirements bundle, if it exists, was written with this BUNDLE_VERSION and was compiled from the current data files.
+    Reads its in-memory copy in data_files (e.g. in shared memory) if there is one. Returns whether it was loaded.
+    A bundle compiled before the data files changed isn't loaded, so the tables are compiled from the data files until it's rebuilt
+    (see acquisitions.extract_requirements_bundle).
+    """
+    if path in data_files:
+        bundle = pl.read_parquet(io.BytesIO(data_files[path]))
+    elif os.path.exists(path):
+        bundle = pl.read_parquet(path)
+    else:
+        return False
+    if bundle.is_empty() or bundle["version"][0] != BUNDLE_VERSION:
+        return False
+    if bundle["sources"][0] != source_stamp():
+        return False
+    keys = bundle.filter(pl.col("table") == "data/nutrient_keys.tsv")
+    reference_tables[("data/nutrient_keys.tsv", ())] = {
+        name: {"unit": unit, "nutrient_nbr": nutrient_nbr, "nutrient_id": nutrient_id}
+        for name, unit, nutrient_nbr, nutrient_id in zip(
+            *(keys[column].to_list() for column in ["name", "unit", "nutrient_nbr", "nutrient_id"])
+        )
+    }
+    for (table,), values in bundle.filter(pl.col("table") != "data/nutrient_keys.tsv").groupby(
+        ["table"], maintain_order=True
+    ):
+        key_columns = REQUIREMENT_TABLES[table]
+        rows = {}
+        for *key, column, value in zip(
+            *(values[column].to_list() for column in key_columns + ["column", "value"])
+        ):
+            rows.setdefault(tuple(key), {})[column] = value
+        reference_tables[(table, tuple(key_columns))] = (rows, bands(rows, key_columns))
+    return True
+
+
+def band(bounds, value):
+    """
+    Returns the band value falls in: the greatest of the sorted lower bounds that is below value.
+    """
+    position = bisect_left(bounds, value)
+    if not position:
+        raise ValueError(f"No reference values for {value}, below the lowest band ({bounds[0]})")
+    return bounds[position - 1]
 
 
 class Person:
+    # Fixed attributes, without a per-instance __dict__, to keep each person small
+    __slots__ = [
+        "_name",
+        "_dob",
+        "_sex",
+        "_height",
+        "_weight",
+        "_due_date",
+        "_breastfeeding",
+        "_pal",
+        "desired_weight",
+        "desired_bmi",
+        "uid",
+        "_requirements",
+        "_inputs_version",
+        "_as_of",
+    ]
+    # Attributes diet_rqmts depends on: setting any of them invalidates the cached requirements
+    REQUIREMENT_INPUTS = {
+        "dob",
+        "sex",
+        "height",
+        "weight",
+        "due_date",
+        "breastfeeding",
+        "pal",
+        "desired_weight",
+        "desired_bmi",
+    }
+    # Guards recomputing requirements, shared by all persons rather than one per person to keep them small
+    _requirements_lock = threading.Lock()
+
     def __init__(
         self,
         name,
@@ -19,7 +352,19 @@ class Person:
         pal=None,
         desired_weight=None,
         desired_bmi=None,
+        uid=None,
     ):
+        # Cached (date, inputs version, diet_rqmts), see diet_rqmts
+        self._requirements = None
+        self._inputs_version = 0
+        # Date age and gestation are worked out on, if not today (see on())
+        self._as_of = None
+        # Add unique user id (or keep the stored one of an existing user), set first so the username check knows whose name it is
+        if uid is None:
+            uid = uuid.uuid1()
+            while user_store is not None and user_store.uid_taken(uid):
+                uid = uuid.uuid1()
+        self.uid = uid
         self.name = name
         self.dob = dob
         self.sex = sex
@@ -30,10 +375,11 @@ class Person:
         self.pal = pal
         self.desired_weight = desired_weight
         self.desired_bmi = desired_bmi
-        # Add unique user id. check if it's already taken (check against user file once established)
-        uid = uuid.uuid1()
-        if uid not in []:
-            self.uid = uid
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in Person.REQUIREMENT_INPUTS:
+            super().__setattr__("_inputs_version", self._inputs_version + 1)
 
     def __str__(self):
         if self.due_date:
@@ -51,11 +397,11 @@ class Person:
 
     @name.setter
     def name(self, name):
-        name = name.strip().title()
+        name = normalise_name(name)
         if not name:
             raise ValueError("Must provide the person's username.")
-        # Check against stored file/db with usernames
-        if name in []:
+        # Check against the user store, if one is in use
+        if user_store is not None and user_store.name_owner(name) not in (None, self.uid):
             raise ValueError("Username must be unique")
         self._name = name
 
@@ -69,16 +415,19 @@ class Person:
             raise ValueError("Must provide a date of birth")
         dob = re.sub(r"[^0-9\-]", "", dob)
         try:
-            date.fromisoformat(dob)
-        except:
+            parse_date(dob)
+        except ValueError:
             raise ValueError("Must provide date of birth in the isoformat: yyyy-mm-dd")
-        if date.fromisoformat(dob) > date.today():
+        if parse_date(dob) > date.today():
             raise ValueError("Must provide a date from the past")
         self._dob = dob
 
+    def today(self):
+        return self._as_of or date.today()
+
     @property
     def age(self):
-        delta = date.today() - date.fromisoformat(self.dob)
+        delta = self.today() - date.fromisoformat(self.dob)
         return delta.days / 365
 
     @property
@@ -148,20 +497,20 @@ class Person:
         if due_date:
             due_date = re.sub(r"[^0-9\-]", "", due_date)
             try:
-                date.fromisoformat(due_date)
-            except:
+                parse_date(due_date)
+            except ValueError:
                 raise ValueError("Must provide due date in the isoformat: yyyy-mm-dd")
             if date.fromisoformat(due_date) < date.today():
-                due_date = None
-            self._due_date = date.fromisoformat(due_date)
+                self._due_date = None
+            else:
+                self._due_date = date.fromisoformat(due_date)
         else:
             self._due_date = None
 
     @property
     def gestation(self):
         if self.due_date:
-            days_left = self.due_date - date.today()
-            print(date.today())
+            days_left = self.due_date - self.today()
             week = 1 + (280 - days_left.days) // 7
             return week
         else:
@@ -197,7 +546,7 @@ class Person:
 
     @pal.setter
     def pal(self, pal):
-        pal = pal.strip().lower()
+        pal = str(pal).strip().lower() if pal is not None else ""
         if not pal:
             raise ValueError("Must provide the person's physical activity level.")
         if pal in [1, "1", "inactive"]:
@@ -216,122 +565,51 @@ class Person:
 
     @property
     def diet_rqmts(self):
-        def float_to_str(n):
-            if n.is_integer():
-                return str(int(n))
-            else:
-                return str(n)
+        """
+        The person's daily requirements (see compute_diet_rqmts), computed once and reused
+        until one of REQUIREMENT_INPUTS is set or the date changes (changing age and gestation).
+        The same dictionary is returned to every reader, so copy it before changing it.
+        """
+        today = date.today()
+        cached = self._requirements
+        if cached and cached[0] == today and cached[1] == self._inputs_version:
+            return cached[2]
+        with self._requirements_lock:
+            cached = self._requirements
+            if cached and cached[0] == today and cached[1] == self._inputs_version:
+                return cached[2]
+            # If an input is set while computing, the version won't match and the next read recomputes
+            version = self._inputs_version
+            requirements = self.compute_diet_rqmts()
+            self._requirements = (today, version, requirements)
+            return requirements
 
-        def str_to_float(s):
-            try:
-                return float(s)
-            except (ValueError, TypeError):
-                return 0
+    def compute_diet_rqmts(self):
+        """
+        Computes the person's daily requirements for each nutrient from the reference tables.
+        """
+        if self.due_date:
+            maternity = "pregnant"
+        elif self.breastfeeding:
+            maternity = "breastfeeding"
+        else:
+            maternity = None
 
         def kcal():
-            dct = {}
-            min_ages = []
-            min_BMIs = []
-            with open("data/energy.csv") as csvfile:
-                data_headers = list(csv.reader(csvfile))[0]
-                remove_headers = [
-                    "min_age",
-                    "sex",
-                    "maternity",
-                    "stage",
-                    "PAL",
-                    "min_BMI",
-                ]
-                for i in remove_headers:
-                    data_headers.remove(i)
-            with open("data/energy.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row["min_age"] not in dct:
-                        dct[row["min_age"]] = {}
-                    if row["sex"] not in dct[row["min_age"]]:
-                        dct[row["min_age"]][row["sex"]] = {}
-                    if row["maternity"] not in dct[row["min_age"]][row["sex"]]:
-                        dct[row["min_age"]][row["sex"]][row["maternity"]] = {}
-                    if (
-                        row["stage"]
-                        not in dct[row["min_age"]][row["sex"]][row["maternity"]]
-                    ):
-                        dct[row["min_age"]][row["sex"]][row["maternity"]][
-                            row["stage"]
-                        ] = {}
-                    if (
-                        row["PAL"]
-                        not in dct[row["min_age"]][row["sex"]][row["maternity"]][
-                            row["stage"]
-                        ]
-                    ):
-                        dct[row["min_age"]][row["sex"]][row["maternity"]][row["stage"]][
-                            row["PAL"]
-                        ] = {}
-                    if (
-                        row["min_BMI"]
-                        not in dct[row["min_age"]][row["sex"]][row["maternity"]][
-                            row["stage"]
-                        ][row["PAL"]]
-                    ):
-                        dct[row["min_age"]][row["sex"]][row["maternity"]][row["stage"]][
-                            row["PAL"]
-                        ][row["min_BMI"]] = {}
-                    dct[row["min_age"]][row["sex"]][row["maternity"]][row["stage"]][
-                        row["PAL"]
-                    ][row["min_BMI"]] = {i: str_to_float(row[i]) for i in data_headers}
-                    if str_to_float(row["min_age"]) not in min_ages:
-                        min_ages.append(str_to_float(row["min_age"]))
-                    if row["min_BMI"] != "none":
-                        if str_to_float(row["min_BMI"]) not in min_BMIs:
-                            min_BMIs.append(str_to_float(row["min_BMI"]))
-            min_age = float_to_str(max(age for age in min_ages if age < self.age))
-            sex = self.sex
+            rows, bands = reference_table("data/energy.csv", ENERGY_KEYS)
+            min_age = band(bands["min_age"], self.age)
+            stage = None
+            min_BMI = None
             if self.due_date:
-                maternity = "pregnant"
-                stage = str(self.trimester)
+                stage = self.trimester
                 if self.trimester > 1:
                     if self.desired_bmi:
-                        min_BMI = str(
-                            max(bmi for bmi in min_BMIs if bmi < self.desired_bmi)
-                        )
+                        min_BMI = band(bands["min_BMI"], self.desired_bmi)
                     elif self.bmi:
-                        min_BMI = str(max(bmi for bmi in min_BMIs if bmi < self.bmi))
-                    else:
-                        min_BMI = "none"
+                        min_BMI = band(bands["min_BMI"], self.bmi)
             elif self.breastfeeding:
-                maternity = "breastfeeding"
-                stage = str(self.breastfeeding)
-                min_BMI = "none"
-            else:
-                maternity = "none"
-                stage = "none"
-                min_BMI = "none"
-            pal = self.pal
-            constant = dct[min_age][sex][maternity][stage][pal][min_BMI]["constant"]
-            age_param = dct[min_age][sex][maternity][stage][pal][min_BMI]["age_param"]
-            height_param = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "height_param"
-            ]
-            weight_param = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "weight_param"
-            ]
-            growth_cost = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "growth_cost"
-            ]
-            gestation_param = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "gestation_param"
-            ]
-            energy_deposition = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "energy_deposition"
-            ]
-            milk_production = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "milk_production"
-            ]
-            energy_mobilization = dct[min_age][sex][maternity][stage][pal][min_BMI][
-                "energy_mobilization"
-            ]
+                stage = self.breastfeeding
+            row = rows[(min_age, self.sex, maternity, stage, self.pal, min_BMI)]
             if self.desired_weight:
                 weight = self.desired_weight
             else:
@@ -341,247 +619,68 @@ class Person:
             else:
                 gestation = 0
             kcal = (
-                constant
-                + (age_param * self.age)
-                + (height_param * self.height)
-                + (weight_param * weight)
-                + growth_cost
-                + (gestation_param * gestation)
-                + energy_deposition
-                + milk_production
-                + energy_mobilization
+                row["constant"]
+                + (row["age_param"] * self.age)
+                + (row["height_param"] * self.height)
+                + (row["weight_param"] * weight)
+                + row["growth_cost"]
+                + (row["gestation_param"] * gestation)
+                + row["energy_deposition"]
+                + row["milk_production"]
+                + row["energy_mobilization"]
             )
             return kcal
 
-        def rda():
-            dct = {}
-            min_ages = []
-            with open("data/rda.csv") as csvfile:
-                data_headers = list(csv.reader(csvfile))[0]
-                remove_headers = ["min_age", "sex", "maternity"]
-                for i in remove_headers:
-                    data_headers.remove(i)
-            with open("data/rda.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row["min_age"] not in dct:
-                        dct[row["min_age"]] = {}
-                    if row["sex"] not in dct[row["min_age"]]:
-                        dct[row["min_age"]][row["sex"]] = {}
-                    if row["maternity"] not in dct[row["min_age"]][row["sex"]]:
-                        dct[row["min_age"]][row["sex"]][row["maternity"]] = {}
-                    dct[row["min_age"]][row["sex"]][row["maternity"]] = {
-                        i: str_to_float(row[i]) for i in data_headers
-                    }
-                    if str_to_float(row["min_age"]) not in min_ages:
-                        min_ages.append(str_to_float(row["min_age"]))
-            min_age = float_to_str(max(age for age in min_ages if age < self.age))
-            sex = self.sex
-            if self.due_date:
-                maternity = "pregnant"
-            elif self.breastfeeding:
-                maternity = "breastfeeding"
-            else:
-                maternity = "none"
-            rda = dct[min_age][sex][maternity]
-            return rda
-
-        def tul():
-            dct = {}
-            min_ages = []
-            with open("data/tul.csv") as csvfile:
-                data_headers = list(csv.reader(csvfile))[0]
-                remove_headers = ["min_age", "sex", "maternity"]
-                for i in remove_headers:
-                    data_headers.remove(i)
-            with open("data/tul.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row["min_age"] not in dct:
-                        dct[row["min_age"]] = {}
-                    if row["sex"] not in dct[row["min_age"]]:
-                        dct[row["min_age"]][row["sex"]] = {}
-                    if row["maternity"] not in dct[row["min_age"]][row["sex"]]:
-                        dct[row["min_age"]][row["sex"]][row["maternity"]] = {}
-                    dct[row["min_age"]][row["sex"]][row["maternity"]] = {
-                        i: str_to_float(row[i]) for i in data_headers
-                    }
-                    if str_to_float(row["min_age"]) not in min_ages:
-                        min_ages.append(str_to_float(row["min_age"]))
-            min_age = float_to_str(max(age for age in min_ages if age < self.age))
-            sex = self.sex
-            if self.due_date:
-                maternity = "pregnant"
-            elif self.breastfeeding:
-                maternity = "breastfeeding"
-            else:
-                maternity = "none"
-            tul = dct[min_age][sex][maternity]
-            return tul
+        def by_age_sex_maternity(path):
+            rows, bands = reference_table(path, AGE_SEX_MATERNITY_KEYS)
+            return rows[(band(bands["min_age"], self.age), self.sex, maternity)]
 
         def proteins():
-            dct = {}
-            min_ages = []
             if self.desired_weight:
                 weight = float(self.desired_weight)
             else:
                 weight = float(self.weight)
-            with open("data/proteins.csv") as csvfile:
-                data_headers = list(csv.reader(csvfile))[0]
-                remove_headers = ["min_age", "sex", "maternity"]
-                for i in remove_headers:
-                    data_headers.remove(i)
-            with open("data/proteins.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row["min_age"] not in dct:
-                        dct[row["min_age"]] = {}
-                    if row["sex"] not in dct[row["min_age"]]:
-                        dct[row["min_age"]][row["sex"]] = {}
-                    if row["maternity"] not in dct[row["min_age"]][row["sex"]]:
-                        dct[row["min_age"]][row["sex"]][row["maternity"]] = {}
-                    dct[row["min_age"]][row["sex"]][row["maternity"]] = {
-                        i: str_to_float(row[i]) * weight for i in data_headers
-                    }
-                    if str_to_float(row["min_age"]) not in min_ages:
-                        min_ages.append(str_to_float(row["min_age"]))
-            min_age = float_to_str(max(age for age in min_ages if age < self.age))
-            sex = self.sex
-            if self.due_date:
-                maternity = "pregnant"
-            elif self.breastfeeding:
-                maternity = "breastfeeding"
-            else:
-                maternity = "none"
-            proteins = dct[min_age][sex][maternity]
-            return proteins
+            row = by_age_sex_maternity("data/proteins.csv")
+            return {i: amount * weight for i, amount in row.items()}
 
         kcal = kcal()
 
-        def energy_upper():
-            dct = {}
-            min_ages = []
-            kcal_to_gram = {}
-            with open("data/kcal_per_gram.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    kcal_to_gram[row["name"]] = str_to_float(row["kcal/g"])
-            with open("data/energy_dist_upper.csv") as csvfile:
-                data_headers = list(csv.reader(csvfile))[0]
-                data_headers.remove("min_age")
-            with open("data/energy_dist_upper.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row["min_age"] not in dct:
-                        dct[row["min_age"]] = {}
-                    dct[row["min_age"]] = {
-                        "Total Fat": (str_to_float(row["Total Fat"]) / 100)
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                        "n-6 linoleic acid": (
-                            str_to_float(row["n-6 linoleic acid"]) / 100
-                        )
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                        "n-3 a-linolenic Acid (ALA)": (
-                            str_to_float(row["n-3 a-linolenic Acid (ALA)"]) / 100
-                        )
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                        "Total Carbohydrates": (
-                            str_to_float(row["Total Carbohydrates"]) / 100
-                        )
-                        * kcal
-                        / kcal_to_gram["Total Carbohydrates"],
-                        "Total Protein": (str_to_float(row["Total Protein"]) / 100)
-                        * kcal
-                        / kcal_to_gram["Total Protein"],
-                        "LC-PUFAs": (str_to_float(row["LC-PUFAs"]) / 100)
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                    }
-                    if str_to_float(row["min_age"]) not in min_ages:
-                        min_ages.append(str_to_float(row["min_age"]))
-            min_age = float_to_str(max(age for age in min_ages if age < self.age))
-
-            energy_upper = dct[min_age]
-            return energy_upper
-
-        def energy_lower():
-            dct = {}
-            min_ages = []
-            kcal_to_gram = {}
-            with open("data/kcal_per_gram.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    kcal_to_gram[row["name"]] = str_to_float(row["kcal/g"])
-            with open("data/energy_dist_lower.csv") as csvfile:
-                data_headers = list(csv.reader(csvfile))[0]
-                data_headers.remove("min_age")
-            with open("data/energy_dist_lower.csv") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if row["min_age"] not in dct:
-                        dct[row["min_age"]] = {}
-                    dct[row["min_age"]] = {
-                        "Total Fat": (str_to_float(row["Total Fat"]) / 100)
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                        "n-6 linoleic acid": (
-                            str_to_float(row["n-6 linoleic acid"]) / 100
-                        )
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                        "n-3 a-linolenic Acid (ALA)": (
-                            str_to_float(row["n-3 a-linolenic Acid (ALA)"]) / 100
-                        )
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                        "Total Carbohydrates": (
-                            str_to_float(row["Total Carbohydrates"]) / 100
-                        )
-                        * kcal
-                        / kcal_to_gram["Total Carbohydrates"],
-                        "Total Protein": (str_to_float(row["Total Protein"]) / 100)
-                        * kcal
-                        / kcal_to_gram["Total Protein"],
-                        "LC-PUFAs": (str_to_float(row["LC-PUFAs"]) / 100)
-                        * kcal
-                        / kcal_to_gram["Total Fat"],
-                    }
-                    if str_to_float(row["min_age"]) not in min_ages:
-                        min_ages.append(str_to_float(row["min_age"]))
-            min_age = float_to_str(max(age for age in min_ages if age < self.age))
-
-            energy_lower = dct[min_age]
-            return energy_lower
+        def energy_dist(path):
+            kcal_to_gram = {
+                name: row["kcal/g"]
+                for (name,), row in reference_table("data/kcal_per_gram.csv", ["name"])[0].items()
+            }
+            rows, bands = reference_table(path, ["min_age"])
+            row = rows[(band(bands["min_age"], self.age),)]
+            return {
+                i: (row[i] / 100) * kcal / kcal_to_gram[source]
+                for i, source in ENERGY_SOURCES.items()
+            }
 
         dct = {}
-        rda = rda()
-        tul = tul()
+        rda = by_age_sex_maternity("data/rda.csv")
+        tul = by_age_sex_maternity("data/tul.csv")
         proteins = proteins()
-        energy_lower = energy_lower()
-        energy_upper = energy_upper()
-
-        with open("data/nutrient_keys.tsv") as tsvfile:
-            reader = csv.DictReader(tsvfile, dialect="excel-tab")
-            for row in reader:
-                if row["name"] not in dct:
-                    dct[row["name"]] = {}
-                dct[row["name"]]["unit"] = row["unit"]
-                dct[row["name"]]["nutrient_nbr"] = json.loads(row["nutrient_nbr"])
-                dct[row["name"]]["nutrient_id"] = json.loads(row["nutrient_id"])
-                dct[row["name"]]["amount_lower"] = None
-                dct[row["name"]]["amount_upper"] = None
-                dct[row["name"]]["amount_tul"] = None
-                if row["name"] in rda:
-                    dct[row["name"]]["amount_lower"] = rda[row["name"]]
-                    dct[row["name"]]["amount_upper"] = rda[row["name"]]
-                if row["name"] in tul:
-                    dct[row["name"]]["amount_tul"] = tul[row["name"]]
-                if row["name"] in proteins:
-                    dct[row["name"]]["amount_lower"] = proteins[row["name"]]
-                    dct[row["name"]]["amount_upper"] = proteins[row["name"]]
+        energy_lower = energy_dist("data/energy_dist_lower.csv")
+        energy_upper = energy_dist("data/energy_dist_upper.csv")
+
+        for name, keys in nutrient_keys().items():
+            dct[name] = {
+                "unit": keys["unit"],
+                "nutrient_nbr": list(keys["nutrient_nbr"]),
+                "nutrient_id": list(keys["nutrient_id"]),
+                "amount_lower": None,
+                "amount_upper": None,
+                "amount_tul": None,
+            }
+            if name in rda:
+                dct[name]["amount_lower"] = rda[name]
+                dct[name]["amount_upper"] = rda[name]
+            if name in tul:
+                dct[name]["amount_tul"] = tul[name]
+            if name in proteins:
+                dct[name]["amount_lower"] = proteins[name]
+                dct[name]["amount_upper"] = proteins[name]
 
         dct["Energy"]["amount_lower"] = kcal
         dct["Energy"]["amount_upper"] = kcal
@@ -630,6 +729,103 @@ class Person:
         
         return dct
 
+    def on(self, day, due_date=None, breastfeeding=None):
+        """
+        Returns a copy of the person as they will be (or were) on a day, optionally with another due_date (a date) and breastfeeding stage.
+        The person's values are copied as they are, without the setters, which check dates against today and names against the user store.
+        """
+        person = Person.__new__(Person)
+        for field in Person.__slots__:
+            object.__setattr__(person, field, getattr(self, field))
+        object.__setattr__(person, "_due_date", due_date or None)
+        object.__setattr__(person, "_breastfeeding", breastfeeding)
+        object.__setattr__(person, "_requirements", None)
+        object.__setattr__(person, "_inputs_version", 0)
+        object.__setattr__(person, "_as_of", day)
+        return person
+
+    def requirement_timeline(self, start, end, breastfeed_after_birth=False):
+        """
+        Returns the person's requirements from start to end (dates, end excluded) as a list of segments,
+        each a dictionary with its start, end (excluded) and diet_rqmts, with diet_rqmts computed once per segment.
+        Segments change when the person enters a new age band of the reference tables, turns a year older,
+        or, while pregnant, at each week of gestation (so trimesters too) and at the due date,
+        after which they are breastfeeding (first 6 months, then after) if breastfeed_after_birth.
+        Before the pregnancy, and without a due date, they are breastfeeding or not as they are now.
+        Energy, and the macronutrient ranges derived from it, also vary slightly with age between birthdays;
+        each segment has the values of its first day.
+        """
+        if end <= start:
+            raise ValueError("Provide an end date after the start date")
+        dob = date.fromisoformat(self.dob)
+        changes = set()
+        bounds = set()
+        for path, key_columns in REQUIREMENT_TABLES.items():
+            if "min_age" in key_columns:
+                bounds.update(reference_table(path, key_columns)[1]["min_age"])
+        # Age is above a band's lower bound from the day after it's reached
+        for bound in bounds:
+            changes.add(dob + timedelta(days=floor(bound * 365) + 1))
+        for year in range(1, (end - dob).days // 365 + 1):
+            changes.add(dob + timedelta(days=365 * year))
+        due_date = self.due_date
+        if due_date:
+            # Gestation goes up a week every 7 days before the due date
+            day = due_date - timedelta(days=280)
+            while day <= due_date:
+                changes.add(day)
+                day += timedelta(days=7)
+            changes.add(due_date + timedelta(days=1))
+            if breastfeed_after_birth:
+                changes.add(due_date + timedelta(days=1 + 183))
+        segments = []
+        for segment_start, segment_end in zip(
+            [start] + sorted(day for day in changes if start < day < end),
+            sorted(day for day in changes if start < day < end) + [end],
+        ):
+            if not due_date or segment_start < due_date - timedelta(days=280):
+                # Not pregnant (yet): as they are now
+                person = self.on(segment_start, breastfeeding=self.breastfeeding)
+            elif segment_start <= due_date:
+                person = self.on(segment_start, due_date=due_date)
+            elif breastfeed_after_birth:
+                stage = 1 if segment_start <= due_date + timedelta(days=183) else 2
+                person = self.on(segment_start, breastfeeding=stage)
+            else:
+                person = self.on(segment_start)
+            diet_rqmts = person.compute_diet_rqmts()
+            if segments and segments[-1]["diet_rqmts"] == diet_rqmts:
+                segments[-1]["end"] = segment_end
+            else:
+                segments.append({"start": segment_start, "end": segment_end, "diet_rqmts": diet_rqmts})
+        return segments
+
+    @classmethod
+    def from_dict(cls, dct):
+        """
+        Creates a person from a dictionary (e.g. parsed JSON) with the same keys as the __init__ arguments.
+        Numbers are accepted as well as strings.
+        """
+
+        def text(value):
+            return None if value is None else str(value)
+
+        try:
+            return cls(
+                text(dct["name"]),
+                text(dct["dob"]),
+                text(dct["sex"]),
+                text(dct["height"]),
+                text(dct["weight"]),
+                text(dct.get("due_date")),
+                dct.get("breastfeeding"),
+                text(dct.get("pal")),
+                dct.get("desired_weight"),
+                dct.get("desired_bmi"),
+            )
+        except KeyError as key:
+            raise ValueError(f"Must provide the person's {key.args[0]}")
+
     @classmethod
     def get(cls):
         due_date = None
@@ -692,3 +888,164 @@ class Person:
             desired_weight,
             desired_bmi,
         )
+
+
+# Columns read by PersonBatch, in the order of the Person arguments
+PERSON_FIELDS = [
+    "name",
+    "dob",
+    "sex",
+    "height",
+    "weight",
+    "due_date",
+    "breastfeeding",
+    "pal",
+    "desired_weight",
+    "desired_bmi",
+]
+SEXES = {"m": "male", "male": "male", "f": "female", "female": "female"}
+PALS = {
+    "1": "Inactive",
+    "inactive": "Inactive",
+    "2": "Low active",
+    "low active": "Low active",
+    "3": "Active",
+    "active": "Active",
+    "4": "Very active",
+    "very active": "Very active",
+}
+
+
+class PersonBatch:
+    """
+    Persons held as the typed columns of a dataframe (see PERSON_FIELDS) rather than as Person objects,
+    with a 'row' column giving each person's row in the file or dataframe they were loaded from.
+    Load them with from_file or from_frame, which validate all rows at once, and get Person objects with person() or by iterating.
+    """
+
+    __slots__ = ["persons"]
+
+    def __init__(self, persons):
+        self.persons = persons
+
+    def __len__(self):
+        return self.persons.height
+
+    def __iter__(self):
+        for i in range(self.persons.height):
+            yield self.person(i)
+
+    def person(self, i):
+        """
+        Returns the i-th person of the batch as a Person.
+        """
+        row = self.persons.row(i, named=True)
+        return Person(
+            row["name"],
+            row["dob"].isoformat(),
+            row["sex"],
+            str(row["height"]),
+            str(row["weight"]),
+            row["due_date"].isoformat() if row["due_date"] else None,
+            row["breastfeeding"],
+            row["pal"],
+            row["desired_weight"],
+            row["desired_bmi"],
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Loads persons from a parquet or csv file with PERSON_FIELDS columns (due_date onwards are optional).
+        Returns (batch, errors), see from_frame.
+        """
+        if path.endswith(".parquet"):
+            df = pl.read_parquet(path)
+        elif path.endswith(".csv"):
+            # Read every column as text, so values are validated the same way whatever their type
+            df = pl.read_csv(path, infer_schema_length=0)
+        else:
+            raise ValueError("Provide a .parquet or .csv file of persons")
+        return cls.from_frame(df)
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Validates and normalises persons from a dataframe with PERSON_FIELDS columns, applying the same rules as the Person setters to whole columns.
+        Returns (batch, errors): a PersonBatch of the valid rows, and a dataframe of the problems found in the others,
+        with one row for each problem giving the person's row, the field and the error message.
+        """
+        missing = [field for field in PERSON_FIELDS[:5] + ["pal"] if field not in df.columns]
+        if missing:
+            raise ValueError(f"Must provide columns: {', '.join(missing)}")
+        today = date.today()
+        text = df.with_row_count("row").select(
+            pl.col("row"),
+            *[
+                (pl.col(field).cast(pl.Utf8).str.strip() if field in df.columns else pl.lit(None, pl.Utf8)).alias(field)
+                for field in PERSON_FIELDS
+            ],
+        )
+        parsed = text.select(
+            pl.col("row"),
+            normalise_names(pl.col("name")),
+            parse_dates(pl.col("dob")),
+            pl.col("sex").str.to_lowercase().map_dict(SEXES),
+            pl.col("height").str.replace_all(r"[^0-9.]", "").cast(pl.Float64, strict=False),
+            pl.col("weight").str.replace_all(r"[^0-9.]", "").cast(pl.Float64, strict=False),
+            parse_dates(pl.col("due_date")),
+            pl.col("breastfeeding").cast(pl.Float64, strict=False).cast(pl.Int64, strict=False),
+            pl.col("pal").str.to_lowercase().map_dict(PALS),
+            pl.col("desired_weight").cast(pl.Float64, strict=False),
+            pl.col("desired_bmi").cast(pl.Float64, strict=False),
+        )
+        given = {field: pl.col(field).is_not_null() & (pl.col(field) != "") for field in PERSON_FIELDS}
+        checks = [
+            ("name", ~given["name"], "Must provide the person's username."),
+            ("dob", ~given["dob"], "Must provide a date of birth"),
+            ("dob", given["dob"] & pl.col("dob_parsed").is_null(), "Must provide date of birth in the isoformat: yyyy-mm-dd"),
+            ("dob", pl.col("dob_parsed") > today, "Must provide a date from the past"),
+            ("sex", ~given["sex"], "Must provide the person's sex."),
+            ("sex", given["sex"] & pl.col("sex_parsed").is_null(), "Provide 'm', 'male', 'f', or 'female'"),
+            ("height", pl.col("height_parsed").is_null(), "Provide a number for height in cm"),
+            ("height", pl.col("height_parsed") <= 0, "Provide a number greater than 0 for height in cm"),
+            ("weight", pl.col("weight_parsed").is_null(), "Provide a number for weight in kg"),
+            ("weight", pl.col("weight_parsed") <= 0, "Provide a number greater than 0 for weight in kg"),
+            ("due_date", given["due_date"] & pl.col("due_date_parsed").is_null(), "Must provide due date in the isoformat: yyyy-mm-dd"),
+            (
+                "breastfeeding",
+                given["breastfeeding"] & (pl.col("breastfeeding") != "0") & ~pl.col("breastfeeding_parsed").is_in([1, 2]),
+                "Use 1 to indicate breastfeeding within 1st 6 months, use 2 to indicate breastfeeding after.",
+            ),
+            ("pal", ~given["pal"], "Must provide the person's physical activity level."),
+            (
+                "pal",
+                given["pal"] & pl.col("pal_parsed").is_null(),
+                "Provide activity level as number (1 to 4) or text. e.g. 1, or 'Inactive'.",
+            ),
+            ("desired_weight", given["desired_weight"] & pl.col("desired_weight_parsed").is_null(), "Provide a number for desired weight in kg"),
+            ("desired_bmi", given["desired_bmi"] & pl.col("desired_bmi_parsed").is_null(), "Provide a number for desired BMI"),
+        ]
+        both = pl.concat(
+            [text, parsed.drop("row").select(pl.all().map_alias(lambda field: field + "_parsed"))], how="horizontal"
+        )
+        errors = pl.concat(
+            [
+                both.filter(check.fill_null(False)).select(
+                    pl.col("row"), pl.lit(i).alias("check"), pl.lit(field).alias("field"), pl.lit(error).alias("error")
+                )
+                for i, (field, check, error) in enumerate(checks)
+            ]
+        ).sort(["row", "check"]).drop("check")
+        persons = (
+            parsed.join(errors.select("row").unique(), on="row", how="anti")
+            .with_columns(
+                pl.col("sex").cast(pl.Categorical),
+                # As with Person, a due date in the past means the person isn't pregnant any more
+                pl.when(pl.col("due_date") >= today).then(pl.col("due_date")).otherwise(None).alias("due_date"),
+                pl.when(pl.col("breastfeeding").is_in([1, 2])).then(pl.col("breastfeeding")).otherwise(None).cast(pl.UInt8),
+                pl.col("pal").cast(pl.Categorical),
+            )
+        )
+        return cls(persons), errors
+
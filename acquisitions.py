@@ -1,22 +1,20 @@
 import sys
 import os
 import shutil
-import urllib.request
-from zipfile import ZipFile
+from math import ceil
 import polars as pl
-import pandas as pd
-import requests
 import json
-from rapidfuzz import fuzz, distance, process, utils
 import re
 import time
 from datetime import timedelta
+import Persons
 
 
-def main():
+def main(memory_budget=None):
     # extract_us_energy_dist()
     # extract_us_nutrient_reqs()
-    extract_us_food_nutrients()
+    extract_us_food_nutrients(memory_budget)
+    extract_requirements_bundle()
     ...
 
 
@@ -38,11 +36,63 @@ def time_it(func):
 
 
 
-def extract_us_food_nutrients():
+# Downloaded FoodData Central datasets, extracted into data/sources
+SURVEY_SOURCE = "data/sources/FoodData_Central_survey_food_csv_2022-10-28"
+LEGACY_SOURCE = "data/sources/FoodData_Central_sr_legacy_food_csv_2018-04"
+# Estimated bytes of memory used per food_nutrient.csv row while a partition of them is joined, mapped, grouped and pivoted
+PARTITION_ROW_BYTES = 400
+# Estimated bytes of memory used per food and nutrient amount while the food tables are unpivoted and sorted (rankings, sparse tables)
+AMOUNT_BYTES = 100
+
+
+def extract_us_food_nutrients(memory_budget=None):
+    """
+    Downloads the FoodData Central datasets and creates the food tables from them.
+    Give memory_budget (bytes) to create them out of core within about that much memory (see create_food_tables).
+    """
     # Create filepath if it does not exist
     if not os.path.exists("data/sources"):
         os.makedirs("data/sources")
-    # Download food data files
+    download_fdc_sources()
+    create_food_tables(memory_budget)
+    # Remove downloaded files
+    shutil.rmtree(SURVEY_SOURCE + "/")
+    shutil.rmtree(LEGACY_SOURCE + "/")
+
+
+def create_food_tables(memory_budget=None, survey_source=SURVEY_SOURCE, legacy_source=LEGACY_SOURCE):
+    """
+    Creates the food tables in data/sources from the extracted survey and legacy datasets.
+    Without memory_budget, the tables are transformed in memory; with it (bytes), they are transformed out of core
+    (see transform_us_food_nutrients_partitioned) and the tables derived from them are created a batch of nutrients or foods at a time.
+    Both create the same files, up to the rounding of sums of amounts.
+    """
+    if memory_budget:
+        transform_us_food_nutrients_partitioned(memory_budget, survey_source, legacy_source)
+    else:
+        food_list, merged_food_df, merged_food_df_cal = transform_us_food_nutrients(survey_source, legacy_source)
+        # Export food list (food_id to description) and dataframes to parquet files
+        food_list.write_parquet("data/sources/food_list.parquet")
+        merged_food_df.write_parquet("data/sources/food_nutrients.parquet", statistics=True)
+        merged_food_df_cal.write_parquet(
+            "data/sources/food_nutrients_cal.parquet", statistics=True
+        )
+    # Precompute per nutrient rankings for "best source of" queries
+    extract_food_rankings(memory_budget=memory_budget)
+    # Create sparse copy of the nutrient tables
+    extract_food_nutrients_sparse(memory_budget=memory_budget)
+    # Create memory mappable snapshots of the food tables
+    extract_food_snapshots()
+
+
+def download_fdc_sources():
+    """
+    Downloads the survey and legacy FoodData Central datasets and extracts them into data/sources.
+    """
+    # Downloading libraries are imported here, so importing this module (e.g. for extract_requirements_bundle) stays fast
+    import urllib.request
+    from zipfile import ZipFile
+
     urllib.request.urlretrieve(
         "https://fdc.nal.usda.gov/fdc-datasets/FoodData_Central_survey_food_csv_2022-10-28.zip",
         "data/sources/FoodData_Central_survey_food_csv.zip",
@@ -59,13 +109,17 @@ def extract_us_food_nutrients():
         archive.extractall("data/sources")
     os.remove("data/sources/FoodData_Central_legacy_food_csv.zip")
 
+
+def transform_us_food_nutrients(survey_source=SURVEY_SOURCE, legacy_source=LEGACY_SOURCE):
+    """
+    Returns (food_list, food_nutrients, food_nutrients_cal) from the extracted survey and legacy datasets (folders with FDC's CSV files).
+    Runs the stages below, which can also be run on their own (e.g. to benchmark them).
+    """
+    from rapidfuzz import fuzz
+
     # Read survey food (current) and legacy (more detailed) food data from downloaded files
-    survey_food = pl.read_csv(
-        "data/sources/FoodData_Central_survey_food_csv_2022-10-28/food.csv"
-    ).select(pl.col("fdc_id"), pl.col("description"))
-    legacy_food = pl.read_csv(
-        "data/sources/FoodData_Central_sr_legacy_food_csv_2018-04/food.csv"
-    ).select(pl.col("fdc_id"), pl.col("description"))
+    survey_food = read_foods(survey_source)
+    legacy_food = read_foods(legacy_source)
     # Use fuzzy matching to find overlapping entries between the 2 datasets
     matched_food = fuzzy_match(
         survey_food["description"],
@@ -73,98 +127,280 @@ def extract_us_food_nutrients():
         scorer=fuzz.token_sort_ratio,
         score_cutoff=90,
     )
-    # Replace entries in legacy food with matched survey_food entry and remove any resulting duplicates
-    legacy_food = legacy_food.with_columns(
-        pl.col("description").map_dict(matched_food, default=pl.first())
-    ).unique(subset="description")
-    # Survey food data
-    # Read the nutrient list used in the survey food dataset
-    survey_nutrient = (
-        pl.read_csv(
-            "data/sources/FoodData_Central_survey_food_csv_2022-10-28/nutrient.csv"
-        )
-        .select(pl.col("nutrient_nbr"), pl.col("name"))
-        .rename({"nutrient_nbr": "nutrient_id"})
+    survey_food, legacy_food, food_list = assign_food_ids(survey_food, legacy_food, matched_food)
+    survey_food_df = nutrient_amounts(survey_food, *read_nutrients(survey_source, "nutrient_nbr"))
+    legacy_food_df = nutrient_amounts(legacy_food, *read_nutrients(legacy_source, "nutrient_id"))
+    merged_food_df = merge_food_nutrients(survey_food_df, legacy_food_df)
+    food_list = food_list.join(merged_food_df.select(pl.col("food_id")), on="food_id").sort("food_id")
+    return food_list, merged_food_df, per_kcal(merged_food_df)
+
+
+def transform_us_food_nutrients_partitioned(
+    memory_budget,
+    survey_source=SURVEY_SOURCE,
+    legacy_source=LEGACY_SOURCE,
+    out_dir="data/sources",
+    work_dir="data/sources/partitions",
+    workers=None,
+):
+    """
+    Out of core version of transform_us_food_nutrients, for datasets whose food_nutrient.csv doesn't fit in memory (e.g. FDC Branded foods).
+    Writes the tables transform_us_food_nutrients returns to food_list.parquet, food_nutrients.parquet and food_nutrients_cal.parquet in out_dir,
+    keeping its working set within about memory_budget bytes (estimated with PARTITION_ROW_BYTES):
+    - foods are split into partitions of consecutive food_ids, with enough partitions for a partition to be processed within the budget;
+    - food_nutrient.csv rows are read in blocks and split by the partition of their food into parquet files under work_dir;
+    - each partition is joined, mapped to the nutrient keys, grouped and pivoted on its own, by up to workers threads at once
+      (as many as the largest partition fits in the budget, and CPUs, by default), its result written to work_dir;
+    - the partitions' results, each sorted by food_id, are streamed in order into the output files.
+    Foods (food.csv) are matched in memory, as in transform_us_food_nutrients. work_dir is removed once done.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from rapidfuzz import fuzz
+
+    survey_food = read_foods(survey_source)
+    legacy_food = read_foods(legacy_source)
+    matched_food = fuzzy_match(
+        survey_food["description"],
+        legacy_food["description"],
+        scorer=fuzz.token_sort_ratio,
+        score_cutoff=90,
     )
-    # Read the nutrient keys file used by the script to map nutrients in the survey food data
-    survey_nutrient_keys = (
-        pl.read_csv("data/nutrient_keys.tsv", separator="\t")
-        .select(pl.col("name"), pl.col("nutrient_nbr"))
-        .rename({"name": "new_name", "nutrient_nbr": "nutrient_id"})
+    survey_food, legacy_food, food_list = assign_food_ids(survey_food, legacy_food, matched_food)
+    sources = [("survey", survey_source, "nutrient_nbr"), ("legacy", legacy_source, "nutrient_id")]
+    rows = sum(estimate_rows(f"{source}/food_nutrient.csv") for _, source, _ in sources)
+    partitions = max(1, ceil(rows * PARTITION_ROW_BYTES / memory_budget))
+    # Blocks of the CSV files are read as text, parsed, joined to their food_ids and split, taking a few times their size in memory
+    block_size = int(max(1 << 16, memory_budget // 8))
+    shutil.rmtree(work_dir, ignore_errors=True)
+    partition_rows = [0] * partitions
+    # Partitions hold consecutive food_ids, so their results are sorted once concatenated in order
+    food_partitions = (
+        food_list.select(pl.col("food_id"))
+        .sort("food_id")
+        .with_row_count("partition")
+        .with_columns((pl.col("partition").cast(pl.Int64) * partitions // max(food_list.height, 1)).alias("partition"))
     )
-    survey_nutrient_keys = survey_nutrient_keys.with_columns(
-        pl.col("nutrient_id").apply(lambda s: json.loads(s))
-    ).explode("nutrient_id")
-    # Read food to nutrient mapping for survey foods
-    survey_food_nutrient = (
-        pl.read_csv(
-            "data/sources/FoodData_Central_survey_food_csv_2022-10-28/food_nutrient.csv"
-        )
-        .select(pl.col("fdc_id"), pl.col("nutrient_id"), pl.col("amount"))
-        .with_columns(pl.col("nutrient_id").cast(pl.Float64))
+    datasets = [
+        (name, source, key, food.join(food_partitions, on="food_id"))
+        for (name, source, key), food in zip(sources, [survey_food, legacy_food])
+    ]
+
+    # Split each dataset's food_nutrient rows by the partition of their food
+    for name, source, key, food in datasets:
+        for number, batch in enumerate(read_csv_blocks(f"{source}/food_nutrient.csv", block_size, ["fdc_id", "nutrient_id", "amount"])):
+            # Types are cast, as each block's types are inferred from its own rows
+            batch = batch.with_columns(
+                pl.col("fdc_id").cast(pl.Int64), pl.col("nutrient_id").cast(pl.Int64), pl.col("amount").cast(pl.Float64)
+            )
+            batch = food_nutrient_columns(batch, key).join(food.select(pl.col("fdc_id"), pl.col("partition")), on="fdc_id")
+            for partition, part in batch.partition_by("partition", as_dict=True).items():
+                os.makedirs(f"{work_dir}/{name}/{partition}", exist_ok=True)
+                part.drop("partition").write_parquet(f"{work_dir}/{name}/{partition}/{number}.parquet")
+                partition_rows[partition] += part.height
+
+    nutrient_keys = {name: read_nutrient_keys(source, key) for name, source, key, _ in datasets}
+    os.makedirs(f"{work_dir}/food_nutrients")
+
+    def transform(partition):
+        amounts = []
+        for name, _, key, food in datasets:
+            path = f"{work_dir}/{name}/{partition}"
+            if os.path.exists(path):
+                food_nutrient = pl.read_parquet(f"{path}/*.parquet")
+            else:
+                food_nutrient = pl.DataFrame(
+                    schema={"fdc_id": pl.Int64, "nutrient_id": pl.Float64 if key == "nutrient_nbr" else pl.Int64, "amount": pl.Float64}
+                )
+            food = food.filter(pl.col("partition") == partition)
+            amounts.append(nutrient_amounts(food, food_nutrient, *nutrient_keys[name]))
+            shutil.rmtree(path, ignore_errors=True)
+        merge_food_nutrients(*amounts).write_parquet(f"{work_dir}/food_nutrients/{partition}.parquet")
+
+    used = [partition for partition in range(partitions) if partition_rows[partition]]
+    if workers is None:
+        largest = max([partition_rows[partition] for partition in used], default=0) * PARTITION_ROW_BYTES
+        workers = max(1, min(os.cpu_count() or 1, memory_budget // max(largest, 1)))
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(transform, used))
+
+    # Stream the partitions' results into one table, with the nutrients any of them has data for in the order of nutrient_keys.tsv
+    paths = [f"{work_dir}/food_nutrients/{partition}.parquet" for partition in used]
+    columns = {path: pl.scan_parquet(path).columns for path in paths}
+    nutrients = [nutrient for nutrient in nutrient_order() if any(nutrient in columns[path] for path in paths)]
+    food_nutrients_path = f"{out_dir}/food_nutrients.parquet"
+    if paths:
+        pl.concat(
+            [
+                pl.scan_parquet(path).select(
+                    [pl.col("food_id")]
+                    + [
+                        pl.col(nutrient) if nutrient in columns[path] else pl.lit(None, pl.Float64).alias(nutrient)
+                        for nutrient in nutrients
+                    ]
+                )
+                for path in paths
+            ]
+        ).sink_parquet(food_nutrients_path, statistics=True)
+    else:
+        pl.DataFrame(schema={"food_id": pl.Int64}).write_parquet(food_nutrients_path, statistics=True)
+    per_kcal(pl.scan_parquet(food_nutrients_path)).sink_parquet(f"{out_dir}/food_nutrients_cal.parquet", statistics=True)
+    shutil.rmtree(work_dir)
+    food_ids = pl.scan_parquet(food_nutrients_path).select(pl.col("food_id")).collect()
+    food_list.join(food_ids, on="food_id").sort("food_id").write_parquet(f"{out_dir}/food_list.parquet")
+
+
+def read_csv_blocks(path, block_size, columns=None):
+    """
+    Yields the rows of a CSV file as DataFrames, parsing about block_size bytes of it at a time so only one block is in memory.
+    Rows must not contain line breaks (true of FDC's food_nutrient.csv).
+    """
+    with open(path, "rb") as file:
+        header = file.readline()
+        rest = b""
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            # Parse whole lines, keeping the last incomplete line for the next block
+            block = rest + block
+            end = block.rfind(b"\n") + 1
+            rest = block[end:]
+            if end:
+                yield pl.read_csv(header + block[:end], columns=columns)
+        if rest.strip():
+            yield pl.read_csv(header + rest, columns=columns)
+
+
+def estimate_rows(path, sample_size=1 << 16):
+    """
+    Returns an estimate of the number of lines of a file, from the length of the lines at its start.
+    """
+    with open(path, "rb") as file:
+        sample = file.read(sample_size)
+    return ceil(os.path.getsize(path) * max(sample.count(b"\n"), 1) / max(len(sample), 1))
+
+
+def read_foods(source):
+    return pl.read_csv(f"{source}/food.csv").select(pl.col("fdc_id"), pl.col("description"))
+
+
+def assign_food_ids(survey_food, legacy_food, matched_food):
+    """
+    Returns (survey_food, legacy_food, food_list): the survey and legacy foods with a food_id column, and each food_id's description.
+    matched_food maps legacy descriptions to the survey descriptions they match (see fuzzy_match).
+    """
+    # Assign an integer food_id to each survey food description, using the lowest fdc_id with that description.
+    # Foods are joined, grouped and pivoted on food_id, with descriptions kept in food_list.parquet.
+    survey_food = survey_food.join(
+        survey_food.groupby("description").agg(pl.col("fdc_id").min().alias("food_id")),
+        on="description",
     )
-    # Create a combined dataframe for the survey food
-    survey_food_df = (
-        survey_food.join(survey_food_nutrient, on="fdc_id")
-        .join(survey_nutrient, on="nutrient_id")
-        .with_columns(pl.col("nutrient_id").cast(pl.Int64))
+    # Replace entries in legacy food with matched survey_food entry and remove any resulting duplicates
+    matched_food = pl.DataFrame(
+        {"description": list(matched_food.keys()), "matched": list(matched_food.values())},
+        schema={"description": pl.Utf8, "matched": pl.Utf8},
     )
-    # EDIT
-    survey_food_df = (
-        survey_food_df.join(survey_nutrient_keys, on="nutrient_id", how="outer")
-        .filter(pl.col("new_name").is_not_null())
-        .filter(pl.col("description").is_not_null())
-        .select(pl.col("description"), pl.col("amount"), pl.col("new_name"))
-        .rename({"description": "food", "new_name": "nutrient"})
-        .groupby(["food", "nutrient"])
-        .agg(pl.col("amount").sum())
+    legacy_food = (
+        legacy_food.join(matched_food, on="description", how="left")
+        .with_columns(pl.coalesce(pl.col("matched"), pl.col("description")).alias("description"))
+        .drop("matched")
+        .sort("fdc_id")
+        .unique(subset="description", keep="first", maintain_order=True)
     )
-
-    # Legacy food data
-    # Read the nutrient list used in the survey food dataset
-    legacy_nutrient = (
-        pl.read_csv(
-            "data/sources/FoodData_Central_sr_legacy_food_csv_2018-04/nutrient.csv"
+    # Legacy foods matching a survey food share its food_id, others use their own fdc_id
+    legacy_food = legacy_food.join(
+        survey_food.select(pl.col("description"), pl.col("food_id")).unique(
+            subset="description", keep="first", maintain_order=True
+        ),
+        on="description",
+        how="left",
+    ).with_columns(pl.coalesce(pl.col("food_id"), pl.col("fdc_id")).alias("food_id"))
+    food_list = (
+        pl.concat(
+            [
+                survey_food.select(pl.col("food_id"), pl.col("description")),
+                legacy_food.select(pl.col("food_id"), pl.col("description")),
+            ]
         )
-        .select(pl.col("id"), pl.col("name"))
-        .rename({"id": "nutrient_id"})
+        .unique(subset="food_id", keep="first", maintain_order=True)
+        .rename({"description": "food"})
     )
-    # Read the nutrient keys file used by the script to map nutrients in the legacy food data
-    legacy_nutrient_keys = (
+    return survey_food, legacy_food, food_list
+
+
+def read_nutrients(source, key):
+    """
+    Returns (food_nutrient, nutrient, nutrient_keys) of a dataset, each with a nutrient_id column to join on.
+    key is the column of nutrient_keys.tsv (and for the survey dataset of nutrient.csv) its food_nutrient.csv nutrient_ids refer to:
+    nutrient_nbr for the survey dataset, nutrient_id for the legacy dataset.
+    """
+    # Read food to nutrient mapping
+    food_nutrient = food_nutrient_columns(pl.read_csv(f"{source}/food_nutrient.csv"), key)
+    return (food_nutrient,) + read_nutrient_keys(source, key)
+
+
+def read_nutrient_keys(source, key):
+    """
+    Returns (nutrient, nutrient_keys) of a dataset (see read_nutrients).
+    """
+    # Read the nutrient list used in the dataset
+    nutrient = pl.read_csv(f"{source}/nutrient.csv")
+    if key == "nutrient_nbr":
+        nutrient = nutrient.select(pl.col("nutrient_nbr"), pl.col("name")).rename({"nutrient_nbr": "nutrient_id"})
+    else:
+        nutrient = nutrient.select(pl.col("id"), pl.col("name")).rename({"id": "nutrient_id"})
+    # Read the nutrient keys file used by the script to map nutrients in the dataset
+    nutrient_keys = (
         pl.read_csv("data/nutrient_keys.tsv", separator="\t")
-        .select(pl.col("name"), pl.col("nutrient_id"))
-        .rename({"name": "new_name"})
+        .select(pl.col("name"), pl.col(key))
+        .rename({"name": "new_name", key: "nutrient_id"})
     )
-    legacy_nutrient_keys = legacy_nutrient_keys.with_columns(
+    nutrient_keys = nutrient_keys.with_columns(
         pl.col("nutrient_id").apply(lambda s: json.loads(s))
     ).explode("nutrient_id")
-    # Read food to nutrient mapping for legacy foods
-    legacy_food_nutrient = (
-        pl.read_csv(
-            "data/sources/FoodData_Central_sr_legacy_food_csv_2018-04/food_nutrient.csv"
-        )
-        .select(pl.col("fdc_id"), pl.col("nutrient_id"), pl.col("amount"))
-        .with_columns(pl.col("nutrient_id"))
-    )
-    # Create a combined dataframe for the legacy food
-    legacy_food_df = (
-        legacy_food.join(legacy_food_nutrient, on="fdc_id")
-        .join(legacy_nutrient, on="nutrient_id")
-        .with_columns(pl.col("nutrient_id"))
-    )
+    return nutrient, nutrient_keys
 
-    legacy_food_df = (
-        legacy_food_df.join(legacy_nutrient_keys, on="nutrient_id", how="outer")
+
+def food_nutrient_columns(food_nutrient, key):
+    """
+    Returns the fdc_id, nutrient_id and amount columns of (part of) a dataset's food_nutrient.csv, ready to join with its nutrients.
+    """
+    food_nutrient = food_nutrient.select(pl.col("fdc_id"), pl.col("nutrient_id"), pl.col("amount"))
+    if key == "nutrient_nbr":
+        food_nutrient = food_nutrient.with_columns(pl.col("nutrient_id").cast(pl.Float64))
+    return food_nutrient
+
+
+def nutrient_amounts(food, food_nutrient, nutrient, nutrient_keys):
+    """
+    Returns the amount of each nutrient of nutrient_keys.tsv in each food of a dataset, as food_id, nutrient and amount columns.
+    """
+    # Create a combined dataframe for the dataset
+    food_df = (
+        food.select(pl.col("fdc_id"), pl.col("food_id"))
+        .join(food_nutrient, on="fdc_id")
+        .join(nutrient, on="nutrient_id")
+        .with_columns(pl.col("nutrient_id").cast(pl.Int64))
+    )
+    return (
+        food_df.join(nutrient_keys, on="nutrient_id", how="outer")
         .filter(pl.col("new_name").is_not_null())
-        .filter(pl.col("description").is_not_null())
-        .select(pl.col("description"), pl.col("amount"), pl.col("new_name"))
-        .rename({"description": "food", "new_name": "nutrient"})
-        .groupby(["food", "nutrient"])
+        .filter(pl.col("food_id").is_not_null())
+        .select(pl.col("food_id"), pl.col("amount"), pl.col("new_name"))
+        .rename({"new_name": "nutrient"})
+        .groupby(["food_id", "nutrient"])
         .agg(pl.col("amount").sum())
     )
+
+
+def merge_food_nutrients(survey_food_df, legacy_food_df):
+    """
+    Returns a table of foods (rows, by food_id) and nutrients (columns, in the order of nutrient_keys.tsv),
+    with survey amounts where there are any and legacy amounts otherwise.
+    """
     # Create a merged food dataframe from survey and legacy food data
     merged_food_df = survey_food_df.join(
-        legacy_food_df, on=["food", "nutrient"], how="outer", suffix="_legacy"
+        legacy_food_df, on=["food_id", "nutrient"], how="outer", suffix="_legacy"
     ).rename({"amount": "amount_survey"})
     merged_food_df = (
         merged_food_df.with_columns(
@@ -175,29 +411,209 @@ def extract_us_food_nutrients():
         )
         .drop("amount_survey", "amount_legacy")
         .pivot(
-            values="amount", index="food", columns="nutrient", aggregate_function=None
+            values="amount", index="food_id", columns="nutrient", aggregate_function=None
         )
+        .sort("food_id")
     )
-    # Create a per kcal table
-    # Create 0 kcal subset, cast this down to nutrients/g instead of nutrients/100g.
-    zero_cal = merged_food_df.filter(pl.col("Energy") == 0).with_columns(pl.exclude("food").truediv(100))
-    other_cal = merged_food_df.filter(pl.col("Energy") > 0).with_columns(pl.exclude("food").truediv(pl.col("Energy")))
-    merged_food_df_cal = pl.concat([other_cal, zero_cal])
-    # Export food list and dataframe to parquet files
-    merged_food_df.select("food").write_parquet("data/sources/food_list.parquet")
-    merged_food_df.write_parquet("data/sources/food_nutrients.parquet")
-    merged_food_df_cal.write_parquet("data/sources/food_nutrients_cal.parquet")
-    # Remove downloaded files
-    shutil.rmtree("data/sources/FoodData_Central_survey_food_csv_2022-10-28/")
-    shutil.rmtree("data/sources/FoodData_Central_sr_legacy_food_csv_2018-04/")
+    # The pivot's columns come in the order nutrients are first met, which varies between runs
+    return merged_food_df.select(["food_id"] + [nutrient for nutrient in nutrient_order() if nutrient in merged_food_df.columns])
+
+
+def nutrient_order():
+    """
+    Returns the nutrients of nutrient_keys.tsv in its order, which is the column order of the food tables.
+    """
+    return pl.read_csv("data/nutrient_keys.tsv", separator="\t")["name"].unique(maintain_order=True).to_list()
+
+
+def per_kcal(food_nutrients):
+    """
+    Returns the nutrient amounts per kcal, or per gram for 0 kcal foods, of the foods with an energy amount, in the order of food_nutrients.
+    food_nutrients can be a DataFrame, or a LazyFrame to stream it (e.g. from and to parquet files).
+    """
+    # Divide 0 kcal foods by 100, to nutrients/g instead of nutrients/100g
+    return food_nutrients.filter(pl.col("Energy") >= 0).with_columns(
+        pl.exclude("food_id").truediv(pl.when(pl.col("Energy") == 0).then(100.0).otherwise(pl.col("Energy")))
+    )
+
 
+def extract_food_rankings(block_size=1024, memory_budget=None):
+    """
+    Creates ranking and zone map files for each nutrient in food_nutrients_cal.parquet, so "best source of X per kcal" and threshold queries don't sort the whole table.
+    food_rankings.parquet holds, for each nutrient, the food_ids of the foods that contain it ordered from the highest to the lowest amount.
+    food_zone_maps.parquet holds the min and max amount of each nutrient for each block of block_size rows in food_nutrients_cal.parquet.
+    Give memory_budget (bytes) to read and rank only as many nutrients at a time as fit in it (estimated with AMOUNT_BYTES), rather than all at once.
+    """
+    path = "data/sources/food_nutrients_cal.parquet"
+    # Nutrients are ranked in name order, so the rankings of successive batches follow each other in the file
+    nutrients = sorted(pl.scan_parquet(path).columns[1:])
+    foods = pl.scan_parquet(path).select(pl.count()).collect().item()
+    per_batch = max(1, memory_budget // max(foods * AMOUNT_BYTES, 1)) if memory_budget else max(len(nutrients), 1)
+    parts = "data/sources/food_rankings.parts"
+    shutil.rmtree(parts, ignore_errors=True)
+    os.makedirs(parts)
+    zone_maps = []
+    for number, start in enumerate(range(0, max(len(nutrients), 1), per_batch)):
+        batch = nutrients[start : start + per_batch]
+        # Unpivot to one row per food and nutrient, dropping nutrients the food has no data for
+        food_nutrients_long = (
+            pl.scan_parquet(path, row_count_name="row")
+            .select(["row", "food_id"] + batch)
+            .collect()
+            .melt(
+                id_vars=["row", "food_id"],
+                value_vars=batch,
+                variable_name="nutrient",
+                value_name="amount",
+            )
+            .filter(pl.col("amount").is_not_null())
+        )
+        # Sort foods from highest to lowest amount within each nutrient (foods with equal amounts by food_id) and number them
+        food_nutrients_long.sort(["nutrient", "amount", "food_id"], descending=[False, True, False]).with_columns(
+            pl.col("row").cumcount().over("nutrient").alias("rank")
+        ).select(pl.col("nutrient"), pl.col("rank"), pl.col("food_id"), pl.col("amount")).write_parquet(
+            f"{parts}/{number}.parquet", row_group_size=block_size
+        )
+        # Min and max of each nutrient per block of rows, to skip blocks that can't match a threshold
+        zone_maps.append(
+            food_nutrients_long.with_columns((pl.col("row") // block_size).alias("block"))
+            .groupby(["nutrient", "block"])
+            .agg(
+                pl.col("row").min().alias("row_start"),
+                pl.col("row").max().alias("row_end"),
+                pl.col("amount").min().alias("amount_min"),
+                pl.col("amount").max().alias("amount_max"),
+                pl.col("amount").count().alias("count"),
+            )
+            .sort(["nutrient", "block"])
+        )
+    # Small row groups allow readers to skip straight to the requested nutrient using parquet statistics
+    concat_parquet([f"{parts}/{number}.parquet" for number in range(len(zone_maps))], "data/sources/food_rankings.parquet")
+    shutil.rmtree(parts)
+    pl.concat(zone_maps).write_parquet("data/sources/food_zone_maps.parquet", statistics=True)
+
+
+def concat_parquet(paths, path):
+    """
+    Streams parquet files with the same columns, in order, into one parquet file at path, with statistics.
+    The file's row groups follow those of the files streamed (polars' streaming sink doesn't split rows by row_group_size).
+    """
+    pl.concat([pl.scan_parquet(part) for part in paths]).sink_parquet(path, statistics=True)
+
+
+def extract_food_nutrients_sparse(memory_budget=None):
+    """
+    Creates a sparse (CSR-style) copy of food_nutrients.parquet and food_nutrients_cal.parquet, holding only the nutrients each food has data for.
+    food_nutrients_sparse.parquet: food_id, nutrient_id, amount (per 100g) and amount_cal (per kcal, or per g for 0 kcal foods), sorted by food_id then nutrient_id.
+    food_offsets.parquet: food_id, and the offset and length of the food's rows in food_nutrients_sparse.parquet (descriptions are in food_list.parquet).
+    nutrient_dictionary.parquet: nutrient_id, nutrient and position, in the column order of food_nutrients.parquet (see sparse_nutrient_ids).
+    Give memory_budget (bytes) to read and unpivot only as many foods at a time as fit in it (estimated with AMOUNT_BYTES), rather than all at once.
+    """
+    path = "data/sources/food_nutrients.parquet"
+    nutrients = pl.scan_parquet(path).columns[1:]
+    nutrient_dictionary = sparse_nutrient_ids(nutrients)
+    food_ids = pl.scan_parquet(path).select(pl.col("food_id")).collect()["food_id"]
+    per_batch = max(1, memory_budget // max(len(nutrients) * AMOUNT_BYTES, 1)) if memory_budget else max(len(food_ids), 1)
+    parts = "data/sources/food_nutrients_sparse.parts"
+    shutil.rmtree(parts, ignore_errors=True)
+    os.makedirs(parts)
+    lengths = []
+    for number, start in enumerate(range(0, max(len(food_ids), 1), per_batch)):
+        # Foods are sorted by food_id, so a batch is a range of food_ids, read skipping the other row groups using parquet statistics
+        food_nutrients = pl.scan_parquet(path)
+        if len(food_ids):
+            food_nutrients = food_nutrients.filter(
+                pl.col("food_id").is_between(food_ids[start], food_ids[min(start + per_batch, len(food_ids)) - 1])
+            )
+        food_nutrients = food_nutrients.collect()
+        # Unpivot to one row per food and nutrient, dropping nutrients the food has no data for
+        food_nutrients_sparse = (
+            food_nutrients.melt(
+                id_vars=["food_id"],
+                value_vars=nutrients,
+                variable_name="nutrient",
+                value_name="amount",
+            )
+            .filter(pl.col("amount").is_not_null())
+            .join(nutrient_dictionary.select(pl.col("nutrient_id"), pl.col("nutrient")), on="nutrient")
+            .join(food_nutrients.select(pl.col("food_id"), pl.col("Energy")), on="food_id", how="left")
+        )
+        # Amounts per kcal, or per gram for 0 kcal foods (as in food_nutrients_cal.parquet)
+        food_nutrients_sparse = (
+            food_nutrients_sparse.with_columns(
+                pl.when(pl.col("Energy") > 0)
+                .then(pl.col("amount") / pl.col("Energy"))
+                .when(pl.col("Energy") == 0)
+                .then(pl.col("amount") / 100)
+                .otherwise(None)
+                .alias("amount_cal")
+            )
+            .select(pl.col("food_id"), pl.col("nutrient_id"), pl.col("amount"), pl.col("amount_cal"))
+            .sort(["food_id", "nutrient_id"])
+        )
+        food_nutrients_sparse.write_parquet(f"{parts}/{number}.parquet", row_group_size=65536)
+        lengths.append(food_nutrients_sparse.groupby("food_id").agg(pl.count().alias("length")))
+    # Row offsets of each food in the sparse table
+    food_offsets = (
+        food_ids.to_frame()
+        .join(pl.concat(lengths), on="food_id", how="left")
+        .with_columns(pl.col("length").fill_null(0).cast(pl.UInt32))
+        .with_columns((pl.col("length").cumsum() - pl.col("length")).alias("offset"))
+        .select(pl.col("food_id"), pl.col("offset"), pl.col("length"))
+    )
+    concat_parquet([f"{parts}/{number}.parquet" for number in range(len(lengths))], "data/sources/food_nutrients_sparse.parquet")
+    shutil.rmtree(parts)
+    food_offsets.write_parquet("data/sources/food_offsets.parquet")
+    nutrient_dictionary.write_parquet("data/sources/nutrient_dictionary.parquet")
 
-def fuzzy_match(list1, list2, scorer=fuzz.ratio, score_cutoff=90):
+
+def sparse_nutrient_ids(nutrients, path="data/sources/nutrient_dictionary.parquet"):
+    """
+    Returns the nutrient dictionary of the sparse files: nutrient_id, nutrient and position (the nutrient's column in food_nutrients.parquet, after food_id).
+    nutrient_ids are kept from the dictionary at path, so an id names the same nutrient across rebuilds even when nutrients are added, dropped or reordered.
+    New nutrients get ids after the largest one used, and nutrients no longer in the table keep theirs (with a null position), so ids are never reused.
+    """
+    ids = {}
+    if os.path.exists(path):
+        previous = pl.read_parquet(path)
+        ids = dict(zip(previous["nutrient"], previous["nutrient_id"]))
+    next_id = max(ids.values(), default=-1) + 1
+    for nutrient in nutrients:
+        if nutrient not in ids:
+            ids[nutrient] = next_id
+            next_id += 1
+    positions = {nutrient: position for position, nutrient in enumerate(nutrients)}
+    return pl.DataFrame(
+        {"nutrient_id": list(ids.values()), "nutrient": list(ids), "position": [positions.get(nutrient) for nutrient in ids]},
+        schema={"nutrient_id": pl.UInt16, "nutrient": pl.Utf8, "position": pl.UInt16},
+    ).sort("position", nulls_last=True)
+
+
+def extract_food_snapshots():
+    """
+    Creates uncompressed Arrow IPC (Feather v2) snapshots of food_list, food_nutrients and food_nutrients_cal next to their parquet files.
+    These can be memory mapped without decoding (see foods.load_food_table), so processes share the OS page cache instead of each holding a decoded copy.
+    The tables are streamed from their parquet files, a batch of rows at a time.
+    """
+    for name in ["food_list", "food_nutrients", "food_nutrients_cal"]:
+        pl.scan_parquet(f"data/sources/{name}.parquet").sink_ipc(
+            f"data/sources/{name}.arrow.tmp", compression=None
+        )
+        # Replace any existing snapshot in one step, so processes that have it mapped keep a consistent copy
+        os.replace(f"data/sources/{name}.arrow.tmp", f"data/sources/{name}.arrow")
+
+
+def fuzzy_match(list1, list2, scorer=None, score_cutoff=90):
     """
     Returns a dictionary of matched pairs from 2 lists.
     Refer to rapidfuzz docs for fuzzy match methods available, and the range of scores that can be outputted for that method (to use in the 'tolerance' argument).
     To reduce processing time, this function creates lists with pre-processed strings instead of using the processor kwarg in the rapidfuzz.process.extractOne method.
+    scorer defaults to rapidfuzz.fuzz.ratio.
     """
+    from rapidfuzz import fuzz, process, utils
+
+    if scorer is None:
+        scorer = fuzz.ratio
     # Preprocess (e.g. remove non-alphabetic characters) of each list and create dictionaries for matching later on.
     list1_strip = []
     list1_key = {}
@@ -241,6 +657,8 @@ def extract_us_nutrient_reqs():
     Function to download recommended dietary allowances and tolerable upper limits for nutrients issued by the US Food and Nutrition Board.
     Link: https://ods.od.nih.gov/HealthInformation/nutrientrecommendations.aspx.
     """
+    import pandas as pd
+    import requests
 
     # helper function to extract and format table from html
     def parse_html(url):
@@ -500,12 +918,17 @@ def extract_us_nutrient_reqs():
     tul_new = pd.concat([tul_not_none, tul_male, tul_female])
     # Export tuls to a csv.
     tul_new.to_csv("data/tul.csv")
+    # Recompile the requirements bundle with the new tables
+    extract_requirements_bundle()
 
 
 def extract_us_energy_dist():
     """
     Function creates CSV files for lower and upper ranges for energy distribution between fats, carbohydrates and proteins in percentages.
     """
+    import pandas as pd
+    import requests
+
     # Add data folder if it does not exist
     if not os.path.exists("data"):
         os.makedirs("data")
@@ -575,6 +998,19 @@ def extract_us_energy_dist():
     # Export lower and upper ranges to CSVs
     energy_dist_lower.to_csv("data/energy_dist_lower.csv")
     energy_dist_upper.to_csv("data/energy_dist_upper.csv")
+    # Recompile the requirements bundle with the new tables
+    extract_requirements_bundle()
+
+
+def extract_requirements_bundle():
+    """
+    Compiles the requirement tables read by Person.diet_rqmts (energy, rda, tul, proteins, kcal per gram, energy distributions and nutrient keys)
+    into a single parquet file with typed band keys, float values, a version stamp and the data files' sizes and modification times, so they're loaded in one read at runtime.
+    """
+    bundle = Persons.requirements_bundle()
+    tmp_path = Persons.REQUIREMENTS_BUNDLE + ".tmp"
+    bundle.write_parquet(tmp_path)
+    os.replace(tmp_path, Persons.REQUIREMENTS_BUNDLE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+from server import Service
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process JSON Lines from stdin (searches, person profiles or intake logs) and write JSON Lines results to stdout."
+    )
+    parser.add_argument(
+        "--type",
+        choices=["search", "requirements", "intake"],
+        help="treat every record as this type, instead of using each record's 'type' key or its fields",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="records to buffer before writing and flushing output")
+    args = parser.parse_args()
+    run(sys.stdin, sys.stdout, args.type, args.batch_size)
+
+
+def record_type(record):
+    """
+    Returns the type of a record: its 'type' key, or 'search' if it has a 'q', 'intake' if it has 'entries', and 'requirements' otherwise.
+    """
+    if "type" in record:
+        return record["type"]
+    if "q" in record:
+        return "search"
+    if "entries" in record:
+        return "intake"
+    return "requirements"
+
+
+def process(service, record, kind=None):
+    """
+    Returns the result for one record:
+    - search: {"q": text, "limit": n, "offset": n}
+    - requirements: a person (see Person.from_dict)
+    - intake: {"entries": [[food_id, grams], ...], "person": optional person}
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Each line must be a JSON object")
+    kind = kind or record_type(record)
+    if kind == "search":
+        return service.search(record.get("q", ""), record.get("limit", 50), record.get("offset", 0))
+    elif kind == "requirements":
+        return service.requirements(record)
+    elif kind == "intake":
+        return service.intake(record)
+    raise ValueError(f"Unknown record type: '{kind}'")
+
+
+def run(lines, output, kind=None, batch_size=1000):
+    """
+    Processes each line of lines as it is read, with the data loaded once.
+    Writes one JSON line per input line, with its line number and either its 'result' or an 'error',
+    flushing output every batch_size lines so memory use stays bounded.
+    """
+    service = Service()
+    buffer = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            result = {"line": number, "result": process(service, json.loads(line), kind)}
+        except json.JSONDecodeError:
+            result = {"line": number, "error": "Line is not valid JSON"}
+        except Exception as error:
+            # No record, however invalid, stops the stream: its error is its result line
+            result = {"line": number, "error": str(error) or type(error).__name__}
+        buffer.append(json.dumps(result))
+        if len(buffer) >= batch_size:
+            output.write("\n".join(buffer) + "\n")
+            output.flush()
+            buffer = []
+    if buffer:
+        output.write("\n".join(buffer) + "\n")
+        output.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Words synthetic food descriptions are made of, so searches and fuzzy matching find realistic numbers of matches
+WORDS = (
+    "apple banana bean beef black bread breast broccoli brown butter cheese chicken cooked cream dried egg fat "
+    "fish fried frozen grilled juice kidney lean milk oil olive pasta pork potato raw rice roasted salmon salted "
+    "sauce soup steamed sugar toast tomato turkey white whole wheat yogurt"
+).split()
+# Terms typed into the search screen, one keystroke at a time
+SEARCH_TERMS = ["broccoli", "chicken breast", "whole wheat bread", "brocoli", "salmn"]
+PERSONS = [
+    {"name": "Adult", "dob": "1990-01-01", "sex": "f", "height": 165, "weight": 60, "pal": 2},
+    {"name": "Child", "dob": "2018-06-01", "sex": "m", "height": 120, "weight": 25, "pal": 3},
+    {"name": "Older", "dob": "1950-03-15", "sex": "m", "height": 175, "weight": 80, "pal": 1},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot paths offline, on synthetic data shaped like FoodData Central's CSV files. "
+        "Run from the directory holding data/ (its reference files are copied into a temporary directory)."
+    )
+    parser.add_argument("--foods", type=int, default=2000, help="foods in each synthetic dataset (survey and legacy)")
+    parser.add_argument("--entries", type=int, default=10000, help="intake entries aggregated in bulk")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark (the median is compared)")
+    parser.add_argument("--only", action="append", help="run only benchmarks whose name starts with this (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file (printed otherwise)")
+    parser.add_argument("--compare", help="baseline results JSON file to compare with; exits with 1 if any benchmark regressed")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown (fraction of the baseline median) counted as a regression")
+    args = parser.parse_args()
+    results = run(args.foods, args.entries, args.repeat, args.only, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        for key in ["foods", "entries"]:
+            if baseline.get("meta", {}).get(key) != results["meta"][key]:
+                print(f"Warning: the baseline was run with a different --{key}", file=sys.stderr)
+        rows = compare(baseline, results, args.threshold)
+        for row in rows:
+            change = f"{row['change']:+.1%}" if row["change"] is not None else "new"
+            print(
+                f"{row['name']:<40} {row['baseline_ms'] or 0:10.3f} {row['median_ms']:10.3f} ms {change:>8}  {row['status']}",
+                file=sys.stderr,
+            )
+        if any(row["status"] == "regression" for row in rows):
+            sys.exit(1)
+
+
+def make_fdc_fixtures(root, foods=2000, seed=1):
+    """
+    Writes synthetic survey and legacy datasets shaped like FoodData Central's food.csv, nutrient.csv and food_nutrient.csv
+    into the folders acquisitions.transform_us_food_nutrients reads under root, using the nutrients of data/nutrient_keys.tsv.
+    About a third of the legacy foods have a survey food's description, exactly or with small changes, so fuzzy matching finds pairs.
+    """
+    import acquisitions
+
+    generator = random.Random(seed)
+    with open("data/nutrient_keys.tsv") as file:
+        keys = list(csv.DictReader(file, dialect="excel-tab"))
+    nutrient_nbrs = sorted({nbr for key in keys for nbr in json.loads(key["nutrient_nbr"])})
+    nutrient_ids = sorted({nutrient_id for key in keys for nutrient_id in json.loads(key["nutrient_id"])})
+
+    def description():
+        return ", ".join(generator.sample(WORDS, generator.randint(2, 5))).capitalize()
+
+    survey = [(100000 + i, description()) for i in range(foods)]
+    legacy = []
+    for i in range(foods):
+        if i % 3 == 0:
+            legacy.append((200000 + i, generator.choice(survey)[1]))
+        elif i % 3 == 1:
+            legacy.append((200000 + i, generator.choice(survey)[1].replace(",", "") + "s"))
+        else:
+            legacy.append((200000 + i, description()))
+    for source, food, nutrients, nutrient_rows, coverage in [
+        (
+            acquisitions.SURVEY_SOURCE,
+            survey,
+            nutrient_nbrs,
+            [(5000 + i, f"Nutrient {nbr}", "G", float(nbr), i) for i, nbr in enumerate(nutrient_nbrs)],
+            0.7,
+        ),
+        (
+            acquisitions.LEGACY_SOURCE,
+            legacy,
+            nutrient_ids,
+            [(nutrient_id, f"Nutrient {nutrient_id}", "G", nutrient_id, i) for i, nutrient_id in enumerate(nutrient_ids)],
+            0.9,
+        ),
+    ]:
+        path = os.path.join(root, source)
+        os.makedirs(path, exist_ok=True)
+        write_csv(
+            os.path.join(path, "food.csv"),
+            ["fdc_id", "data_type", "description", "food_category_id", "publication_date"],
+            [(fdc_id, "synthetic", text, "", "2020-01-01") for fdc_id, text in food],
+        )
+        write_csv(os.path.join(path, "nutrient.csv"), ["id", "name", "unit_name", "nutrient_nbr", "rank"], nutrient_rows)
+        rows = []
+        for fdc_id, _ in food:
+            for nutrient in nutrients:
+                if generator.random() < coverage:
+                    # Some foods have no energy, so the per gram branch of the per kcal table is exercised
+                    amount = 0 if nutrient in (208, 1008) and generator.random() < 0.05 else round(generator.uniform(0, 50), 3)
+                    rows.append((len(rows) + 1, fdc_id, nutrient, amount))
+        write_csv(os.path.join(path, "food_nutrient.csv"), ["id", "fdc_id", "nutrient_id", "amount"], rows)
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def timed(function, repeat):
+    """
+    Runs function repeat times. Returns the summary of its durations in milliseconds, and its last result.
+    """
+    durations = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = function()
+        durations.append((time.perf_counter() - tic) * 1000)
+    return {
+        "repeats": repeat,
+        "median_ms": round(statistics.median(durations), 3),
+        "min_ms": round(min(durations), 3),
+        "max_ms": round(max(durations), 3),
+    }, result
+
+
+def run(foods=2000, entries=10000, repeat=5, only=None, seed=1):
+    """
+    Generates the synthetic datasets in a temporary directory and runs the benchmarks there. Returns the results
+    ({"meta": ..., "benchmarks": {name: timings}}), with benchmarks whose name starts with one of only, if given.
+    """
+    import polars as pl
+
+    meta = {
+        "foods": foods,
+        "entries": entries,
+        "seed": seed,
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    benchmarks = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "data", "sources"))
+        for name in os.listdir("data"):
+            if os.path.isfile(os.path.join("data", name)):
+                shutil.copy(os.path.join("data", name), os.path.join(root, "data", name))
+        make_fdc_fixtures(root, foods, seed)
+        os.chdir(root)
+        try:
+            for name, function in cases(entries, seed):
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                benchmarks[name], _ = timed(function, repeat)
+        finally:
+            os.chdir(cwd)
+    return {"meta": meta, "benchmarks": benchmarks}
+
+
+def cases(entries, seed):
+    """
+    Yields (name, function) for each benchmark, preparing each one's inputs (outside of its timings) as it goes.
+    Run from the directory holding the synthetic datasets.
+    """
+    import polars as pl
+    from rapidfuzz import fuzz
+    import acquisitions
+    import Persons
+    from foods import intake_totals
+    from intake import IntakeLog, IntakeRollups
+    from search import FoodSearch, FuzzyRanker
+
+    # Food tables
+    survey_food = acquisitions.read_foods(acquisitions.SURVEY_SOURCE)
+    legacy_food = acquisitions.read_foods(acquisitions.LEGACY_SOURCE)
+    yield "fuzzy_match", lambda: acquisitions.fuzzy_match(
+        survey_food["description"], legacy_food["description"], scorer=fuzz.token_sort_ratio, score_cutoff=90
+    )
+    matched_food = acquisitions.fuzzy_match(
+        survey_food["description"], legacy_food["description"], scorer=fuzz.token_sort_ratio, score_cutoff=90
+    )
+    yield "etl.read_foods", lambda: acquisitions.read_foods(acquisitions.SURVEY_SOURCE)
+    yield "etl.assign_food_ids", lambda: acquisitions.assign_food_ids(survey_food, legacy_food, matched_food)
+    survey_food, legacy_food, food_list = acquisitions.assign_food_ids(survey_food, legacy_food, matched_food)
+    yield "etl.read_nutrients", lambda: acquisitions.read_nutrients(acquisitions.SURVEY_SOURCE, "nutrient_nbr")
+    survey_nutrients = acquisitions.read_nutrients(acquisitions.SURVEY_SOURCE, "nutrient_nbr")
+    legacy_nutrients = acquisitions.read_nutrients(acquisitions.LEGACY_SOURCE, "nutrient_id")
+    yield "etl.nutrient_amounts.survey", lambda: acquisitions.nutrient_amounts(survey_food, *survey_nutrients)
+    yield "etl.nutrient_amounts.legacy", lambda: acquisitions.nutrient_amounts(legacy_food, *legacy_nutrients)
+    survey_amounts = acquisitions.nutrient_amounts(survey_food, *survey_nutrients)
+    legacy_amounts = acquisitions.nutrient_amounts(legacy_food, *legacy_nutrients)
+    yield "etl.merge_food_nutrients", lambda: acquisitions.merge_food_nutrients(survey_amounts, legacy_amounts)
+    food_nutrients = acquisitions.merge_food_nutrients(survey_amounts, legacy_amounts)
+    yield "etl.per_kcal", lambda: acquisitions.per_kcal(food_nutrients)
+    food_list = food_list.join(food_nutrients.select(pl.col("food_id")), on="food_id").sort("food_id")
+
+    # Search screen filtering: each keystroke queries the term typed so far and keeps the rows shown
+    def type_terms(food_search):
+        session = food_search.session()
+        for term in SEARCH_TERMS:
+            for end in range(1, len(term) + 1):
+                session.query(term[:end]).slice(0, 50)
+
+    food_search = FoodSearch(food_list=food_list)
+    yield "search.keystrokes", lambda: type_terms(food_search)
+    fuzzy_search = FoodSearch(food_list=food_list, ranker=FuzzyRanker())
+    yield "search.keystrokes.fuzzy", lambda: type_terms(fuzzy_search)
+
+    # Requirements, computed from the reference tables each time rather than cached per person
+    persons = [Persons.Person.from_dict(person) for person in PERSONS]
+
+    def load_reference_tables():
+        Persons.reference_tables.clear()
+        return persons[0].compute_diet_rqmts()
+
+    yield "diet_rqmts.cold", load_reference_tables
+    yield "diet_rqmts", lambda: [person.compute_diet_rqmts() for person in persons]
+
+    # Intake: totals of a bulk list of entries, and logging them with daily and rolling totals
+    generator = random.Random(seed)
+    food_ids = food_nutrients["food_id"].to_list()
+    bulk = [(generator.choice(food_ids), generator.uniform(10, 300)) for _ in range(entries)]
+    yield "intake.totals", lambda: intake_totals(bulk, food_nutrients)
+    days = [datetime(2024, 1, day, 12) for day in range(1, 29)]
+    grouped = [(1 + i % 20, food_id, grams, days[i % len(days)], None, None) for i, (food_id, grams) in enumerate(bulk)]
+
+    def log_and_roll_up():
+        intake_log = IntakeLog(":memory:", food_nutrients)
+        with intake_log.lock, intake_log.connection:
+            intake_log.append_group(grouped)
+        IntakeRollups(intake_log).refresh()
+        intake_log.connection.close()
+
+    yield "intake.log_and_roll_up", log_and_roll_up
+
+
+def compare(baseline, results, threshold=0.2):
+    """
+    Returns a row for each benchmark in results with its baseline and current medians, the relative change,
+    and a status: "regression" if it's slower than the baseline by more than threshold, "faster" if it's faster by more, "new", or "ok".
+    """
+    rows = []
+    for name, timings in results["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if before is None:
+            rows.append({"name": name, "baseline_ms": None, "median_ms": timings["median_ms"], "change": None, "status": "new"})
+            continue
+        change = timings["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        if change > threshold:
+            status = "regression"
+        elif change < -threshold:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append(
+            {"name": name, "baseline_ms": before["median_ms"], "median_ms": timings["median_ms"], "change": change, "status": status}
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    main()
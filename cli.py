@@ -0,0 +1,142 @@
+import argparse
+import json
+import sys
+
+# Only the standard library is imported at startup: each command imports what it needs when it runs,
+# so e.g. requirements never loads the search stack and --help loads nothing
+REBUILD_STEPS = ["all", "foods", "nutrient-reqs", "energy-dist", "bundle"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search foods, compute requirements or rebuild the data files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="search foods, interactively if no term is given")
+    search.add_argument("term", nargs="?", help="print foods matching term, best first, instead of opening the search screen")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--fuzzy", action="store_true", help="tolerate typos when there are no exact matches")
+    search.add_argument("--latency", metavar="FILE", help="record each keystroke's latency and the keys pressed, and write them to FILE on exit")
+    search.add_argument("--latency-status", action="store_true", help="show keystroke latency percentiles in a status line")
+    search.add_argument("--replay", metavar="FILE", help="replay the keys of a recorded session headlessly and print its latency summary")
+    search.set_defaults(run=run_search)
+
+    requirements = commands.add_parser("requirements", help="print a person's requirements as JSON")
+    requirements.add_argument("--name", default="cli")
+    requirements.add_argument("--dob", required=True, help="yyyy-mm-dd")
+    requirements.add_argument("--sex", required=True)
+    requirements.add_argument("--height", required=True, help="cm")
+    requirements.add_argument("--weight", required=True, help="kg")
+    requirements.add_argument("--pal", required=True, help="physical activity level (1-4 or its name)")
+    requirements.add_argument("--due-date", help="yyyy-mm-dd")
+    requirements.add_argument("--breastfeeding", type=int, choices=[1, 2])
+    requirements.set_defaults(run=run_requirements)
+
+    rebuild = commands.add_parser("rebuild", help="download and rebuild the data files")
+    rebuild.add_argument("step", nargs="?", choices=REBUILD_STEPS, default="all")
+    rebuild.add_argument(
+        "--memory-budget",
+        type=parse_size,
+        help="build the food tables out of core within about this much memory (bytes, or e.g. 512M, 4G)",
+    )
+    rebuild.set_defaults(run=run_rebuild)
+
+    args = parser.parse_args(argv)
+    try:
+        args.run(args)
+    except ValueError as error:
+        parser.exit(1, f"{error}\n")
+
+
+def run_search(args):
+    if args.replay:
+        import latency
+
+        with open(args.replay) as file:
+            keys = json.load(file)["keys"]
+        _, recorded = latency.replay(keys)
+        if args.latency:
+            recorded.dump(args.latency)
+        json.dump(recorded.summary(), sys.stdout, indent=2)
+        print()
+        return
+    if args.term is None:
+        import main
+
+        if not (args.latency or args.latency_status):
+            main.main()
+            return
+        import latency
+
+        recorded = latency.KeystrokeLatency(status=args.latency_status)
+        try:
+            main.main(recorded)
+        finally:
+            if args.latency:
+                recorded.dump(args.latency)
+        return
+    from recipes import foods_and_recipes
+    from search import FoodSearch, FuzzyRanker
+
+    food_list, _ = foods_and_recipes()
+    if args.fuzzy:
+        food_search = FoodSearch(food_list=food_list, ranker=FuzzyRanker())
+    else:
+        food_search = FoodSearch(food_list=food_list)
+    for food_id, food, _ in food_search.query(args.term, limit=args.limit).rows():
+        print(f"{food_id}\t{food}")
+
+
+def run_requirements(args):
+    from Persons import Person
+
+    person = Person.from_dict(
+        {
+            "name": args.name,
+            "dob": args.dob,
+            "sex": args.sex,
+            "height": args.height,
+            "weight": args.weight,
+            "pal": args.pal,
+            "due_date": args.due_date,
+            "breastfeeding": args.breastfeeding,
+        }
+    )
+    json.dump(person.diet_rqmts, sys.stdout, indent=2)
+    print()
+
+
+def run_rebuild(args):
+    import acquisitions
+
+    if args.step == "all":
+        acquisitions.main(args.memory_budget)
+    elif args.step == "foods":
+        acquisitions.extract_us_food_nutrients(args.memory_budget)
+    elif args.step == "nutrient-reqs":
+        acquisitions.extract_us_nutrient_reqs()
+    elif args.step == "energy-dist":
+        acquisitions.extract_us_energy_dist()
+    elif args.step == "bundle":
+        acquisitions.extract_requirements_bundle()
+
+
+def parse_size(text):
+    """
+    Returns the number of bytes in a size such as 1048576, 512M or 4G.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    text = text.strip().upper().removesuffix("B")
+    try:
+        if text and text[-1] in units:
+            size = int(float(text[:-1]) * units[text[-1]])
+        else:
+            size = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: '{text}'")
+    if size <= 0:
+        raise argparse.ArgumentTypeError("size must be greater than 0")
+    return size
+
+
+if __name__ == "__main__":
+    main()
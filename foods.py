@@ -0,0 +1,428 @@
+import operator
+import os
+import re
+import shlex
+import polars as pl
+
+# Comparison operators allowed in nutrient predicates
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def strip_food(food):
+    """
+    Returns a food name (or search term) in lower case with only alphabetic characters and '.', as used for searching.
+    """
+    return re.sub(r"[^a-z.]", "", food.lower())
+
+
+def food_strip():
+    """
+    Returns an expression creating the 'food_strip' column (see strip_food) from the 'food' column.
+    """
+    return (
+        pl.col("food")
+        .str.to_lowercase()
+        .str.replace_all(r"[^a-z.]", "")
+        .alias("food_strip")
+    )
+
+
+def load_food_table(name):
+    """
+    Returns a food table ('food_list', 'food_nutrients' or 'food_nutrients_cal').
+    Memory maps its Arrow IPC snapshot (see acquisitions.extract_food_snapshots) when there is one, otherwise reads the parquet file.
+    """
+    if os.path.exists(f"data/sources/{name}.arrow"):
+        # Snapshots streamed in several record batches are kept as chunks, as rechunking would copy them out of the mapping
+        return pl.read_ipc(f"data/sources/{name}.arrow", memory_map=True, rechunk=False)
+    return pl.read_parquet(f"data/sources/{name}.parquet")
+
+
+def food_names(food_ids):
+    """
+    Returns a dataframe with the food_id and food (description) of the given food_ids, from food_list.parquet.
+    """
+    return (
+        pl.scan_parquet("data/sources/food_list.parquet")
+        .filter(pl.col("food_id").is_in(list(food_ids)))
+        .collect()
+    )
+
+
+def find_food_ids(foods):
+    """
+    Returns the food_ids of the given food descriptions, from food_list.parquet.
+    """
+    return (
+        pl.scan_parquet("data/sources/food_list.parquet")
+        .filter(pl.col("food").is_in(list(foods)))
+        .select(pl.col("food_id"))
+        .collect()["food_id"]
+    )
+
+
+def top_sources(nutrient, limit=50, offset=0, recipe_book=None):
+    """
+    Returns the foods with the highest amount of a nutrient per kcal (per gram for 0 kcal foods), best first.
+    Reads only the requested slice of the precomputed food_rankings.parquet (see acquisitions.extract_food_rankings).
+    The recipes of recipe_book (a recipes.RecipeBook), if given, are ranked among the foods.
+    """
+    sources = pl.scan_parquet("data/sources/food_rankings.parquet").filter(pl.col("nutrient") == nutrient)
+    recipes = recipe_amounts(recipe_book, nutrient)
+    if recipes is None:
+        sources = sources.slice(offset, limit).select(pl.col("rank"), pl.col("food_id"), pl.col("amount")).collect()
+        return add_food_names(sources)
+    # Recipes may rank anywhere, so the foods up to the end of the requested slice are read and merged with them
+    sources = sources.slice(0, offset + limit).select(pl.col("food_id"), pl.col("amount")).collect()
+    return add_food_names(merge_ranks(sources, recipes, 0).slice(offset, limit), recipe_book)
+
+
+def sources_in_range(nutrient, lower=None, upper=None, limit=None, offset=0, recipe_book=None):
+    """
+    Returns the foods with an amount of a nutrient per kcal between lower and upper (inclusive), best first.
+    Because rankings are sorted by amount, matches are a contiguous run of rows, and row groups outside it are skipped using parquet statistics.
+    The recipes of recipe_book (a recipes.RecipeBook), if given, are ranked among the foods.
+    """
+    predicate = pl.col("nutrient") == nutrient
+    if lower is not None:
+        predicate = predicate & (pl.col("amount") >= lower)
+    if upper is not None:
+        predicate = predicate & (pl.col("amount") <= upper)
+    sources = pl.scan_parquet("data/sources/food_rankings.parquet").filter(predicate)
+    recipes = recipe_amounts(recipe_book, nutrient)
+    if recipes is None:
+        if limit is not None:
+            sources = sources.slice(offset, limit)
+        elif offset:
+            sources = sources.slice(offset)
+        sources = sources.select(pl.col("rank"), pl.col("food_id"), pl.col("amount")).collect()
+        return add_food_names(sources)
+    if limit is not None:
+        sources = sources.slice(0, offset + limit)
+    sources = sources.select(pl.col("food_id"), pl.col("amount")).collect()
+    # Foods and recipes above the range come first in the rankings
+    first_rank = 0
+    if upper is not None:
+        first_rank = count_matches(nutrient, ">", upper) + recipes.filter(pl.col("amount") > upper).height
+    recipes = recipes.filter(
+        (pl.col("amount") >= (lower if lower is not None else float("-inf")))
+        & (pl.col("amount") <= (upper if upper is not None else float("inf")))
+    )
+    sources = merge_ranks(sources, recipes, first_rank)
+    return add_food_names(sources.slice(offset, limit) if limit is not None else sources.slice(offset), recipe_book)
+
+
+def recipe_amounts(recipe_book, nutrient):
+    """
+    Returns the food_id and amount per kcal of a nutrient of the recipes having data for it,
+    or None if there is no recipe_book or it has no recipes.
+    """
+    if recipe_book is None or not recipe_book.recipes:
+        return None
+    nutrients_cal = recipe_book.nutrients_cal()
+    if nutrient not in nutrients_cal.columns:
+        return nutrients_cal.select(pl.col("food_id"), pl.lit(None, pl.Float64).alias("amount")).clear()
+    return nutrients_cal.select(pl.col("food_id"), pl.col(nutrient).alias("amount")).filter(pl.col("amount").is_not_null())
+
+
+def merge_ranks(sources, recipes, first_rank):
+    """
+    Returns the food_id and amount rows of sources and recipes, sorted like the rankings (highest amount first, then by food_id)
+    and numbered from first_rank.
+    """
+    recipes = recipes.with_columns(pl.col("food_id").cast(sources["food_id"].dtype))
+    return (
+        pl.concat([sources, recipes])
+        .sort(["amount", "food_id"], descending=[True, False])
+        .with_row_count("rank", offset=first_rank)
+    )
+
+
+def add_food_names(df, recipe_book=None):
+    """
+    Adds the food (description) column after food_id to a dataframe with a food_id column, keeping its row order.
+    Names of the recipes of recipe_book, if given, are looked up there.
+    """
+    columns = df.columns
+    columns.insert(columns.index("food_id") + 1, "food")
+    names = food_names(df["food_id"])
+    if recipe_book is not None and recipe_book.recipes:
+        recipes = recipe_book.food_list().filter(pl.col("food_id").is_in(df["food_id"]))
+        names = pl.concat(
+            [names.select(pl.col("food_id"), pl.col("food")), recipes.with_columns(pl.col("food_id").cast(names["food_id"].dtype))]
+        )
+    return df.join(names, on="food_id", how="left").select(columns)
+
+
+def nutrient_blocks(nutrient, lower=None, upper=None):
+    """
+    Returns the zone map blocks of food_nutrients_cal.parquet that may hold amounts of a nutrient between lower and upper.
+    Each block gives the row range (row_start, row_end) and the min and max amount of the nutrient in it.
+    """
+    predicate = pl.col("nutrient") == nutrient
+    if lower is not None:
+        predicate = predicate & (pl.col("amount_max") >= lower)
+    if upper is not None:
+        predicate = predicate & (pl.col("amount_min") <= upper)
+    return pl.scan_parquet("data/sources/food_zone_maps.parquet").filter(predicate).collect()
+
+
+def nutrient_range(nutrient):
+    """
+    Returns the (min, max) amount of a nutrient per kcal across all foods, from the zone maps.
+    """
+    blocks = nutrient_blocks(nutrient)
+    if blocks.is_empty():
+        return None, None
+    return blocks["amount_min"].min(), blocks["amount_max"].max()
+
+
+def parse_query(query):
+    """
+    Parses a query such as "Total Protein/kcal > 0.05 and Sodium/kcal < 1 and name contains 'bean'".
+    Returns a list of (nutrient, operator, value) predicates, and the name search term (or None).
+    Quoted values are kept whole, so they may contain "and".
+    """
+    try:
+        # Keep the quotes, which the name clause strips
+        tokens = shlex.split(query, posix=False)
+    except ValueError as error:
+        raise ValueError(f"Can't parse query: {error}")
+    clauses = [[]]
+    for token in tokens:
+        if token.lower() == "and":
+            clauses.append([])
+        else:
+            clauses[-1].append(token)
+    predicates = []
+    name = None
+    for clause in [" ".join(tokens) for tokens in clauses]:
+        match = re.fullmatch(
+            r"name\s+contains\s+['\"]?(.*?)['\"]?", clause.strip(), flags=re.IGNORECASE
+        )
+        if match:
+            name = match.group(1)
+            continue
+        match = re.fullmatch(
+            r"(.+?)\s*(?:/\s*kcal)?\s*(>=|<=|==|!=|=|>|<)\s*([-+0-9.eE]+)", clause.strip()
+        )
+        if not match:
+            raise ValueError(f"Can't parse query clause: '{clause}'")
+        nutrient, op, value = match.groups()
+        if op == "=":
+            op = "=="
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"Provide a number to compare {nutrient} with")
+        predicates.append((nutrient.strip(), op, value))
+    return predicates, name
+
+
+def count_matches(nutrient, op, value):
+    """
+    Returns the number of foods matching a nutrient predicate, counted in the rankings.
+    Only the nutrient's amounts are read, the row groups of other nutrients being skipped using parquet statistics.
+    """
+    return (
+        pl.scan_parquet("data/sources/food_rankings.parquet")
+        .filter((pl.col("nutrient") == nutrient) & OPERATORS[op](pl.col("amount"), value))
+        .select(pl.count())
+        .collect()
+        .item()
+    )
+
+
+def query_foods(predicates=(), name=None, limit=50, offset=0, order_by=None, recipe_book=None):
+    """
+    Returns foods from food_nutrients_cal.parquet matching all nutrient predicates and, optionally, containing a name search term.
+    predicates is a list of (nutrient, operator, value) tuples, e.g. [("Total Protein", ">", 0.05)], or see parse_query.
+    Predicates are evaluated against the sorted rankings from the most to the least selective (see count_matches),
+    narrowing down the candidate food_ids as they go, so only matching rows of the wide table are read.
+    Results are ordered like search_food (foods starting with name before those containing it), or by the order_by nutrient (highest first),
+    and paginated with limit and offset. The recipes of recipe_book (a recipes.RecipeBook), if given, are queried along with the foods.
+    """
+    nutrients = pl.scan_parquet("data/sources/food_nutrients_cal.parquet").columns
+    for nutrient, op, value in predicates:
+        if nutrient not in nutrients:
+            raise ValueError(f"Unknown nutrient: '{nutrient}'")
+        if op not in OPERATORS:
+            raise ValueError(f"Provide one of {', '.join(OPERATORS)} as operator")
+    if order_by and order_by not in nutrients:
+        raise ValueError(f"Unknown nutrient: '{order_by}'")
+    # Match the name first, as the food list is much smaller than the nutrient tables
+    food_list = None
+    ids = None
+    if name:
+        name_strip = strip_food(name)
+        food_list = (
+            pl.scan_parquet("data/sources/food_list.parquet")
+            .with_columns(food_strip())
+            .filter(pl.col("food_strip").str.contains(name_strip, literal=True))
+            .with_columns(pl.col("food_strip").str.starts_with(name_strip).alias("begins"))
+            .drop("food_strip")
+            .collect()
+        )
+        ids = food_list["food_id"]
+    # Evaluate the most selective predicate first
+    predicates = sorted(predicates, key=lambda p: count_matches(*p))
+    for nutrient, op, value in predicates:
+        if ids is not None and ids.is_empty():
+            break
+        matches = pl.scan_parquet("data/sources/food_rankings.parquet").filter(
+            (pl.col("nutrient") == nutrient) & OPERATORS[op](pl.col("amount"), value)
+        )
+        if ids is not None:
+            matches = matches.filter(pl.col("food_id").is_in(ids))
+        ids = matches.select(pl.col("food_id")).collect()["food_id"]
+    # Read only the food_ids and the nutrients queried from the matching rows
+    columns = ["food_id"] + list(
+        dict.fromkeys([p[0] for p in predicates] + ([order_by] if order_by else []))
+    )
+    foods = pl.scan_parquet("data/sources/food_nutrients_cal.parquet").select(columns)
+    if ids is not None:
+        foods = foods.filter(pl.col("food_id").is_in(ids))
+    # Also filter on the predicates themselves, so row groups can be skipped using parquet statistics
+    for nutrient, op, value in predicates:
+        foods = foods.filter(OPERATORS[op](pl.col(nutrient), value))
+    foods = foods.collect()
+    if food_list is None:
+        food_list = food_names(foods["food_id"]).with_columns(pl.lit(True).alias("begins"))
+    foods = foods.join(food_list, on="food_id")
+    if recipe_book is not None and recipe_book.recipes:
+        foods = pl.concat([foods, matching_recipes(recipe_book, predicates, name, foods)])
+    if order_by:
+        foods = foods.sort(order_by, descending=True, nulls_last=True)
+    else:
+        # Prioritise foods that begin with name
+        foods = foods.sort([~pl.col("begins"), pl.col("food_id")])
+    return foods.select(["food_id", "food"] + columns[1:]).slice(offset, limit)
+
+
+def matching_recipes(recipe_book, predicates, name, foods):
+    """
+    Returns the recipes of recipe_book matching all nutrient predicates and containing name (if given), with the columns of foods (see query_foods).
+    """
+    recipes = recipe_book.nutrients_cal().join(recipe_book.food_list(), on="food_id")
+    if name:
+        name_strip = strip_food(name)
+        recipes = (
+            recipes.with_columns(food_strip())
+            .filter(pl.col("food_strip").str.contains(name_strip, literal=True))
+            .with_columns(pl.col("food_strip").str.starts_with(name_strip).alias("begins"))
+        )
+    else:
+        recipes = recipes.with_columns(pl.lit(True).alias("begins"))
+    recipes = recipes.select(
+        [
+            pl.col(column).cast(dtype) if column in recipes.columns else pl.lit(None, dtype).alias(column)
+            for column, dtype in foods.schema.items()
+        ]
+    )
+    for nutrient, op, value in predicates:
+        recipes = recipes.filter(OPERATORS[op](pl.col(nutrient), value))
+    return recipes
+
+
+def read_sparse_rows(food_ids=None, nutrients=None, per_kcal=False):
+    """
+    Rebuilds dense rows of food_nutrients.parquet (or food_nutrients_cal.parquet if per_kcal) from the sparse files,
+    for the given food_ids only (all foods if not given), and optionally only some nutrients.
+    """
+    food_offsets = pl.scan_parquet("data/sources/food_offsets.parquet")
+    if food_ids is not None:
+        food_offsets = food_offsets.filter(pl.col("food_id").is_in(list(food_ids)))
+    food_offsets = food_offsets.select(pl.col("food_id")).collect()
+    # Nutrients dropped from the table keep their ids in the dictionary, without a position
+    nutrient_dictionary = (
+        pl.read_parquet("data/sources/nutrient_dictionary.parquet").filter(pl.col("position").is_not_null()).sort("position")
+    )
+    if nutrients is not None:
+        nutrient_dictionary = nutrient_dictionary.filter(pl.col("nutrient").is_in(list(nutrients)))
+    amount = "amount_cal" if per_kcal else "amount"
+    # Rows are sorted by food_id, so row groups without the requested foods are skipped
+    food_nutrients_sparse = (
+        pl.scan_parquet("data/sources/food_nutrients_sparse.parquet")
+        .filter(pl.col("food_id").is_in(food_offsets["food_id"]))
+        .filter(pl.col("nutrient_id").is_in(nutrient_dictionary["nutrient_id"]))
+        .filter(pl.col(amount).is_not_null())
+        .select(pl.col("food_id"), pl.col("nutrient_id"), pl.col(amount))
+        .collect()
+        .join(nutrient_dictionary.select(pl.col("nutrient_id"), pl.col("nutrient")), on="nutrient_id")
+    )
+    if per_kcal:
+        # Foods without an energy amount are not part of the per kcal table
+        food_offsets = food_offsets.filter(
+            pl.col("food_id").is_in(food_nutrients_sparse["food_id"].unique())
+        )
+    if food_nutrients_sparse.is_empty():
+        rows = food_offsets
+    else:
+        rows = food_offsets.join(
+            food_nutrients_sparse.pivot(
+                values=amount, index="food_id", columns="nutrient", aggregate_function=None
+            ),
+            on="food_id",
+            how="left",
+        )
+    # Add nutrients none of the foods have data for, in the column order of the dense table
+    return rows.sort("food_id").select(
+        [pl.col("food_id")]
+        + [
+            pl.col(nutrient)
+            if nutrient in rows.columns
+            else pl.lit(None, pl.Float64).alias(nutrient)
+            for nutrient in nutrient_dictionary["nutrient"]
+        ]
+    )
+
+
+def read_sparse_row(food_id, per_kcal=False):
+    """
+    Returns a dictionary of the nutrient amounts a food has data for, reading only that food's rows of food_nutrients_sparse.parquet.
+    """
+    entry = (
+        pl.scan_parquet("data/sources/food_offsets.parquet")
+        .filter(pl.col("food_id") == food_id)
+        .collect()
+    )
+    if entry.is_empty():
+        raise ValueError(f"Unknown food_id: {food_id}")
+    amount = "amount_cal" if per_kcal else "amount"
+    food_nutrients_sparse = (
+        pl.scan_parquet("data/sources/food_nutrients_sparse.parquet")
+        .slice(entry.item(0, "offset"), entry.item(0, "length"))
+        .filter(pl.col(amount).is_not_null())
+        .collect()
+        .join(pl.read_parquet("data/sources/nutrient_dictionary.parquet", columns=["nutrient_id", "nutrient"]), on="nutrient_id")
+    )
+    return dict(zip(food_nutrients_sparse["nutrient"], food_nutrients_sparse[amount]))
+
+
+def intake_totals(entries, food_nutrients=None):
+    """
+    Returns a dictionary with the total amount of each nutrient in a list of (food_id, grams) entries.
+    food_nutrients (amounts per 100g) is loaded with load_food_table if not given.
+    """
+    if food_nutrients is None:
+        food_nutrients = load_food_table("food_nutrients")
+    intake = pl.DataFrame(
+        [(food_id, float(grams)) for food_id, grams in entries],
+        schema=[("food_id", food_nutrients["food_id"].dtype), ("grams", pl.Float64)],
+        orient="row",
+    )
+    unknown = intake.join(food_nutrients.select("food_id"), on="food_id", how="anti")
+    if not unknown.is_empty():
+        raise ValueError(f"Unknown food_id: {unknown.item(0, 'food_id')}")
+    nutrients = food_nutrients.drop("food_id").columns
+    totals = intake.join(food_nutrients, on="food_id").select(
+        [(pl.col(nutrient) * pl.col("grams") / 100).sum() for nutrient in nutrients]
+    )
+    return totals.row(0, named=True)
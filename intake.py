@@ -0,0 +1,477 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+import numpy as np
+import polars as pl
+from recipes import foods_and_recipes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intake_log (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    food_id INTEGER NOT NULL,
+    grams REAL NOT NULL,
+    eaten_at TEXT NOT NULL,
+    day TEXT NOT NULL,
+    logged_at TEXT NOT NULL,
+    corrects INTEGER REFERENCES intake_log (id),
+    amounts BLOB
+);
+CREATE INDEX IF NOT EXISTS intake_log_user_day ON intake_log (user_id, day);
+CREATE UNIQUE INDEX IF NOT EXISTS intake_log_corrects ON intake_log (corrects);
+CREATE TABLE IF NOT EXISTS daily_totals (
+    user_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    amounts BLOB NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rolling_totals (
+    user_id INTEGER NOT NULL,
+    days INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    amounts BLOB NOT NULL,
+    PRIMARY KEY (user_id, days, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_state (
+    days INTEGER PRIMARY KEY,
+    last_entry INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS total_nutrients (
+    position INTEGER PRIMARY KEY,
+    nutrient TEXT NOT NULL UNIQUE
+);
+"""
+INSERT_ENTRY = (
+    "INSERT INTO intake_log (user_id, food_id, grams, eaten_at, day, logged_at, corrects, amounts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SET_TOTALS = (
+    "INSERT INTO daily_totals (user_id, day, amounts) VALUES (?, ?, ?) "
+    "ON CONFLICT (user_id, day) DO UPDATE SET amounts = excluded.amounts"
+)
+
+
+def parse_grams(grams):
+    """
+    Returns grams as a float, raising ValueError unless it's a number greater than 0.
+    """
+    try:
+        grams = float(grams)
+    except (TypeError, ValueError):
+        raise ValueError("Provide a number for grams")
+    if grams <= 0:
+        raise ValueError("Provide a number greater than 0 for grams")
+    return grams
+
+
+def parse_time(eaten_at):
+    """
+    Returns a datetime for eaten_at (a datetime, an isoformat string, or None for now).
+    """
+    if eaten_at is None:
+        return datetime.now()
+    if isinstance(eaten_at, datetime):
+        return eaten_at
+    try:
+        return datetime.fromisoformat(str(eaten_at))
+    except ValueError:
+        raise ValueError("Provide the time eaten in the isoformat: yyyy-mm-ddThh:mm")
+
+
+def against_requirements(amounts, diet_rqmts):
+    """
+    Returns nutrient amounts against a person's requirements (Person.diet_rqmts):
+    for each nutrient, the amount with the requirement's unit, amount_lower, amount_upper and amount_tul.
+    """
+    return {
+        nutrient: {
+            "amount": amounts.get(nutrient, 0.0),
+            "unit": requirement["unit"],
+            "amount_lower": requirement["amount_lower"],
+            "amount_upper": requirement["amount_upper"],
+            "amount_tul": requirement["amount_tul"],
+        }
+        for nutrient, requirement in diet_rqmts.items()
+    }
+
+
+class IntakeLog:
+    """
+    Append-only log of the foods users ate (user_id, food_id, grams, time eaten) in an SQLite database,
+    with the running total of each nutrient per user and day (one row holding a vector of amounts) kept up to date as entries are logged,
+    so reading a day's totals doesn't go back over the entries.
+    Entries are never changed: deleting or editing one logs a correcting entry with the negative grams,
+    which takes its nutrients back off the day's totals. Each entry keeps the nutrients it added (its amounts vector),
+    so a correction takes off exactly those, even if the food's amounts changed since (e.g. after rebuilding the food tables).
+    user_id is the user's id in the user store (see users.UserStore.user_id).
+    Foods are those of food_nutrients, by default the food tables with the recipes added (see recipes.foods_and_recipes), so recipes are logged like foods.
+    """
+
+    def __init__(self, path="data/intake.db", food_nutrients=None):
+        if food_nutrients is None:
+            _, food_nutrients = foods_and_recipes()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Logs created before entries kept their amounts
+        if "amounts" not in [column for _, column, *_ in self.connection.execute("PRAGMA table_info (intake_log)")]:
+            self.connection.execute("ALTER TABLE intake_log ADD COLUMN amounts BLOB")
+        self.lock = threading.Lock()
+        # Totals are stored as vectors with a position for each nutrient, kept in the database
+        # so they're read the same way if the nutrient table changes (new nutrients are added at the end)
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO total_nutrients (nutrient) VALUES (?)",
+                [(nutrient,) for nutrient in food_nutrients.drop("food_id").columns],
+            )
+        self.nutrient_names = [
+            nutrient for nutrient, in self.connection.execute("SELECT nutrient FROM total_nutrients ORDER BY position")
+        ]
+        # Each food's amounts per 100g in that order, with 0 where it has no data
+        amounts = (
+            food_nutrients.select(
+                [
+                    pl.col(nutrient).fill_null(0) if nutrient in food_nutrients.columns else pl.lit(0.0).alias(nutrient)
+                    for nutrient in self.nutrient_names
+                ]
+            )
+            .to_numpy()
+            .astype(np.float64)
+        )
+        self.vectors = dict(zip(food_nutrients["food_id"], amounts))
+
+    def close(self):
+        self.connection.close()
+
+    def delta(self, food_id, grams):
+        """
+        Returns the change to the daily totals vector from eating grams of a food.
+        """
+        if food_id not in self.vectors:
+            raise ValueError(f"Unknown food_id: {food_id}")
+        return self.vectors[food_id] * (grams / 100)
+
+    def totals_vector(self, user_id, day):
+        """
+        Returns a user's daily totals vector, or None if nothing was logged that day.
+        """
+        row = self.connection.execute(
+            "SELECT amounts FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, day)
+        ).fetchone()
+        return self.unpack(row[0]) if row else None
+
+    def unpack(self, amounts):
+        """
+        Returns a vector of totals stored as bytes.
+        """
+        amounts = np.frombuffer(amounts, dtype=np.float64)
+        # Totals written before nutrients were added are shorter
+        return np.pad(amounts, (0, len(self.nutrient_names) - len(amounts)))
+
+    def append(self, user_id, food_id, grams, eaten_at, corrects=None, delta=None):
+        """
+        Writes an entry and its change to the daily totals, in the current transaction. Returns the entry's id.
+        """
+        return self.append_group([(user_id, food_id, grams, eaten_at, corrects, delta)])[0]
+
+    def append_group(self, entries):
+        """
+        Writes (user_id, food_id, grams, eaten_at, corrects) entries in the current transaction,
+        adding up their changes to each user's daily totals so each user-day's row is read and written once.
+        An entry may have a sixth field, delta: its change to the totals, computed from the food's amounts if missing or None.
+        Returns the entries' ids.
+        """
+        ids = []
+        deltas = {}
+        logged_at = datetime.now().isoformat()
+        for user_id, food_id, grams, eaten_at, corrects, *delta in entries:
+            delta = delta[0] if delta else None
+            day = eaten_at.date().isoformat()
+            if delta is None:
+                delta = self.delta(food_id, grams)
+            if (user_id, day) in deltas:
+                deltas[(user_id, day)] = deltas[(user_id, day)] + delta
+            else:
+                deltas[(user_id, day)] = delta
+            cursor = self.connection.execute(
+                INSERT_ENTRY, (user_id, food_id, grams, eaten_at.isoformat(), day, logged_at, corrects, delta.tobytes())
+            )
+            ids.append(cursor.lastrowid)
+        rows = []
+        for (user_id, day), delta in deltas.items():
+            totals = self.totals_vector(user_id, day)
+            rows.append((user_id, day, (delta if totals is None else totals + delta).tobytes()))
+        self.connection.executemany(SET_TOTALS, rows)
+        return ids
+
+    def log(self, user_id, food_id, grams, eaten_at=None):
+        """
+        Logs that a user ate grams of a food (now, unless eaten_at is given). Returns the entry's id.
+        """
+        grams = parse_grams(grams)
+        with self.lock, self.connection:
+            return self.append(user_id, food_id, grams, parse_time(eaten_at))
+
+    def entry(self, entry_id):
+        """
+        Returns a logged entry as a dictionary, raising ValueError if there is none or it has been deleted or edited.
+        """
+        row = self.connection.execute(
+            "SELECT id, user_id, food_id, grams, eaten_at, corrects FROM intake_log WHERE id = ?", (entry_id,)
+        ).fetchone()
+        if not row or row[5] is not None:
+            raise ValueError(f"No intake entry {entry_id}")
+        if self.connection.execute("SELECT 1 FROM intake_log WHERE corrects = ?", (entry_id,)).fetchone():
+            raise ValueError(f"Intake entry {entry_id} was already deleted or edited")
+        return dict(zip(["id", "user_id", "food_id", "grams", "eaten_at"], row[:5]))
+
+    def delete(self, entry_id):
+        """
+        Deletes an entry by logging its negative. Returns the correcting entry's id.
+        """
+        with self.lock, self.connection:
+            return self.retract(entry_id)
+
+    def retract(self, entry_id):
+        """
+        Logs the negative of an entry, taking off the amounts it added, in the current transaction. Returns the correcting entry's id.
+        """
+        entry = self.entry(entry_id)
+        (amounts,) = self.connection.execute("SELECT amounts FROM intake_log WHERE id = ?", (entry_id,)).fetchone()
+        return self.append(
+            entry["user_id"],
+            entry["food_id"],
+            -entry["grams"],
+            datetime.fromisoformat(entry["eaten_at"]),
+            corrects=entry_id,
+            # Entries logged before amounts were kept are taken off at the food's current amounts
+            delta=None if amounts is None else -self.unpack(amounts),
+        )
+
+    def edit(self, entry_id, food_id=None, grams=None, eaten_at=None):
+        """
+        Replaces an entry with one changing its food, grams or time eaten, deleting the old one. Returns the new entry's id.
+        """
+        with self.lock, self.connection:
+            entry = self.entry(entry_id)
+            grams = parse_grams(entry["grams"] if grams is None else grams)
+            self.retract(entry_id)
+            return self.append(
+                entry["user_id"],
+                entry["food_id"] if food_id is None else food_id,
+                grams,
+                parse_time(entry["eaten_at"] if eaten_at is None else eaten_at),
+            )
+
+    def daily_totals(self, user_id, day):
+        """
+        Returns the total amount of each nutrient a user ate on a day (a date or an isoformat string), or {} if nothing was logged.
+        """
+        totals = self.totals_vector(user_id, str(day))
+        if totals is None:
+            return {}
+        return dict(zip(self.nutrient_names, totals.tolist()))
+
+    def entries(self, user_id, day):
+        """
+        Returns a dataframe of a user's entries on a day, including deletions and edits.
+        """
+        return pl.DataFrame(
+            self.connection.execute(
+                "SELECT id, food_id, grams, eaten_at, logged_at, corrects FROM intake_log WHERE user_id = ? AND day = ? ORDER BY id",
+                (user_id, str(day)),
+            ).fetchall(),
+            schema=[
+                ("id", pl.Int64),
+                ("food_id", pl.Int64),
+                ("grams", pl.Float64),
+                ("eaten_at", pl.Utf8),
+                ("logged_at", pl.Utf8),
+                ("corrects", pl.Int64),
+            ],
+            orient="row",
+        )
+
+    def progress(self, user_id, day, diet_rqmts):
+        """
+        Returns the day's totals against a person's requirements (Person.diet_rqmts):
+        for each nutrient, the amount eaten with the requirement's unit, amount_lower, amount_upper and amount_tul.
+        """
+        return against_requirements(self.daily_totals(user_id, day), diet_rqmts)
+
+
+class IntakeWriter:
+    """
+    Write path for many concurrent writers to an IntakeLog: entries are queued, and one thread commits them in groups,
+    once max_entries are waiting or max_delay seconds after the first of them arrived, so one transaction covers many entries.
+    submit() returns a Future that resolves to the entry's id once its group is committed (or raises the commit's error),
+    as the writer's acknowledgement that the entry is stored. With durable, commits are synced to disk before they're acknowledged.
+    """
+
+    def __init__(self, intake_log, max_entries=500, max_delay=0.005, durable=True):
+        self.intake_log = intake_log
+        self.max_entries = max_entries
+        self.max_delay = max_delay
+        if durable:
+            with intake_log.lock:
+                intake_log.connection.execute("PRAGMA synchronous = FULL")
+        self.queue = queue.Queue()
+        self.closed = False
+        # Held while checking closed and queueing, so no entry is queued after close() queues the end of the queue
+        self.queue_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, user_id, food_id, grams, eaten_at=None):
+        """
+        Queues an entry to log, raising ValueError straight away if it's invalid. Returns a Future of the entry's id.
+        """
+        grams = parse_grams(grams)
+        if food_id not in self.intake_log.vectors:
+            raise ValueError(f"Unknown food_id: {food_id}")
+        entry = (user_id, food_id, grams, parse_time(eaten_at))
+        future = Future()
+        with self.queue_lock:
+            if self.closed:
+                raise ValueError("The intake writer is closed")
+            self.queue.put((entry, future))
+        return future
+
+    def log(self, user_id, food_id, grams, eaten_at=None):
+        """
+        Logs an entry, waiting until it's committed. Returns the entry's id.
+        """
+        return self.submit(user_id, food_id, grams, eaten_at).result()
+
+    def close(self):
+        """
+        Commits the entries still queued and stops the writer thread.
+        """
+        with self.queue_lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            group = [item]
+            deadline = time.perf_counter() + self.max_delay
+            stop = False
+            while len(group) < self.max_entries:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                group.append(item)
+            self.commit(group)
+            if stop:
+                return
+
+    def commit(self, group):
+        """
+        Writes a group of queued entries in one transaction and resolves their futures.
+        """
+        try:
+            with self.intake_log.lock, self.intake_log.connection:
+                ids = self.intake_log.append_group([entry + (None, None) for entry, _ in group])
+        except Exception as error:
+            for _, future in group:
+                future.set_exception(error)
+            return
+        for (_, future), entry_id in zip(group, ids):
+            future.set_result(entry_id)
+
+
+class IntakeRollups:
+    """
+    Rolling 7 and 30 day (or other windows) nutrient totals per user, kept in the intake log's database:
+    one row per user, window and last day of the window, holding a vector of amounts like daily_totals.
+    refresh() reads only the entries logged since the last refresh, and adds each one's nutrients to the windows containing the day it was eaten,
+    so back-dated entries, deletions and edits only change the windows they fall in.
+    """
+
+    def __init__(self, intake_log, windows=(7, 30)):
+        self.intake_log = intake_log
+        self.windows = windows
+
+    def refresh(self):
+        """
+        Applies the entries logged since the last refresh to the rolling totals. Returns the number of entries applied.
+        """
+        intake_log = self.intake_log
+        connection = intake_log.connection
+        with intake_log.lock, connection:
+            applied = 0
+            for days in self.windows:
+                row = connection.execute("SELECT last_entry FROM rollup_state WHERE days = ?", (days,)).fetchone()
+                last_entry = row[0] if row else 0
+                entries = connection.execute(
+                    "SELECT id, user_id, food_id, grams, day, amounts FROM intake_log WHERE id > ? ORDER BY id", (last_entry,)
+                ).fetchall()
+                if not entries:
+                    continue
+                # Add up each user-day's change first, then spread it over the windows ending on that day and the days after it
+                deltas = {}
+                for _, user_id, food_id, grams, day, amounts in entries:
+                    delta = intake_log.delta(food_id, grams) if amounts is None else intake_log.unpack(amounts)
+                    deltas[(user_id, day)] = deltas[(user_id, day)] + delta if (user_id, day) in deltas else delta
+                windows = {}
+                for (user_id, day), delta in deltas.items():
+                    first = date.fromisoformat(day)
+                    for offset in range(days):
+                        key = (user_id, (first + timedelta(days=offset)).isoformat())
+                        windows[key] = windows[key] + delta if key in windows else delta
+                rows = []
+                for (user_id, day), delta in windows.items():
+                    totals = self.totals_vector(user_id, days, day)
+                    rows.append((user_id, days, day, (delta if totals is None else totals + delta).tobytes()))
+                connection.executemany(
+                    "INSERT INTO rolling_totals (user_id, days, day, amounts) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, days, day) DO UPDATE SET amounts = excluded.amounts",
+                    rows,
+                )
+                connection.execute(
+                    "INSERT INTO rollup_state (days, last_entry) VALUES (?, ?) "
+                    "ON CONFLICT (days) DO UPDATE SET last_entry = excluded.last_entry",
+                    (days, entries[-1][0]),
+                )
+                applied = max(applied, len(entries))
+            return applied
+
+    def totals_vector(self, user_id, days, day):
+        row = self.intake_log.connection.execute(
+            "SELECT amounts FROM rolling_totals WHERE user_id = ? AND days = ? AND day = ?", (user_id, days, day)
+        ).fetchone()
+        return self.intake_log.unpack(row[0]) if row else None
+
+    def averages(self, user_id, day, days=7):
+        """
+        Returns a user's average daily amount of each nutrient over the days-long window ending on day (a date or an isoformat string),
+        after applying any new entries. Days without entries count as eating nothing.
+        """
+        if days not in self.windows:
+            raise ValueError(f"Provide one of the rolled up windows: {', '.join(map(str, self.windows))}")
+        self.refresh()
+        totals = self.totals_vector(user_id, days, str(day))
+        if totals is None:
+            return {}
+        return dict(zip(self.intake_log.nutrient_names, (totals / days).tolist()))
+
+    def progress(self, user_id, day, diet_rqmts, days=7):
+        """
+        Returns the average daily amounts over the window ending on day against a person's requirements (see against_requirements).
+        """
+        return against_requirements(self.averages(user_id, day, days), diet_rqmts)
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from intake import IntakeLog, IntakeWriter
+from loadgen import summarise
+from recipes import foods_and_recipes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure sustained throughput and latency of concurrent intake logging, with group commits or one transaction per entry."
+    )
+    parser.add_argument("--writers", type=int, default=64, help="concurrent threads logging entries")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to log entries for")
+    parser.add_argument("--mode", default="group", choices=["group", "single"])
+    parser.add_argument("--max-entries", type=int, default=500, help="most entries committed in one group")
+    parser.add_argument("--max-delay", type=float, default=0.005, help="most seconds an entry waits for its group to commit")
+    parser.add_argument("--no-durable", action="store_true", help="don't sync group commits to disk before acknowledging them")
+    parser.add_argument("--path", help="database to log to (a temporary one by default)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.path or os.path.join(directory, "intake.db")
+        results = run(path, args.writers, args.duration, args.mode, args.max_entries, args.max_delay, not args.no_durable)
+    print(json.dumps(results, indent=2))
+
+
+def run(path, writers, duration, mode="group", max_entries=500, max_delay=0.005, durable=True):
+    """
+    Logs random entries from writers threads for duration seconds, each waiting for its entry to be acknowledged before logging the next.
+    Returns the throughput and acknowledgement latency summary (see loadgen.summarise).
+    """
+    food_list, food_nutrients = foods_and_recipes()
+    intake_log = IntakeLog(path, food_nutrients)
+    if mode == "group":
+        writer = IntakeWriter(intake_log, max_entries, max_delay, durable)
+        log = writer.log
+    else:
+        if durable:
+            intake_log.connection.execute("PRAGMA synchronous = FULL")
+        log = intake_log.log
+    food_ids = food_list["food_id"].to_list()
+    latencies = []
+    errors = []
+
+    def write(user_id, deadline):
+        count = 0
+        while time.perf_counter() < deadline:
+            tic = time.perf_counter()
+            try:
+                log(user_id, random.choice(food_ids), random.randint(10, 300))
+            except Exception:
+                count += 1
+            latencies.append(time.perf_counter() - tic)
+        errors.append(count)
+
+    tic = time.perf_counter()
+    threads = [threading.Thread(target=write, args=(user_id, tic + duration)) for user_id in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - tic
+    if mode == "group":
+        writer.close()
+    intake_log.close()
+    return {"mode": mode, "writers": writers, **summarise(latencies, sum(errors), elapsed)}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import time
+from contextlib import contextmanager
+
+from stats import percentile
+
+# Stages of a keystroke on the search screen, timed by main.search_loop
+STAGES = ["filter", "slice", "draw", "refresh"]
+# Upper bounds (milliseconds) of the histogram's buckets, the last bucket holding slower keystrokes
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+class KeystrokeLatency:
+    """
+    Records, for each keystroke on the search screen, the time spent in each stage (filtering, slicing, drawing the pad and refreshing the screen),
+    the total time and the number of results. Stages can be nested, each stage's time excluding the stages timed inside it.
+    The keys pressed are kept too, so a session can be saved and replayed (see replay).
+    Set status to show the latency percentiles in a status line under the results.
+    """
+
+    def __init__(self, status=False):
+        self.status = status
+        self.keys = []
+        self.records = []
+        self._record = None
+        self._started = None
+        self._nested = []
+
+    def start(self, key):
+        self.keys.append(key)
+        self._record = {"key": key, **{f"{name}_ms": 0.0 for name in STAGES}}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        tic = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - tic
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            if self._record is not None:
+                self._record[f"{name}_ms"] += (elapsed - nested) * 1000
+
+    def finish(self, results):
+        """
+        Ends the current keystroke's record, with the number of results it found.
+        """
+        record = self._record
+        record["total_ms"] = (time.perf_counter() - self._started) * 1000
+        record["results"] = results
+        self.records.append(record)
+        self._record = None
+
+    def cancel(self):
+        """
+        Drops the current keystroke's record, for keys that leave the search screen without searching (its key is kept for replay).
+        """
+        self._record = None
+        self._started = None
+
+    def summary(self):
+        """
+        Returns the number of keystrokes, p50/p95/p99/max (milliseconds) of the total and of each stage, and a histogram of the totals.
+        """
+        summary = {"keystrokes": len(self.records)}
+        for name in ["total"] + STAGES:
+            values = sorted(record[f"{name}_ms"] for record in self.records)
+            summary[name] = {
+                "p50_ms": round(percentile(values, 0.5), 3) if values else None,
+                "p95_ms": round(percentile(values, 0.95), 3) if values else None,
+                "p99_ms": round(percentile(values, 0.99), 3) if values else None,
+                "max_ms": round(values[-1], 3) if values else None,
+            }
+        histogram = {f"<={bound}ms": 0 for bound in BUCKETS}
+        histogram[f">{BUCKETS[-1]}ms"] = 0
+        for record in self.records:
+            bucket = next((f"<={bound}ms" for bound in BUCKETS if record["total_ms"] <= bound), f">{BUCKETS[-1]}ms")
+            histogram[bucket] += 1
+        summary["histogram"] = histogram
+        return summary
+
+    def status_line(self):
+        if not self.records:
+            return ""
+        total = sorted(record["total_ms"] for record in self.records)
+        last = self.records[-1]
+        return (
+            f"{len(total)} keys  p50 {percentile(total, 0.5):.1f}  p95 {percentile(total, 0.95):.1f}  p99 {percentile(total, 0.99):.1f} ms"
+            f"  last {last['total_ms']:.1f} ms ({last['results']} results:"
+            + "".join(f" {name} {last[f'{name}_ms']:.1f}" for name in STAGES)
+            + ")"
+        )
+
+    def dump(self, path):
+        """
+        Writes the keys pressed, each keystroke's record and the summary to a JSON file.
+        """
+        with open(path, "w") as file:
+            json.dump({"keys": self.keys, "records": self.records, "summary": self.summary()}, file, indent=2)
+
+
+class ReplayScreen:
+    """
+    Stand-in for the curses screen that returns recorded keys from getch, and then the escape key, drawing nothing.
+    """
+
+    def __init__(self, keys, height=24, width=80):
+        self.keys = list(keys)
+        self.height = height
+        self.width = width
+
+    def getch(self):
+        return self.keys.pop(0) if self.keys else 27
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def clear(self):
+        pass
+
+    def addstr(self, *args):
+        pass
+
+    def refresh(self, *args):
+        pass
+
+
+class ReplayPad(ReplayScreen):
+    def __init__(self, height, width):
+        super().__init__([], height, width)
+
+    def erase(self):
+        pass
+
+
+def replay(keys, height=24, width=80, food_list=None):
+    """
+    Runs the search screen headlessly on a list of keys (e.g. the "keys" of a dumped session), without drawing,
+    so filtering and slicing are timed as on screen but drawing and refreshing only cost the stand-ins' calls.
+    food_list is the foods to search, by default the food list with home recipes (see main.search_loop).
+    Returns (the food_id it selected or None, the KeystrokeLatency of the run).
+    """
+    import main
+
+    latency = KeystrokeLatency()
+    food_id = main.search_loop(ReplayScreen(keys, height, width), ReplayPad, latency, food_list)
+    return food_id, latency
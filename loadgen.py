@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from stats import percentile
+
+# Requests sent by default: searches for common food words and a requirements calculation
+SEARCH_TERMS = ["apple", "bean", "bread", "broccoli", "cheese", "chicken", "egg", "milk", "rice", "salmon"]
+PERSON = {"name": "Load", "dob": "1990-01-01", "sex": "f", "height": 165, "weight": 60, "pal": 2}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput and latency of a running server.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--connections", type=int, default=16, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send requests for")
+    parser.add_argument("--mix", default="search", choices=["search", "requirements", "mixed"])
+    args = parser.parse_args()
+    results = asyncio.run(run(args.host, args.port, args.connections, args.duration, args.mix))
+    print(json.dumps(results, indent=2))
+
+
+def summarise(latencies, errors, elapsed):
+    """
+    Returns throughput and latency percentiles (in milliseconds) for a list of request latencies in seconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+    }
+
+
+def make_request(host, mix):
+    """
+    Returns the bytes of a random HTTP request for the request mix.
+    """
+    if mix == "requirements" or (mix == "mixed" and random.random() < 0.2):
+        body = json.dumps(PERSON).encode("utf-8")
+        head = f"POST /requirements HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        return head.encode("latin-1") + body
+    term = random.choice(SEARCH_TERMS)
+    # Send a prefix of the term, as typed
+    term = term[: random.randint(1, len(term))]
+    return f"GET /search?q={term}&limit=20 HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1")
+
+
+async def connection(host, port, mix, deadline, latencies):
+    """
+    Sends requests one after the other over one keep-alive connection until the deadline. Returns the number of errors.
+    """
+    errors = 0
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            tic = time.perf_counter()
+            writer.write(make_request(host, mix))
+            await writer.drain()
+            status = (await reader.readline()).split(b" ")
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - tic)
+            if len(status) < 2 or status[1] != b"200":
+                errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def run(host, port, connections, duration, mix):
+    """
+    Runs the load test and returns its summary.
+    """
+    latencies = []
+    tic = time.perf_counter()
+    errors = await asyncio.gather(
+        *[connection(host, port, mix, tic + duration, latencies) for _ in range(connections)]
+    )
+    return summarise(latencies, sum(errors), time.perf_counter() - tic)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,59 @@
-from Persons import Person
 import csv
 import json
-import polars as pl
-import curses
-import re
+from contextlib import nullcontext
 
+# Libraries are imported by the functions using them, so importing this module (e.g. to replay a session) loads nothing heavy
 
-def main():
-    food = curses.wrapper(search_food)
-    print(food)
+
+def main(latency=None):
+    import curses
+    import polars as pl
+    from recipes import foods_and_recipes
+
+    # Load the food list, with home recipes, once for the search screen and the selected food's name
+    food_list, _ = foods_and_recipes()
+    food_id = curses.wrapper(search_food, latency, food_list)
+    if food_id is not None:
+        print(food_list.filter(pl.col("food_id") == food_id).item(row=0, column="food"))
     # with open('dct.json', 'w') as file:
     #   json.dump(dct, file)
 
 
-def search_food(stdscr):
+def search_food(stdscr, latency=None, food_list=None):
+    import curses
+
     # Set colors to match terminal defaults
     curses.use_default_colors()
-    # Read parquet food files
-    food_list = pl.read_parquet("data/sources/food_list.parquet")
-    food_list = food_list.with_columns(
-        pl.col("food")
-        .str.to_lowercase()
-        .str.replace_all(r"[^a-z.]", "")
-        .alias("food_strip")
-    )
+    return search_loop(stdscr, curses.newpad, latency, food_list)
+
+
+def search_loop(stdscr, new_pad, latency=None, food_list=None):
+    """
+    Runs the search screen on stdscr, with pads made by new_pad(height, width) (curses.newpad, or a stand-in to run it headlessly).
+    Pass a latency.KeystrokeLatency to record the time spent on each keystroke.
+    food_list is the foods to search, by default the food list with home recipes (see recipes.foods_and_recipes).
+    """
+    # The search stack (rapidfuzz, numpy) is imported here, so new_user doesn't load it
+    import curses
+    import polars as pl
+    from recipes import foods_and_recipes
+    from search import FoodSearch, FuzzyRanker
+
+    # Time stages of each keystroke only if asked to
+    if latency is not None:
+        stage = latency.stage
+    else:
+        stage = lambda name: nullcontext()
+    # Load food search index, with home recipes, tolerating typos when there are no exact matches
+    if food_list is None:
+        food_list, _ = foods_and_recipes()
+    food_search = FoodSearch(food_list=food_list, ranker=FuzzyRanker())
+    # Narrow down from the previous keystroke's matches as the term is typed
+    search_session = food_search.session()
     # Establish filtered_food variable for search results
-    filtered_food = food_list
+    filtered_food = food_search.food_list
     # Establish scroll_counter variable for scrolling through search results
     scroll_counter = 0
-    food_nutrients = pl.read_parquet("data/sources/food_nutrients.parquet")
     # Prompt user for input
     prompt = "Enter food search term (or press the 'esc' key to quit): "
     user_input = ""
@@ -39,21 +64,29 @@ def search_food(stdscr):
     # Add a new pad
     height, width = stdscr.getmaxyx()
     height = height - 1
-    pad = curses.newpad(height, width)
+    # Keep the last line for the latency status line, if shown
+    if latency is not None and latency.status:
+        height = height - 1
+    pad = new_pad(height, width)
     pad.refresh(0, 0, 1, 0, height, width)
 
     # List keys which do not have any input
     # Update screen and pad
     while True:
         key = stdscr.getch()
+        if latency is not None:
+            latency.start(key)
         # exit if escape key (27) is hit, return nothing
         if key == 27:
+            if latency is not None:
+                latency.cancel()
             return None
-        # If enter key (10) hit, return 1st entry of filtered_food
+        # If enter key (10) hit, return the food_id of the 1st entry of filtered_food
         elif key == 10:
             if user_input and pl.count(filtered_food["food"]) > 0:
-                user_input = filtered_food.item(row=0, column="food")
-                return user_input
+                if latency is not None:
+                    latency.cancel()
+                return filtered_food.item(row=0, column="food_id")
         # If tab key (9) is hit, autocomplete
         # based on 1st entry of filtered food
         elif key == 9:
@@ -73,18 +106,9 @@ def search_food(stdscr):
             scroll_counter = 0
         # update the pad with search results for the user_input
         if user_input:
-            # Use stripped (lower_case alphabetic characters only) for search
-            user_input_stripped = re.sub(r"[^a-z.]", "", user_input.lower())
-            # Find foods that beging with user_input
-            food_begins = food_list.filter(
-                pl.col("food_strip").str.starts_with(user_input_stripped)
-            )
-            # From the remaining foods, find those that contain user_input
-            food_contains = food_list.filter(
-                ~pl.col("food_strip").str.starts_with(user_input_stripped)
-            ).filter(pl.col("food_strip").str.contains(user_input_stripped))
-            # Combine dataframes, prioritising foods that begin with user_input
-            filtered_food_full = pl.concat([food_begins, food_contains])
+            # Find foods matching user_input, prioritising foods that begin with user_input
+            with stage("filter"):
+                filtered_food_full = search_session.query(user_input)
             # create a windowed filtered_food to allow scrolling through results
             # Allow incremental scrolling
             if key == curses.KEY_DOWN and scroll_counter < (filtered_food_full.height - 1):
@@ -109,27 +133,45 @@ def search_food(stdscr):
             # reset the scroll counter to zero.
             if scroll_counter >= filtered_food_full.height:
                 scroll_counter = 0
-            filtered_food = filtered_food_full.slice(scroll_counter)
-            # Clear existing search results in pad
-            pad.erase()
-            # Add search results (filtered_food) to pad 
-            line = 0
-            for count, value in enumerate(filtered_food["food"]):
-                if count < height - 1:
-                    pad.addstr(line, 0, f"{value}\n")
-                    pad.refresh(0, 0, 1, 0, height, width)
-                    line = count + 1
+            with stage("slice"):
+                filtered_food = filtered_food_full.slice(scroll_counter)
+            with stage("draw"):
+                # Clear existing search results in pad
+                pad.erase()
+                # Add search results (filtered_food) to pad 
+                line = 0
+                for count, value in enumerate(filtered_food["food"]):
+                    if count < height - 1:
+                        pad.addstr(line, 0, f"{value}\n")
+                        with stage("refresh"):
+                            pad.refresh(0, 0, 1, 0, height, width)
+                        line = count + 1
         # When there isn't user input, clear the pad
         else:
-            pad.erase()
-            pad.refresh(0, 0, 1, 0, height, width)
+            with stage("draw"):
+                pad.erase()
+            with stage("refresh"):
+                pad.refresh(0, 0, 1, 0, height, width)
         # Update user_input shown on screen following key-press
-        stdscr.addstr(0, len(prompt), user_input)
-        stdscr.refresh()
-
+        with stage("draw"):
+            stdscr.addstr(0, len(prompt), user_input)
+        with stage("refresh"):
+            stdscr.refresh()
+        if latency is not None:
+            latency.finish(filtered_food_full.height if user_input else 0)
+            if latency.status:
+                stdscr.addstr(height + 1, 0, latency.status_line().ljust(width - 1)[: width - 1])
+                stdscr.refresh()
 
 def new_user():
+    import Persons
+    from Persons import Person
+    from users import UserStore
+
+    # Check new usernames against the stored users, and store the new one
+    Persons.user_store = UserStore()
     person = Person.get()
+    Persons.user_store.add(person)
 
     print(person)
     print(person.uid)
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import polars as pl
+from foods import load_food_table
+
+
+class RecipeBook:
+    """
+    Home recipes, logged and searched like foods: each has a name, ingredients ([food_id, grams] pairs, where a food_id can be another recipe's),
+    and optionally its cooked weight ('yield', grams, the ingredients' total by default) and cooking losses
+    ('retention', the fraction of a nutrient kept after cooking, e.g. {"Vitamin C (total ascorbic acid)": 0.7}).
+    Recipes get negative food_ids, so they never clash with FDC foods, counting down without reusing the ids of removed recipes
+    (intake entries may still refer to them).
+    Definitions are kept in path as JSON, and nutrient amounts per 100g in cache_path, each with a stamp of everything it was computed from
+    (its definition, its ingredients' nutrient amounts and the stamps of the recipes it uses),
+    so only recipes whose stamp changed are recomputed.
+    """
+
+    def __init__(self, path="data/recipes.json", cache_path="data/sources/recipe_nutrients.parquet", food_nutrients=None):
+        self.path = path
+        self.cache_path = cache_path
+        if food_nutrients is None:
+            food_nutrients = load_food_table("food_nutrients")
+        self.food_nutrients = food_nutrients
+        self.recipes = {}
+        self.next_food_id = -1
+        if os.path.exists(path):
+            with open(path) as file:
+                saved = json.load(file)
+            # Files saved before the next food_id was kept hold just the list of recipes
+            if isinstance(saved, list):
+                saved = {"recipes": saved}
+            self.recipes = {recipe["food_id"]: recipe for recipe in saved["recipes"]}
+            self.next_food_id = min([saved.get("next_food_id", -1), min(self.recipes, default=0) - 1])
+        self._nutrients = None
+        self._nutrients_cal = None
+
+    def save(self):
+        with open(self.path, "w") as file:
+            json.dump({"next_food_id": self.next_food_id, "recipes": list(self.recipes.values())}, file, indent=2)
+
+    def add(self, food, ingredients, yield_grams=None, retention=None):
+        """
+        Adds a recipe (replacing any recipe of the same name) and saves the recipes. Returns its food_id.
+        """
+        food = food.strip()
+        if not food:
+            raise ValueError("Must provide the recipe's name")
+        food_id = next((recipe["food_id"] for recipe in self.recipes.values() if recipe["food"] == food), None)
+        if food_id is None:
+            food_id = self.next_food_id
+        try:
+            ingredients = [[int(ingredient), float(grams)] for ingredient, grams in ingredients]
+        except (TypeError, ValueError):
+            raise ValueError("Provide ingredients as a list of [food_id, grams] pairs")
+        if not ingredients or any(grams <= 0 for _, grams in ingredients):
+            raise ValueError("Provide at least one ingredient, each with grams greater than 0")
+        known = set(self.food_nutrients["food_id"])
+        for ingredient, _ in ingredients:
+            if ingredient not in known and ingredient not in self.recipes:
+                raise ValueError(f"Unknown food_id: {ingredient}")
+            if ingredient == food_id or (ingredient in self.recipes and food_id in self.uses(ingredient)):
+                raise ValueError(f"A recipe can't include itself: {ingredient}")
+        if yield_grams is not None and float(yield_grams) <= 0:
+            raise ValueError("Provide a yield greater than 0 grams")
+        retention = {nutrient: float(factor) for nutrient, factor in (retention or {}).items()}
+        unknown = set(retention) - set(self.food_nutrients.columns[1:])
+        if unknown:
+            raise ValueError(f"Unknown nutrients: {', '.join(sorted(unknown))}")
+        self.recipes[food_id] = {
+            "food_id": food_id,
+            "food": food,
+            "ingredients": ingredients,
+            "yield": None if yield_grams is None else float(yield_grams),
+            "retention": retention,
+        }
+        self.next_food_id = min(self.next_food_id, food_id - 1)
+        self.save()
+        self._nutrients = None
+        self._nutrients_cal = None
+        return food_id
+
+    def rename(self, food_id, food):
+        """
+        Renames a recipe, keeping its food_id, and saves the recipes.
+        """
+        if food_id not in self.recipes:
+            raise ValueError(f"No recipe with food_id {food_id}")
+        food = food.strip()
+        if not food:
+            raise ValueError("Must provide the recipe's name")
+        if any(recipe["food"] == food for other, recipe in self.recipes.items() if other != food_id):
+            raise ValueError(f"There is already a recipe named {food}")
+        self.recipes[food_id]["food"] = food
+        self.save()
+
+    def remove(self, food_id):
+        """
+        Removes a recipe, unless another recipe uses it.
+        """
+        if food_id not in self.recipes:
+            raise ValueError(f"No recipe with food_id {food_id}")
+        users = [recipe["food"] for recipe in self.recipes.values() if food_id in dict(recipe["ingredients"])]
+        if users:
+            raise ValueError(f"Recipe is used by: {', '.join(users)}")
+        del self.recipes[food_id]
+        self.save()
+        self._nutrients = None
+        self._nutrients_cal = None
+
+    def uses(self, food_id):
+        """
+        Returns the food_ids of the recipes a recipe uses, directly or through other recipes.
+        """
+        used = set()
+        pending = [food_id]
+        while pending:
+            for ingredient, _ in self.recipes[pending.pop()]["ingredients"]:
+                if ingredient in self.recipes and ingredient not in used:
+                    used.add(ingredient)
+                    pending.append(ingredient)
+        return used
+
+    def order(self):
+        """
+        Returns the recipes' food_ids with every recipe after the recipes it uses.
+        """
+        ordered = []
+        done = set()
+
+        def visit(food_id):
+            if food_id in done:
+                return
+            done.add(food_id)
+            for ingredient, _ in self.recipes[food_id]["ingredients"]:
+                if ingredient in self.recipes:
+                    visit(ingredient)
+            ordered.append(food_id)
+
+        for food_id in sorted(self.recipes, reverse=True):
+            visit(food_id)
+        return ordered
+
+    def food_list(self):
+        """
+        Returns the recipes' food_id and food, like food_list.parquet.
+        """
+        return pl.DataFrame(
+            {
+                "food_id": [recipe["food_id"] for recipe in self.recipes.values()],
+                "food": [recipe["food"] for recipe in self.recipes.values()],
+            },
+            schema={"food_id": self.food_nutrients["food_id"].dtype, "food": pl.Utf8},
+        )
+
+    def nutrients(self):
+        """
+        Returns the recipes' nutrient amounts per 100g, like food_nutrients.parquet, recomputing only recipes whose stamp changed.
+        """
+        if self._nutrients is not None:
+            return self._nutrients
+        columns = self.food_nutrients.columns
+        cached = {}
+        if os.path.exists(self.cache_path):
+            cache = pl.read_parquet(self.cache_path)
+            if cache.columns == ["stamp"] + columns:
+                cached = {row[1]: (row[0], row) for row in cache.rows()}
+        ingredients = {ingredient for recipe in self.recipes.values() for ingredient, _ in recipe["ingredients"]}
+        # Hashes of the ingredients' rows, so a change to the dataset only invalidates recipes using foods that changed
+        food_hashes = {
+            row[0]: hashlib.sha256(repr(row).encode("utf-8")).hexdigest()
+            for row in self.food_nutrients.filter(pl.col("food_id").is_in(list(ingredients))).rows()
+        }
+        stamps = {}
+        rows = {}
+        changed = False
+        for food_id in self.order():
+            recipe = self.recipes[food_id]
+            stamp = hashlib.sha256(
+                json.dumps(
+                    [
+                        recipe,
+                        [stamps.get(ingredient) or food_hashes.get(ingredient) for ingredient, _ in recipe["ingredients"]],
+                    ],
+                    sort_keys=True,
+                ).encode("utf-8")
+            ).hexdigest()
+            stamps[food_id] = stamp
+            if food_id in cached and cached[food_id][0] == stamp:
+                rows[food_id] = cached[food_id][1][1:]
+            else:
+                rows[food_id] = self.compute(recipe, rows)
+                changed = True
+        nutrients = pl.DataFrame(
+            [rows[food_id] for food_id in sorted(rows, reverse=True)], schema=self.food_nutrients.schema, orient="row"
+        )
+        if changed or set(cached) != set(rows):
+            nutrients.select(
+                pl.Series("stamp", [stamps[food_id] for food_id in nutrients["food_id"]], dtype=pl.Utf8), pl.all()
+            ).write_parquet(self.cache_path)
+        self._nutrients = nutrients
+        return nutrients
+
+    def compute(self, recipe, recipe_rows):
+        """
+        Returns a recipe's row of nutrient amounts per 100g: its ingredients' amounts added up, less cooking losses, per 100g of its yield.
+        recipe_rows holds the rows of the recipes it uses.
+        """
+        ingredients = pl.DataFrame(recipe["ingredients"], schema=[("food_id", self.food_nutrients["food_id"].dtype), ("grams", pl.Float64)], orient="row")
+        sources = self.food_nutrients.filter(pl.col("food_id").is_in(ingredients["food_id"]))
+        used = [recipe_rows[ingredient] for ingredient in ingredients["food_id"] if ingredient in recipe_rows]
+        if used:
+            sources = pl.concat([sources, pl.DataFrame(used, schema=self.food_nutrients.schema, orient="row")])
+        weight = recipe["yield"] or ingredients["grams"].sum()
+        retention = recipe["retention"]
+        nutrients = self.food_nutrients.columns[1:]
+        totals = ingredients.join(sources, on="food_id").select(
+            [
+                # Nutrients none of the ingredients have data for stay empty
+                pl.when(pl.col(nutrient).is_not_null().any())
+                .then((pl.col(nutrient) * pl.col("grams") / 100).sum() * retention.get(nutrient, 1.0) * 100 / weight)
+                .otherwise(None)
+                .alias(nutrient)
+                for nutrient in nutrients
+            ]
+        )
+        return (recipe["food_id"],) + totals.row(0)
+
+    def nutrients_cal(self):
+        """
+        Returns the recipes' nutrient amounts per kcal (or per gram for 0 kcal recipes), like food_nutrients_cal.parquet.
+        """
+        if self._nutrients_cal is None:
+            nutrients = self.nutrients()
+            self._nutrients_cal = pl.concat(
+                [
+                    nutrients.filter(pl.col("Energy") > 0).with_columns(pl.exclude("food_id").truediv(pl.col("Energy"))),
+                    nutrients.filter(pl.col("Energy") == 0).with_columns(pl.exclude("food_id").truediv(100)),
+                ]
+            ).sort("food_id")
+        return self._nutrients_cal
+
+
+def foods_and_recipes(recipe_book=None):
+    """
+    Returns (food_list, food_nutrients): the food tables with the recipes added, to search and log recipes like foods.
+    """
+    food_list = load_food_table("food_list")
+    food_nutrients = load_food_table("food_nutrients")
+    if recipe_book is None:
+        recipe_book = RecipeBook(food_nutrients=food_nutrients)
+    if not recipe_book.recipes:
+        return food_list, food_nutrients
+    return (
+        pl.concat([food_list, recipe_book.food_list()]),
+        pl.concat([food_nutrients, recipe_book.nutrients()]),
+    )
@@ -0,0 +1,131 @@
+import os
+import re
+import numpy as np
+import polars as pl
+from rapidfuzz import fuzz, process, utils
+from foods import load_food_table
+
+# Leading amounts and units in free text meal log lines, e.g. "2 slices", "1/2 cup of", "100g"
+QUANTITY = re.compile(
+    r"^\s*(?:(?:\d+\s*/\s*\d+|\d+(?:[.,]\d+)?|(?:a|an|one|two|three|four|half)\b)\s*)+"
+    r"(?:(?:g|grams?|kg|mg|ml|l|oz|ounces?|lbs?|pounds?|cups?|tbsps?|tablespoons?|tsps?|teaspoons?|slices?|pieces?|pcs?|servings?|portions?|bowls?|glass(?:es)?|cans?|handfuls?|small|medium|large)\b\.?\s*)*"
+    r"(?:of\s+)?",
+    re.IGNORECASE,
+)
+
+
+def split_quantity(line):
+    """
+    Splits a meal log line into its leading quantity (e.g. "2 slices") and the food text (e.g. "whole wheat toast").
+    """
+    match = QUANTITY.match(line)
+    if not match or match.end() == len(line):
+        return "", line.strip()
+    return match.group(0).strip(), line[match.end() :].strip()
+
+
+class MealLogResolver:
+    """
+    Matches free text meal log lines (e.g. "2 slices whole wheat toast") to foods in food_list.parquet.
+    Catalogue names are pre-processed once with rapidfuzz.utils.default_process, and batches of distinct new lines are scored
+    against all of them at once with rapidfuzz.process.cdist on all cores.
+    Resolutions are cached by pre-processed text, so repeated lines (and past imports, with cache_path) aren't scored again.
+    The cache holds food_ids rather than rows, so it stays valid when food_list is rebuilt; lines whose food left the catalogue are scored again.
+    """
+
+    def __init__(
+        self,
+        food_list=None,
+        scorer=fuzz.token_set_ratio,
+        score_cutoff=60,
+        batch_size=1000,
+        workers=-1,
+        cache_path=None,
+    ):
+        if food_list is None:
+            food_list = load_food_table("food_list")
+        self.food_ids = food_list["food_id"]
+        self.foods = food_list["food"]
+        self.food_names = dict(zip(self.food_ids, self.foods))
+        self.choices = [utils.default_process(food) for food in self.foods]
+        self.scorer = scorer
+        self.score_cutoff = score_cutoff
+        self.batch_size = batch_size
+        self.workers = workers
+        self.cache_path = cache_path
+        # Pre-processed text: (food_id or None if no match, score)
+        self.cache = {}
+        if cache_path and os.path.exists(cache_path):
+            cache = pl.read_parquet(cache_path)
+            # Caches of rows in food_list, written before food_ids were cached, can't be trusted after a rebuild and are scored again
+            if "food_id" in cache.columns:
+                self.cache = {
+                    text: (food_id, score)
+                    for text, food_id, score in zip(cache["text"], cache["food_id"], cache["score"])
+                    if food_id is None or food_id in self.food_names
+                }
+
+    def save_cache(self):
+        """
+        Writes the cached resolutions to cache_path.
+        """
+        if not self.cache_path:
+            raise ValueError("Must provide a cache_path to save the cache to")
+        pl.DataFrame(
+            {
+                "text": list(self.cache),
+                "food_id": [food_id for food_id, _ in self.cache.values()],
+                "score": [score for _, score in self.cache.values()],
+            },
+            schema={"text": pl.Utf8, "food_id": self.food_ids.dtype, "score": pl.Float64},
+        ).write_parquet(self.cache_path)
+
+    def score(self, texts):
+        """
+        Scores pre-processed texts not yet in the cache against all catalogue choices, in batches, and caches the best match of each.
+        """
+        texts = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            scores = process.cdist(
+                batch,
+                self.choices,
+                scorer=self.scorer,
+                score_cutoff=self.score_cutoff,
+                dtype=np.uint8,
+                workers=self.workers,
+            )
+            rows = scores.argmax(axis=1)
+            for text, row, score in zip(batch, rows, scores[np.arange(len(batch)), rows]):
+                self.cache[text] = (self.food_ids[int(row)], float(score)) if score else (None, 0.0)
+
+    def resolve(self, lines):
+        """
+        Returns a dataframe with, for each line, its quantity, food text, and the best matching food_id and food with a confidence from 0 to 1.
+        food_id and food are null where no food scores at least score_cutoff. lines can be any iterable of strings, e.g. a file.
+        """
+        lines = list(lines)
+        quantities = []
+        texts = []
+        for line in lines:
+            quantity, text = split_quantity(line)
+            quantities.append(quantity)
+            texts.append(utils.default_process(text))
+        self.score(texts)
+        food_ids = [self.cache[text][0] for text in texts]
+        return pl.DataFrame(
+            {
+                "line": lines,
+                "quantity": quantities,
+                "food_id": food_ids,
+                "food": [self.food_names.get(food_id) for food_id in food_ids],
+                "confidence": [self.cache[text][1] / 100 for text in texts],
+            },
+            schema={
+                "line": pl.Utf8,
+                "quantity": pl.Utf8,
+                "food_id": self.food_ids.dtype,
+                "food": pl.Utf8,
+                "confidence": pl.Float64,
+            },
+        )
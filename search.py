@@ -0,0 +1,212 @@
+import time
+import numpy as np
+import polars as pl
+from rapidfuzz import fuzz, process
+from foods import food_strip, load_food_table, strip_food
+
+
+def rank_begins_contains(foods, term):
+    """
+    Default ranker: foods whose stripped name begins with the (stripped) search term score 1, those that only contain it score 0.5.
+    Returns the matching foods ordered by score, keeping the food list order within each score.
+    """
+    return (
+        foods.filter(pl.col("food_strip").str.contains(term, literal=True))
+        .with_columns(
+            pl.when(pl.col("food_strip").str.starts_with(term))
+            .then(1.0)
+            .otherwise(0.5)
+            .alias("score")
+        )
+        .sort(["score", "row"], descending=[True, False])
+    )
+
+
+# Matches for a longer term are always among the matches for its beginning
+rank_begins_contains.narrows = True
+
+
+def bigrams(text):
+    """
+    Returns the set of 2 character substrings of text.
+    """
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class FuzzyRanker:
+    """
+    Ranker that tolerates typos (e.g. "brocoli"): uses rank_begins_contains, and when it finds fewer than min_results foods,
+    adds foods scored with a rapidfuzz scorer on the stripped names, scaled to between 0 and 0.5 so they rank below exact matches.
+    Only foods sharing enough 2 character substrings with the term, and long enough, are scored,
+    most promising first and in chunks, stopping once time_budget seconds have passed so keystrokes stay fast.
+    """
+
+    narrows = False
+
+    def __init__(
+        self,
+        scorer=fuzz.partial_ratio,
+        score_cutoff=75,
+        min_results=1,
+        min_length=3,
+        max_edits=2,
+        time_budget=0.05,
+        chunk_size=2000,
+    ):
+        self.scorer = scorer
+        self.score_cutoff = score_cutoff
+        self.min_results = min_results
+        self.min_length = min_length
+        self.max_edits = max_edits
+        self.time_budget = time_budget
+        self.chunk_size = chunk_size
+        # Index of the rows of each 2 character substring, built for the food list on first use
+        self._indexed = None
+        self._postings = None
+        self._lengths = None
+
+    def index(self, foods):
+        """
+        Builds the 2 character substring index of foods' stripped names, if it isn't built for these foods already.
+        """
+        if self._indexed is foods:
+            return
+        postings = {}
+        for position, name in enumerate(foods["food_strip"]):
+            for bigram in bigrams(name):
+                postings.setdefault(bigram, []).append(position)
+        self._postings = {bigram: np.array(rows, dtype=np.int64) for bigram, rows in postings.items()}
+        self._lengths = foods["food_strip"].str.lengths().to_numpy()
+        self._indexed = foods
+
+    def candidates(self, foods, term):
+        """
+        Returns the positions of foods that could be within max_edits of the term, those sharing the most 2 character substrings first.
+        """
+        self.index(foods)
+        term_bigrams = bigrams(term)
+        postings = [self._postings[bigram] for bigram in term_bigrams if bigram in self._postings]
+        if not postings:
+            return np.array([], dtype=np.int64)
+        # Each edit changes at most 2 of the term's 2 character substrings
+        overlap = np.bincount(np.concatenate(postings), minlength=foods.height)
+        minimum = max(1, len(term_bigrams) - 2 * self.max_edits)
+        positions = np.flatnonzero(
+            (overlap >= minimum) & (self._lengths >= len(term) - self.max_edits)
+        )
+        return positions[np.argsort(-overlap[positions], kind="stable")]
+
+    def __call__(self, foods, term):
+        matches = rank_begins_contains(foods, term)
+        if matches.height >= self.min_results or len(term) < self.min_length:
+            return matches
+        deadline = time.perf_counter() + self.time_budget
+        positions = self.candidates(foods, term)
+        names = foods["food_strip"]
+        found = []
+        for start in range(0, len(positions), self.chunk_size):
+            chunk = positions[start : start + self.chunk_size]
+            for _, score, index in process.extract(
+                term,
+                names.take(chunk).to_list(),
+                scorer=self.scorer,
+                score_cutoff=self.score_cutoff,
+                limit=None,
+            ):
+                found.append((int(chunk[index]), score))
+            if time.perf_counter() > deadline:
+                break
+        if not found:
+            return matches
+        fuzzy = (
+            foods[[position for position, _ in found]]
+            .with_columns(pl.Series("score", [score / 200 for _, score in found]))
+            .join(matches.select("row"), on="row", how="anti")
+            .sort(["score", "row"], descending=[True, False])
+        )
+        return pl.concat([matches, fuzzy])
+
+
+class FoodSearch:
+    """
+    Food name search, independent of the curses UI in main.search_food.
+    Loads the food list once, and ranks matches for a search term with a ranker:
+    a function taking the food list (with 'row', 'food_id', 'food' and 'food_strip' columns) and a stripped search term,
+    and returning the matching rows ordered best first with a 'score' column.
+    Rankers with a true 'narrows' attribute only ever match a subset of the previous matches when the term is extended.
+    FoodSearch keeps no state between queries, so one can be shared by threads; use session() to narrow down matches as a term is typed.
+    """
+
+    def __init__(self, food_list=None, ranker=rank_begins_contains):
+        if food_list is None:
+            food_list = load_food_table("food_list")
+        self.food_list = (
+            food_list.select(pl.col("food_id"), pl.col("food"))
+            .with_row_count("row")
+            .with_columns(food_strip())
+        )
+        self.ranker = ranker
+        # Let rankers with an index build it up front, rather than on the first keystroke
+        if hasattr(ranker, "index"):
+            ranker.index(self.food_list)
+
+    def session(self):
+        """
+        Returns a new SearchSession of this search, for a user typing a term.
+        """
+        return SearchSession(self)
+
+    def query(self, text, limit=None, offset=0):
+        """
+        Returns foods matching text, best first, with food_id, food and score columns.
+        Use limit and offset to page through results.
+        """
+        if not text:
+            return pl.DataFrame(
+                schema={"food_id": self.food_list["food_id"].dtype, "food": pl.Utf8, "score": pl.Float64}
+            )
+        return self.results(self.ranker(self.food_list, strip_food(text)), limit, offset)
+
+    def results(self, matches, limit=None, offset=0):
+        """
+        Returns the food_id, food and score columns of a ranker's matches, sliced by limit and offset.
+        """
+        return matches.select(pl.col("food_id"), pl.col("food"), pl.col("score")).slice(offset, limit)
+
+
+class SearchSession:
+    """
+    Queries of one user typing a term (e.g. on the search screen), on a FoodSearch that may be shared with other sessions.
+    Keeps the foods matching its previous term, to narrow down from as the term is typed.
+    """
+
+    def __init__(self, food_search):
+        self.food_search = food_search
+        self._last_term = None
+        self._last_matches = None
+
+    def candidates(self, term):
+        """
+        Returns the foods that may match a stripped search term.
+        Foods containing a term also contain the term's beginning, so when the term extends the previous one only its matches are searched.
+        """
+        if (
+            getattr(self.food_search.ranker, "narrows", False)
+            and self._last_term is not None
+            and term.startswith(self._last_term)
+        ):
+            return self._last_matches
+        return self.food_search.food_list
+
+    def query(self, text, limit=None, offset=0):
+        """
+        Returns foods matching text, best first, with food_id, food and score columns (see FoodSearch.query).
+        """
+        if not text:
+            return self.food_search.query(text)
+        term = strip_food(text)
+        matches = self.food_search.ranker(self.candidates(term), term)
+        if getattr(self.food_search.ranker, "narrows", False):
+            self._last_term = term
+            self._last_matches = matches.drop("score")
+        return self.food_search.results(matches, limit, offset)
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import Persons
+from Persons import Person
+from foods import intake_totals
+from recipes import foods_and_recipes
+from search import FoodSearch
+from shared import SharedTables
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve food search and requirements over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="threads for search and intake computations")
+    parser.add_argument("--processes", type=int, help="processes for requirement computations (CPUs by default)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.processes))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # Stopped with Ctrl-C or SIGTERM
+        pass
+
+
+class Service:
+    """
+    Loads the food index, nutrient table and reference files once, and handles requests:
+    - GET /search?q=<text>&limit=<n>&offset=<n>: foods matching text, best first (see search.FoodSearch).
+    - POST /requirements with a person (see Person.from_dict): the person's diet_rqmts.
+    - POST /intake with {"entries": [[food_id, grams], ...]} and optionally "person": nutrient totals,
+      with the person's requirements if given.
+    Requirements are computed on process_executor if given, so they don't hold the GIL of the threads serving the other requests.
+    """
+
+    def __init__(self, process_executor=None):
+        self.process_executor = process_executor
+        # Home recipes are searched and logged like foods
+        food_list, self.food_nutrients = foods_and_recipes()
+        # FoodSearch keeps no state between queries, so concurrent searches share it
+        self.food_search = FoodSearch(food_list=food_list)
+        # Keep the reference files in memory instead of reading them for every person
+        Persons.preload_data_files()
+
+    def search(self, text, limit=50, offset=0):
+        try:
+            limit = int(limit)
+            offset = int(offset)
+        except (TypeError, ValueError):
+            raise ValueError("Provide whole numbers for limit and offset")
+        results = self.food_search.query(text, limit=limit, offset=offset)
+        return {"results": results.to_dicts()}
+
+    def requirements(self, body):
+        return requirements(body)
+
+    def intake(self, body):
+        entries = body.get("entries")
+        if not isinstance(entries, list):
+            raise ValueError("Provide entries as a list of [food_id, grams] pairs")
+        try:
+            totals = intake_totals(entries, self.food_nutrients)
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"Provide entries as a list of [food_id, grams] pairs ({error})")
+        result = {"totals": totals}
+        if body.get("person"):
+            if self.process_executor is not None:
+                result["requirements"] = self.process_executor.submit(requirements, body["person"]).result()
+            else:
+                result["requirements"] = requirements(body["person"])
+        return result
+
+
+def requirements(person):
+    """
+    Returns the diet_rqmts of a person (see Person.from_dict). Runs in the server's worker processes.
+    """
+    return Person.from_dict(person).diet_rqmts
+
+
+def attach_shared_tables(prefix):
+    """
+    Initialises a worker process: attaches it to the server's shared tables, so Person reads the data files from shared memory.
+    """
+    SharedTables.attach(prefix)
+
+
+async def serve(host, port, workers, processes=None):
+    """
+    Runs the service until cancelled. Connections are kept alive between requests,
+    and requests are computed on a thread pool so the event loop keeps accepting and reading requests meanwhile.
+    Requirements, pure Python computations that would hold the GIL, are computed on a pool of processes,
+    which read the reference files from shared memory (see shared.SharedTables) rather than each holding a copy.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    shared_tables = await loop.run_in_executor(executor, SharedTables.create, f"nutripy_{os.getpid()}")
+    # Worker processes are spawned, as forking a process running polars' thread pool can deadlock the children
+    process_executor = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=attach_shared_tables,
+        initargs=(shared_tables.prefix,),
+    )
+    service = await loop.run_in_executor(executor, Service, process_executor)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as error:
+                    # The rest of a malformed request can't be told apart from the next one, so the connection is closed
+                    await write_response(writer, 400, {"error": str(error)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await respond(loop, executor, process_executor, service, method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    # Stop on SIGTERM as on Ctrl-C, so the worker processes are shut down too
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+        process_executor.shutdown(wait=True, cancel_futures=True)
+        shared_tables.close(unlink=True)
+
+
+async def read_request(reader):
+    """
+    Reads one HTTP/1.1 request. Returns (method, target, headers, body), or None once the client closes the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ValueError("Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise ValueError("Content-Length must be a whole number of bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+async def write_response(writer, status, payload, keep_alive=True):
+    """
+    Writes an HTTP/1.1 response with a JSON payload.
+    """
+    data = json.dumps(payload).encode("utf-8")
+    writer.write(
+        (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1")
+        + data
+    )
+    await writer.drain()
+
+
+async def respond(loop, executor, process_executor, service, method, target, body):
+    """
+    Routes a request to the service, returning (status, payload).
+    GET handlers are called with the query's parameters, POST handlers with the parsed JSON body.
+    """
+    url = urlsplit(target)
+    # (method, executor to compute on, handler)
+    routes = {
+        "/search": ("GET", executor, service.search),
+        "/requirements": ("POST", process_executor, requirements),
+        "/intake": ("POST", executor, service.intake),
+    }
+    if url.path not in routes:
+        return 404, {"error": f"Unknown path: {url.path}"}
+    route_method, route_executor, handler = routes[url.path]
+    if method != route_method:
+        return 405, {"error": f"Use {route_method} for {url.path}"}
+    try:
+        if method == "POST":
+            parsed = json.loads(body or b"{}")
+            if not isinstance(parsed, dict):
+                raise ValueError("Request body must be a JSON object")
+            arguments = (parsed,)
+        else:
+            query = parse_qs(url.query)
+            arguments = (query.get("q", [""])[0], query.get("limit", [50])[0], query.get("offset", [0])[0])
+        return 200, await loop.run_in_executor(route_executor, handler, *arguments)
+    except json.JSONDecodeError:
+        return 400, {"error": "Request body must be JSON"}
+    except ValueError as error:
+        return 400, {"error": str(error)}
+    except Exception:
+        # The details stay in the server's log, not in responses
+        logger.exception("Error handling %s %s", method, url.path)
+        return 500, {"error": "Internal server error"}
+
+
+if __name__ == "__main__":
+    main()
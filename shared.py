@@ -0,0 +1,207 @@
+import atexit
+import json
+import re
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import Persons
+from foods import load_food_table
+
+class SharedTables:
+    """
+    Food tables and reference data held in multiprocessing.shared_memory segments, for pools of worker processes.
+    A parent process builds them once with SharedTables.create(), and workers attach read-only with SharedTables.attach(),
+    so adding workers doesn't add copies of the data.
+    Segments hold:
+    - matrix: food_nutrients as a float64 array (foods x nutrients), with NaN where a food has no data for a nutrient.
+    - food_ids: the food_id of each row of the matrix, sorted.
+    - names / names_strip: food descriptions, and their stripped versions used for searching, as newline separated UTF-8,
+      with the offset of each row's line in name_offsets / strip_offsets.
+    - the contents of the data files used by Person.diet_rqmts: the reference data files, and the requirements bundle if there is one.
+    """
+
+    def __init__(self, prefix, segments, manifest):
+        self.prefix = prefix
+        self._segments = segments
+        self.nutrients = manifest["nutrients"]
+        self.food_ids = self._array(manifest["arrays"]["food_ids"])
+        self.matrix = self._array(manifest["arrays"]["matrix"])
+        self.name_offsets = self._array(manifest["arrays"]["name_offsets"])
+        self.strip_offsets = self._array(manifest["arrays"]["strip_offsets"])
+        self.names = segments[manifest["buffers"]["names"]].buf
+        self.names_strip = segments[manifest["buffers"]["names_strip"]].buf
+        self.files = {
+            path: segments[segment].buf[:size]
+            for path, (segment, size) in manifest["files"].items()
+        }
+
+    def _array(self, spec):
+        array = np.ndarray(
+            tuple(spec["shape"]), dtype=spec["dtype"], buffer=self._segments[spec["segment"]].buf
+        )
+        array.flags.writeable = False
+        return array
+
+    @classmethod
+    def create(cls, prefix="nutripy"):
+        """
+        Builds the shared segments from the food tables and reference files. Call close(unlink=True) once workers are done.
+        """
+        segments = {}
+
+        def new_segment(name, data):
+            segment = shared_memory.SharedMemory(
+                name=f"{prefix}_{name}", create=True, size=max(len(data), 1)
+            )
+            segment.buf[: len(data)] = data
+            segments[segment.name] = segment
+            return segment.name
+
+        food_nutrients = load_food_table("food_nutrients").sort("food_id")
+        food_list = load_food_table("food_list")
+        # Food names in the same order as the matrix rows
+        names = (
+            food_nutrients.select("food_id")
+            .join(food_list, on="food_id", how="left")["food"]
+            .fill_null("")
+            .to_list()
+        )
+        manifest = {
+            "nutrients": food_nutrients.drop("food_id").columns,
+            "arrays": {},
+            "buffers": {},
+            "files": {},
+        }
+        arrays = {
+            "food_ids": food_nutrients["food_id"].to_numpy().astype(np.int64),
+            "matrix": np.ascontiguousarray(
+                food_nutrients.drop("food_id").to_numpy().astype(np.float64)
+            ),
+        }
+        # One line per food, in matrix row order, with the offset of each line
+        encoded = [(name.replace("\n", " ") + "\n").encode("utf-8") for name in names]
+        arrays["name_offsets"] = np.concatenate(
+            [[0], np.cumsum([len(name) for name in encoded])]
+        ).astype(np.int64)
+        # Stripped names are matched as in search_food
+        encoded_strip = [
+            (re.sub(r"[^a-z.]", "", name.lower()) + "\n").encode("utf-8") for name in names
+        ]
+        arrays["strip_offsets"] = np.concatenate(
+            [[0], np.cumsum([len(name) for name in encoded_strip])]
+        ).astype(np.int64)
+        for name, array in arrays.items():
+            manifest["arrays"][name] = {
+                "segment": new_segment(name, array.tobytes()),
+                "dtype": array.dtype.str,
+                "shape": array.shape,
+            }
+        manifest["buffers"]["names"] = new_segment("names", b"".join(encoded))
+        manifest["buffers"]["names_strip"] = new_segment("names_strip", b"".join(encoded_strip))
+        for i, path in enumerate(Persons.shared_data_paths()):
+            with open(path, "rb") as file:
+                data = file.read()
+            manifest["files"][path] = (new_segment(f"file{i}", data), len(data))
+        manifest = json.dumps(manifest).encode("utf-8")
+        new_segment("manifest", len(manifest).to_bytes(8, "little") + manifest)
+        return cls(prefix, segments, json.loads(manifest))
+
+    @classmethod
+    def attach(cls, prefix="nutripy"):
+        """
+        Attaches to segments created by SharedTables.create() in another process, and makes Person use the shared data files.
+        """
+        segments = {}
+
+        def open_segment(name):
+            try:
+                segment = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Before python 3.13 attaching registers the segment with the resource tracker, which would remove it
+                # when this process exits (or clash with the creating process' registration), so skip registering.
+                register = resource_tracker.register
+                resource_tracker.register = lambda name, rtype: None
+                try:
+                    segment = shared_memory.SharedMemory(name=name)
+                finally:
+                    resource_tracker.register = register
+            segments[name] = segment
+            return segment
+
+        header = open_segment(f"{prefix}_manifest").buf
+        size = int.from_bytes(header[:8], "little")
+        manifest = json.loads(bytes(header[8 : 8 + size]))
+        for spec in manifest["arrays"].values():
+            open_segment(spec["segment"])
+        for name in manifest["buffers"].values():
+            open_segment(name)
+        for name, _ in manifest["files"].values():
+            open_segment(name)
+        tables = cls(prefix, segments, manifest)
+        Persons.data_files.update(tables.files)
+        # Release the views before the segments are closed when the worker exits
+        atexit.register(tables.close)
+        return tables
+
+    def close(self, unlink=False):
+        """
+        Detaches from the segments, and removes them if unlink (from the process that created them).
+        """
+        for path in self.files:
+            Persons.data_files.pop(path, None)
+        self.food_ids = self.matrix = self.name_offsets = self.strip_offsets = None
+        self.names = self.names_strip = None
+        self.files = {}
+        for segment in self._segments.values():
+            segment.close()
+            if unlink:
+                segment.unlink()
+        self._segments = {}
+
+    def food(self, row):
+        """
+        Returns the description of the food in a row of the matrix.
+        """
+        start, end = self.name_offsets[row], self.name_offsets[row + 1] - 1
+        return bytes(self.names[start:end]).decode("utf-8")
+
+    def row(self, food_id):
+        """
+        Returns the matrix row index of a food_id, or None if there isn't one.
+        """
+        row = int(np.searchsorted(self.food_ids, food_id))
+        if row < len(self.food_ids) and self.food_ids[row] == food_id:
+            return row
+        return None
+
+    def food_nutrients(self, food_id):
+        """
+        Returns a dictionary of the nutrient amounts (per 100g) a food has data for.
+        """
+        row = self.row(food_id)
+        if row is None:
+            raise ValueError(f"Unknown food_id: {food_id}")
+        return {
+            nutrient: float(amount)
+            for nutrient, amount in zip(self.nutrients, self.matrix[row])
+            if not np.isnan(amount)
+        }
+
+    def search(self, term):
+        """
+        Returns the matrix rows of foods whose stripped name contains the search term, those beginning with it first,
+        scanning the shared names buffer without copying it.
+        """
+        term = re.sub(r"[^a-z.]", "", term.lower()).encode("utf-8")
+        if not term:
+            return []
+        begins = []
+        contains = []
+        for match in re.finditer(re.escape(term), self.names_strip):
+            row = int(np.searchsorted(self.strip_offsets, match.start(), side="right")) - 1
+            if match.start() == self.strip_offsets[row]:
+                begins.append(row)
+            elif not contains or contains[-1] != row:
+                contains.append(row)
+        # A food beginning with the term may also contain it again later on
+        begins_set = set(begins)
+        return begins + [row for row in contains if row not in begins_set]
@@ -0,0 +1,7 @@
+def percentile(values, fraction):
+    """
+    Returns the value at a fraction (0 to 1) of sorted values, using the nearest rank.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
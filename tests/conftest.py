@@ -0,0 +1,22 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    Runs the test from a scratch directory holding a copy of the repo's data/, as the modules read and write data/... relative to it.
+    """
+    import Persons
+
+    shutil.copytree(os.path.join(ROOT, "data"), tmp_path / "data")
+    (tmp_path / "data" / "sources").mkdir(exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Persons, "user_store", None)
+    return tmp_path / "data"
@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+import acquisitions
+import benchmarks
+import foods
+
+TABLES = [
+    "food_list.parquet",
+    "food_nutrients.parquet",
+    "food_nutrients_cal.parquet",
+    "food_rankings.parquet",
+    "food_zone_maps.parquet",
+    "food_nutrients_sparse.parquet",
+    "food_offsets.parquet",
+    "nutrient_dictionary.parquet",
+    "food_list.arrow",
+    "food_nutrients.arrow",
+    "food_nutrients_cal.arrow",
+]
+
+
+def create_food_tables(memory_budget, copy_to):
+    acquisitions.create_food_tables(memory_budget)
+    shutil.copytree("data/sources", copy_to, ignore=shutil.ignore_patterns("FoodData_Central_*"))
+
+
+def read_table(path):
+    return pl.read_parquet(path) if path.endswith(".parquet") else pl.read_ipc(path)
+
+
+def test_partitioned_etl_matches_in_memory_etl(data_dir, tmp_path):
+    benchmarks.make_fdc_fixtures(str(tmp_path), foods=150)
+    create_food_tables(None, tmp_path / "in_memory")
+    # A budget this small splits the foods into several partitions and the derived tables into several batches
+    create_food_tables(600000, tmp_path / "partitioned")
+    assert not os.path.exists("data/sources/partitions")
+    for table in TABLES:
+        in_memory = read_table(str(tmp_path / "in_memory" / table))
+        partitioned = read_table(str(tmp_path / "partitioned" / table))
+        # Amounts are summed in a different order, so may differ in their last bit
+        assert_frame_equal(in_memory, partitioned, check_exact=False, rtol=1e-12)
+    food_nutrients = read_table(str(tmp_path / "partitioned" / "food_nutrients.parquet"))
+    assert food_nutrients["food_id"].is_sorted()
+    nutrients = acquisitions.nutrient_order()
+    assert food_nutrients.columns[1:] == [nutrient for nutrient in nutrients if nutrient in food_nutrients.columns]
+
+
+def test_sparse_nutrient_ids_survive_column_changes(data_dir):
+    path = "data/sources/food_nutrients.parquet"
+    pl.DataFrame({"food_id": [1, 2], "Energy": [50.0, 0.0], "Iron": [1.0, None], "Zinc": [None, 2.0]}).write_parquet(path)
+    acquisitions.extract_food_nutrients_sparse()
+    first = pl.read_parquet("data/sources/nutrient_dictionary.parquet")
+    # Rebuild with a nutrient dropped, one added and the columns reordered
+    pl.DataFrame({"food_id": [1, 2], "Energy": [50.0, 0.0], "Calcium": [3.0, None], "Iron": [1.5, None]}).write_parquet(path)
+    acquisitions.extract_food_nutrients_sparse()
+    second = pl.read_parquet("data/sources/nutrient_dictionary.parquet")
+    ids = dict(zip(second["nutrient"], second["nutrient_id"]))
+    assert {nutrient: ids[nutrient] for nutrient in first["nutrient"]} == dict(zip(first["nutrient"], first["nutrient_id"]))
+    assert ids["Calcium"] not in first["nutrient_id"].to_list()
+    assert_frame_equal(foods.read_sparse_rows(), pl.read_parquet(path))
+    assert foods.read_sparse_row(1) == {"Energy": 50.0, "Calcium": 3.0, "Iron": 1.5}
+
+
+def test_food_ids_dont_depend_on_row_order():
+    survey_food = pl.DataFrame({"fdc_id": [10, 11, 12], "description": ["Apple", "Pear", "Apple"]})
+    legacy_food = pl.DataFrame(
+        {"fdc_id": [24, 21, 22, 23, 20], "description": ["Plum", "Plum", "Apples", "Plum", "Kiwi"]}
+    )
+    matched_food = {"Apples": "Apple"}
+    expected = acquisitions.assign_food_ids(survey_food, legacy_food, matched_food)
+    for seed in range(10):
+        shuffled = acquisitions.assign_food_ids(
+            survey_food.sample(fraction=1.0, shuffle=True, seed=seed),
+            legacy_food.sample(fraction=1.0, shuffle=True, seed=seed),
+            matched_food,
+        )
+        for frame, other in zip(expected, shuffled):
+            assert_frame_equal(frame.sort(frame.columns), other.sort(other.columns))
+    food_ids = dict(expected[2].select("food", "food_id").iter_rows())
+    assert food_ids == {"Apple": 10, "Pear": 11, "Plum": 21, "Kiwi": 20}
@@ -0,0 +1,29 @@
+import io
+import json
+
+import batch
+
+
+class StubService:
+    def search(self, text, limit, offset):
+        return {"q": text}
+
+    def requirements(self, person):
+        raise KeyError(person.get("name"))
+
+    def intake(self, body):
+        raise RuntimeError()
+
+
+def test_every_record_gets_a_result_line(monkeypatch):
+    monkeypatch.setattr(batch, "Service", StubService)
+    lines = ['{"q": "oat"}', "not json", '{"name": "x"}', '{"entries": []}', "[1]", '{"q": "milk"}']
+    output = io.StringIO()
+    batch.run(iter(lines), output)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result["line"] for result in results] == [1, 2, 3, 4, 5, 6]
+    assert results[0]["result"] == {"q": "oat"} and results[5]["result"] == {"q": "milk"}
+    assert results[1]["error"] == "Line is not valid JSON"
+    assert results[2]["error"] == "'x'"
+    assert results[3]["error"] == "RuntimeError"
+    assert results[4]["error"] == "Each line must be a JSON object"
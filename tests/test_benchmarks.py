@@ -0,0 +1,12 @@
+import benchmarks
+
+
+def test_benchmarks_run_end_to_end(data_dir, monkeypatch):
+    # Persons keeps the reference tables it compiled in the benchmarks' temporary directory
+    import Persons
+
+    monkeypatch.setattr(Persons, "reference_tables", {})
+    results = benchmarks.run(foods=30, entries=50, repeat=1)
+    names = results["benchmarks"].keys()
+    assert {"search.keystrokes", "diet_rqmts", "intake.totals", "intake.log_and_roll_up"} <= set(names)
+    assert all(timings["repeats"] == 1 for timings in results["benchmarks"].values())
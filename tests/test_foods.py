@@ -0,0 +1,102 @@
+import polars as pl
+import pytest
+
+import acquisitions
+import foods
+
+FOOD_LIST = pl.DataFrame(
+    {
+        "food_id": [1, 2, 3, 4],
+        "food": ["Macaroni and cheese", "Cheese, cheddar", "Beans, black", "Macaroni, cooked"],
+    }
+)
+# Amounts per kcal
+FOOD_NUTRIENTS_CAL = pl.DataFrame(
+    {
+        "food_id": [1, 2, 3, 4],
+        "Energy": [1.0, 1.0, 1.0, 1.0],
+        "Total Protein": [0.04, 0.06, 0.07, 0.03],
+        "Sodium": [2.0, 1.5, None, 0.0],
+    }
+)
+
+
+@pytest.fixture
+def food_tables(data_dir):
+    FOOD_LIST.write_parquet(str(data_dir / "sources" / "food_list.parquet"))
+    FOOD_NUTRIENTS_CAL.write_parquet(str(data_dir / "sources" / "food_nutrients_cal.parquet"))
+    acquisitions.extract_food_rankings(block_size=2)
+
+
+def test_parse_query_keeps_quoted_values_whole():
+    assert foods.parse_query("name contains 'macaroni and cheese'") == ([], "macaroni and cheese")
+    assert foods.parse_query('Total Protein/kcal > 0.05 AND name contains "black"') == (
+        [("Total Protein", ">", 0.05)],
+        "black",
+    )
+    with pytest.raises(ValueError):
+        foods.parse_query("name contains 'macaroni")
+
+
+@pytest.mark.parametrize("op", ["<", "<=", ">", ">=", "==", "!=", "="])
+def test_parse_query_operators(op):
+    assert foods.parse_query(f"Sodium/kcal {op} 1.5 and Total Protein>=0.05") == (
+        [("Sodium", "==" if op == "=" else op, 1.5), ("Total Protein", ">=", 0.05)],
+        None,
+    )
+
+
+@pytest.mark.parametrize(
+    "op, food_ids",
+    [("<", [4]), ("<=", [2, 4]), (">", [1]), (">=", [1, 2]), ("==", [2]), ("!=", [1, 4])],
+)
+def test_query_foods_operators(food_tables, op, food_ids):
+    results = foods.query_foods([("Sodium", op, 1.5)])
+    assert sorted(results["food_id"]) == food_ids
+
+
+def test_query_foods_with_name_and_predicates(food_tables):
+    results = foods.query_foods(*foods.parse_query("name contains 'macaroni and cheese' and Sodium > 1"))
+    assert results["food"].to_list() == ["Macaroni and cheese"]
+    results = foods.query_foods(*foods.parse_query("Total Protein > 0.035 and Sodium < 2"), order_by="Total Protein")
+    assert results["food_id"].to_list() == [2]
+
+
+def test_query_foods_unknown_nutrient(food_tables):
+    with pytest.raises(ValueError, match="Unknown nutrient"):
+        foods.query_foods([("Vitamin Q", ">", 1)])
+
+
+def test_count_matches_is_exact(food_tables):
+    assert foods.count_matches("Sodium", ">=", 0) == 3
+    assert foods.count_matches("Total Protein", ">", 0.05) == 2
+
+
+def test_top_sources_ranks_by_amount(food_tables):
+    sources = foods.top_sources("Total Protein")
+    assert sources["food_id"].to_list() == [3, 2, 1, 4]
+    assert sources["rank"].to_list() == [0, 1, 2, 3]
+    assert sources["food"].to_list()[0] == "Beans, black"
+    # Foods without an amount aren't ranked
+    sodium = foods.top_sources("Sodium", limit=2, offset=1)
+    assert sodium.select("rank", "food_id", "amount").rows() == [(1, 2, 1.5), (2, 4, 0.0)]
+    assert foods.top_sources("Sodium", offset=3).height == 0
+
+
+@pytest.mark.parametrize(
+    "lower, upper",
+    [(None, None), (0.04, 0.06), (0.05, None), (None, 0.04), (0.041, 0.059), (0.08, None), (0.06, 0.04)],
+)
+def test_sources_in_range_matches_a_filter(food_tables, lower, upper):
+    expected = FOOD_NUTRIENTS_CAL.filter(
+        (pl.col("Total Protein") >= (lower if lower is not None else float("-inf")))
+        & (pl.col("Total Protein") <= (upper if upper is not None else float("inf")))
+    ).sort("Total Protein", descending=True)
+    sources = foods.sources_in_range("Total Protein", lower, upper)
+    assert sources["food_id"].to_list() == expected["food_id"].to_list()
+    assert sources["amount"].to_list() == expected["Total Protein"].to_list()
+    # Ranks are positions among all the foods, so a range continues the top sources' numbering
+    top = dict(foods.top_sources("Total Protein").select("food_id", "rank").iter_rows())
+    assert sources["rank"].to_list() == [top[food_id] for food_id in sources["food_id"]]
+    paged = foods.sources_in_range("Total Protein", lower, upper, limit=1, offset=1)
+    assert paged["food_id"].to_list() == expected["food_id"].to_list()[1:2]
@@ -0,0 +1,124 @@
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import polars as pl
+import pytest
+
+from intake import IntakeLog, IntakeRollups, IntakeWriter
+
+FOOD_NUTRIENTS = pl.DataFrame({"food_id": [1, 2], "Energy": [100.0, 250.0], "Total Protein": [5.0, None]})
+
+
+@pytest.fixture
+def intake_log(tmp_path):
+    intake_log = IntakeLog(str(tmp_path / "intake.db"), FOOD_NUTRIENTS)
+    yield intake_log
+    intake_log.close()
+
+
+def test_writer_resolves_every_accepted_entry_when_closed(intake_log):
+    writer = IntakeWriter(intake_log, max_entries=10, max_delay=0.001, durable=False)
+    futures = []
+    rejected = []
+
+    def submit():
+        for _ in range(200):
+            try:
+                futures.append(writer.submit(1, 1, 50, "2026-01-01T12:00"))
+            except ValueError:
+                rejected.append(1)
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    writer.close()
+    for thread in threads:
+        thread.join()
+    ids = [future.result(timeout=5) for future in futures]
+    assert len(set(ids)) == len(futures) == 800 - len(rejected)
+    assert intake_log.daily_totals(1, "2026-01-01").get("Energy", 0.0) == pytest.approx(50 * len(futures))
+
+
+def test_daily_totals_after_delete_and_edit(intake_log):
+    first = intake_log.log(1, 1, 200, "2026-01-01T08:00")
+    second = intake_log.log(1, 2, 100, "2026-01-01T12:00")
+    assert intake_log.daily_totals(1, "2026-01-01") == {"Energy": 450.0, "Total Protein": 10.0}
+    intake_log.delete(first)
+    assert intake_log.daily_totals(1, "2026-01-01") == {"Energy": 250.0, "Total Protein": 0.0}
+    # Moving the entry to another day takes it off the first day
+    intake_log.edit(second, grams=50, eaten_at="2026-01-02T12:00")
+    assert intake_log.daily_totals(1, "2026-01-01") == {"Energy": 0.0, "Total Protein": 0.0}
+    assert intake_log.daily_totals(1, "2026-01-02") == {"Energy": 125.0, "Total Protein": 0.0}
+    with pytest.raises(ValueError):
+        intake_log.delete(first)
+
+
+def test_delete_takes_off_the_amounts_logged(tmp_path):
+    path = str(tmp_path / "intake.db")
+    intake_log = IntakeLog(path, FOOD_NUTRIENTS)
+    entry_id = intake_log.log(1, 1, 100, "2026-01-01T08:00")
+    intake_log.close()
+    # The food's amounts change when the food tables are rebuilt
+    intake_log = IntakeLog(path, FOOD_NUTRIENTS.with_columns(pl.col("Energy") * 2))
+    intake_log.delete(entry_id)
+    assert intake_log.daily_totals(1, "2026-01-01") == {"Energy": 0.0, "Total Protein": 0.0}
+    intake_log.close()
+
+
+def test_append_group_entries(intake_log):
+    eaten_at = datetime(2026, 1, 1, 12)
+    with intake_log.lock, intake_log.connection:
+        ids = intake_log.append_group(
+            [
+                (1, 1, 100, eaten_at, None),
+                (1, 2, 100, eaten_at, None, None),
+                # Entries may bring their change to the totals
+                (1, 1, 100, eaten_at, None, np.array([1.0, 2.0])),
+            ]
+        )
+    assert len(set(ids)) == 3
+    assert intake_log.daily_totals(1, "2026-01-01") == {"Energy": 351.0, "Total Protein": 7.0}
+
+
+def test_default_log_accepts_recipes(data_dir):
+    from recipes import RecipeBook
+
+    FOOD_NUTRIENTS.write_parquet(str(data_dir / "sources" / "food_nutrients.parquet"))
+    pl.DataFrame({"food_id": [1, 2], "food": ["Oats", "Milk"]}).write_parquet(str(data_dir / "sources" / "food_list.parquet"))
+    recipe_id = RecipeBook(food_nutrients=FOOD_NUTRIENTS).add("Porridge", [[1, 50], [2, 150]])
+    intake_log = IntakeLog(str(data_dir / "intake.db"))
+    intake_log.log(1, recipe_id, 100, "2026-01-01T08:00")
+    assert intake_log.daily_totals(1, "2026-01-01")["Energy"] == pytest.approx((50 * 100 + 150 * 250) / 200)
+    intake_log.close()
+
+
+def window_averages(intake_log, user_id, day, days):
+    """
+    Returns the averages IntakeRollups should give, worked out from the daily totals of each day of the window.
+    """
+    last = date.fromisoformat(day)
+    totals = [intake_log.daily_totals(user_id, (last - timedelta(days=offset)).isoformat()) for offset in range(days)]
+    return {name: sum(day_totals.get(name, 0.0) for day_totals in totals) / days for name in ["Energy", "Total Protein"]}
+
+
+def test_rolling_totals_after_corrections(intake_log):
+    rollups = IntakeRollups(intake_log, windows=(3, 7))
+    breakfast = intake_log.log(1, 1, 200, "2026-01-01T08:00")
+    lunch = intake_log.log(1, 2, 100, "2026-01-03T12:00")
+    intake_log.log(2, 1, 100, "2026-01-03T12:00")
+    assert rollups.averages(1, "2026-01-03", days=3) == pytest.approx({"Energy": 150.0, "Total Protein": 10 / 3})
+    assert rollups.averages(1, "2026-01-04", days=3) == pytest.approx({"Energy": 250 / 3, "Total Protein": 0.0})
+    # Back-dated entries, deletions and edits after a refresh change the windows they fall in
+    intake_log.log(1, 1, 100, "2026-01-02T08:00")
+    intake_log.delete(breakfast)
+    intake_log.edit(lunch, grams=200, eaten_at="2026-01-05T12:00")
+    for day in ["2026-01-01", "2026-01-03", "2026-01-05", "2026-01-08"]:
+        for days in (3, 7):
+            # Windows that never had an entry have no totals
+            averages = rollups.averages(1, day, days) or {"Energy": 0.0, "Total Protein": 0.0}
+            assert averages == pytest.approx(window_averages(intake_log, 1, day, days))
+    assert rollups.averages(2, "2026-01-03", days=7) == pytest.approx({"Energy": 100 / 7, "Total Protein": 5 / 7})
+    assert rollups.refresh() == 0
+    with pytest.raises(ValueError):
+        rollups.averages(1, "2026-01-03", days=30)
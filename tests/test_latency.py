@@ -0,0 +1,71 @@
+import json
+
+import polars as pl
+import pytest
+
+import latency
+from latency import KeystrokeLatency
+from stats import percentile
+
+FOOD_LIST = pl.DataFrame(
+    {
+        "food_id": [1, 2, 3, 4],
+        "food": ["Apple, raw", "Applesauce", "Banana, raw", "Broccoli, raw"],
+    }
+)
+
+
+def keys(text, *extra):
+    return [ord(char) for char in text] + list(extra)
+
+
+@pytest.mark.parametrize(
+    "fraction, expected",
+    [(0, 1), (0.5, 5), (0.95, 10), (0.99, 10), (1, 10)],
+)
+def test_percentile_uses_the_nearest_rank(fraction, expected):
+    assert percentile(list(range(1, 11)), fraction) == expected
+    assert percentile([], fraction) is None
+
+
+def test_nested_stages_are_timed_exclusively(monkeypatch):
+    clock = iter([0.0, 0.001, 0.003, 0.007, 0.010, 0.012])
+    monkeypatch.setattr(latency.time, "perf_counter", lambda: next(clock))
+    recorder = KeystrokeLatency()
+    recorder.start(ord("a"))
+    with recorder.stage("draw"):
+        with recorder.stage("refresh"):
+            pass
+    recorder.finish(3)
+    (record,) = recorder.records
+    assert record["total_ms"] == pytest.approx(12)
+    assert record["refresh_ms"] == pytest.approx(4)
+    assert record["draw_ms"] == pytest.approx(5)
+    assert record["results"] == 3
+    summary = recorder.summary()
+    assert summary["keystrokes"] == 1
+    assert summary["total"]["p99_ms"] == pytest.approx(12)
+    assert summary["histogram"]["<=20ms"] == 1
+
+
+def test_replay_records_each_search_keystroke(tmp_path):
+    food_id, recorded = latency.replay(keys("appl", 10), food_list=FOOD_LIST)
+    assert food_id == 1
+    # The enter key leaves without searching, so it isn't recorded, but is kept to replay the session
+    assert recorded.keys == keys("appl", 10)
+    assert [record["key"] for record in recorded.records] == keys("appl")
+    assert [record["results"] for record in recorded.records] == [4, 2, 2, 2]
+    assert all(record["total_ms"] >= record["filter_ms"] >= 0 for record in recorded.records)
+    path = tmp_path / "session.json"
+    recorded.dump(path)
+    dumped = json.loads(path.read_text())
+    assert dumped["summary"]["keystrokes"] == 4
+    # Replaying the dumped keys selects the same food
+    assert latency.replay(dumped["keys"], food_list=FOOD_LIST)[0] == food_id
+
+
+def test_replay_escape_records_nothing():
+    food_id, recorded = latency.replay([27], food_list=FOOD_LIST)
+    assert food_id is None
+    assert recorded.records == []
+    assert recorded.summary()["total"]["p50_ms"] is None
@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+import polars as pl
+import pytest
+
+from Persons import Person, PersonBatch
+
+
+def person_row(name):
+    return {"name": name, "dob": "1990-01-01", "sex": "f", "height": "165", "weight": "60", "pal": "2"}
+
+
+def test_batch_names_normalised_like_person():
+    names = ["  mary-jane o'neil ", "JEAN-LUC", "ann marie", "o'BRIEN-smith2nd", "straße", "İlker", "ΣΟΦΟΣ"]
+    batch, errors = PersonBatch.from_frame(pl.DataFrame([person_row(name) for name in names]))
+    assert errors.height == 0
+    assert batch.persons["name"].to_list() == [Person.from_dict(person_row(name)).name for name in names]
+    assert batch.persons["name"][0] == "Mary-Jane O'Neil"
+
+
+@pytest.mark.parametrize("dob", ["1990-01-01", "19900101", "1990-1-1", "1990-02-30", "01/02/1990", " 1990-01-01 "])
+def test_batch_dates_validated_like_person(dob):
+    row = dict(person_row("dates"), dob=dob)
+    _, errors = PersonBatch.from_frame(pl.DataFrame([row]))
+    try:
+        Person.from_dict(row)
+        accepted = True
+    except ValueError:
+        accepted = False
+    assert accepted == (errors.height == 0)
+
+
+@pytest.mark.parametrize(
+    "attribute, value",
+    [
+        ("weight", "70"),
+        ("height", "170"),
+        ("pal", "3"),
+        ("due_date", (date.today() + timedelta(days=100)).isoformat()),
+        ("breastfeeding", 1),
+    ],
+)
+def test_setting_an_input_recomputes_requirements(data_dir, attribute, value):
+    person = Person.from_dict(person_row("cache"))
+    cached = person.diet_rqmts
+    assert person.diet_rqmts is cached
+    setattr(person, attribute, value)
+    assert person.diet_rqmts is not cached
+    assert person.diet_rqmts == person.compute_diet_rqmts()
+
+
+def test_setting_other_attributes_keeps_requirements(data_dir):
+    person = Person.from_dict(person_row("cache"))
+    cached = person.diet_rqmts
+    person.name = "renamed"
+    person.uid = "another uid"
+    assert person.diet_rqmts is cached
@@ -0,0 +1,84 @@
+import polars as pl
+import pytest
+
+import acquisitions
+import foods
+from recipes import RecipeBook
+
+FOOD_LIST = pl.DataFrame({"food_id": [1, 2], "food": ["Oats", "Milk"]})
+# Amounts per 100g
+FOOD_NUTRIENTS = pl.DataFrame(
+    {"food_id": [1, 2], "Energy": [400.0, 50.0], "Total Protein": [10.0, 4.0], "Vitamin C (total ascorbic acid)": [None, 2.0]}
+)
+
+
+@pytest.fixture
+def recipe_book(tmp_path):
+    return RecipeBook(str(tmp_path / "recipes.json"), str(tmp_path / "recipe_nutrients.parquet"), food_nutrients=FOOD_NUTRIENTS)
+
+
+def reopen(recipe_book):
+    return RecipeBook(recipe_book.path, recipe_book.cache_path, food_nutrients=FOOD_NUTRIENTS)
+
+
+def test_add_remove_rename(recipe_book):
+    porridge = recipe_book.add("Porridge", [[1, 50], [2, 150]])
+    toast = recipe_book.add("Toast", [[1, 30]])
+    assert [porridge, toast] == [-1, -2]
+    # Adding a recipe of the same name replaces it
+    assert recipe_book.add("Porridge", [[1, 60], [2, 140]]) == porridge
+    recipe_book.rename(porridge, " Oat porridge ")
+    with pytest.raises(ValueError):
+        recipe_book.rename(toast, "Oat porridge")
+    breakfast = recipe_book.add("Breakfast", [[porridge, 200], [toast, 30]])
+    with pytest.raises(ValueError, match="used by"):
+        recipe_book.remove(porridge)
+    with pytest.raises(ValueError, match="itself"):
+        recipe_book.add("Oat porridge", [[breakfast, 10]])
+    with pytest.raises(ValueError, match="Unknown food_id"):
+        recipe_book.add("Soup", [[3, 100]])
+    recipe_book.remove(breakfast)
+    saved = reopen(recipe_book)
+    assert {food_id: recipe["food"] for food_id, recipe in saved.recipes.items()} == {porridge: "Oat porridge", toast: "Toast"}
+    assert saved.recipes[porridge]["ingredients"] == [[1, 60.0], [2, 140.0]]
+
+
+def test_removed_ids_not_reused(recipe_book):
+    recipe_book.add("Porridge", [[1, 50]])
+    toast = recipe_book.add("Toast", [[1, 30]])
+    recipe_book.remove(toast)
+    assert recipe_book.add("Muesli", [[1, 40]]) == toast - 1
+    saved = reopen(recipe_book)
+    saved.remove(toast - 1)
+    assert saved.add("Pancakes", [[1, 40]]) == toast - 2
+
+
+def test_recipe_nutrient_totals(recipe_book):
+    porridge = recipe_book.add("Porridge", [[1, 50], [2, 150]], yield_grams=250, retention={"Vitamin C (total ascorbic acid)": 0.5})
+    breakfast = recipe_book.add("Breakfast", [[porridge, 100], [2, 100]])
+    nutrients = {row["food_id"]: row for row in recipe_book.nutrients().to_dicts()}
+    # 50g of oats and 150g of milk, per 100g of 250g cooked
+    assert nutrients[porridge]["Energy"] == pytest.approx((200 + 75) * 100 / 250)
+    assert nutrients[porridge]["Total Protein"] == pytest.approx((5 + 6) * 100 / 250)
+    assert nutrients[porridge]["Vitamin C (total ascorbic acid)"] == pytest.approx(3 * 0.5 * 100 / 250)
+    assert nutrients[breakfast]["Energy"] == pytest.approx((110 + 50) / 2)
+    nutrients_cal = recipe_book.nutrients_cal()
+    assert nutrients_cal.filter(pl.col("food_id") == porridge)["Total Protein"][0] == pytest.approx(11 / 275)
+    assert recipe_book.nutrients_cal() is nutrients_cal
+    # Cached amounts are reused by a new RecipeBook
+    assert reopen(recipe_book).nutrients().frame_equal(recipe_book.nutrients())
+
+
+def test_recipes_ranked_and_queried_with_foods(data_dir, recipe_book):
+    FOOD_LIST.write_parquet(str(data_dir / "sources" / "food_list.parquet"))
+    acquisitions.per_kcal(FOOD_NUTRIENTS).write_parquet(str(data_dir / "sources" / "food_nutrients_cal.parquet"))
+    acquisitions.extract_food_rankings()
+    porridge = recipe_book.add("Porridge", [[1, 50], [2, 150]])
+    sources = foods.top_sources("Total Protein", recipe_book=recipe_book)
+    assert sources["food"].to_list() == ["Milk", "Porridge", "Oats"]
+    assert sources["rank"].to_list() == [0, 1, 2]
+    assert foods.top_sources("Total Protein", limit=1, offset=1, recipe_book=recipe_book)["food_id"].to_list() == [porridge]
+    in_range = foods.sources_in_range("Total Protein", lower=0.02, upper=0.05, recipe_book=recipe_book)
+    assert in_range.select("rank", "food").rows() == [(1, "Porridge"), (2, "Oats")]
+    results = foods.query_foods([("Total Protein", ">", 0.03)], name="porr", recipe_book=recipe_book)
+    assert results["food_id"].to_list() == [porridge]
@@ -0,0 +1,60 @@
+import pytest
+
+import acquisitions
+import Persons
+
+
+@pytest.fixture
+def fresh_tables(data_dir, monkeypatch):
+    """
+    Empties the reference tables and in-memory data files Persons holds for the process.
+    """
+    monkeypatch.setattr(Persons, "reference_tables", {})
+    monkeypatch.setattr(Persons, "data_files", {})
+
+
+def compiled_from_csv():
+    tables = {(path, tuple(keys)): Persons.compile_reference_table(path, keys) for path, keys in Persons.REQUIREMENT_TABLES.items()}
+    tables[("data/nutrient_keys.tsv", ())] = Persons.compile_nutrient_keys()
+    return tables
+
+
+def test_bundle_loaded_from_shared_buffer(fresh_tables):
+    acquisitions.extract_requirements_bundle()
+    with open(Persons.REQUIREMENTS_BUNDLE, "rb") as file:
+        # As attached from shared memory (see shared.SharedTables)
+        Persons.data_files[Persons.REQUIREMENTS_BUNDLE] = memoryview(file.read())
+    for path in Persons.REFERENCE_FILES:
+        with open(path, "rb") as file:
+            Persons.data_files[path] = memoryview(file.read())
+    assert Persons.REQUIREMENTS_BUNDLE in Persons.shared_data_paths()
+    assert Persons.load_requirements_bundle()
+    assert Persons.reference_tables == compiled_from_csv()
+
+
+def test_bundle_matches_csv_tables(fresh_tables):
+    acquisitions.extract_requirements_bundle()
+    assert Persons.load_requirements_bundle()
+    assert Persons.reference_tables == compiled_from_csv()
+
+
+def test_stale_bundle_not_loaded(fresh_tables):
+    acquisitions.extract_requirements_bundle()
+    with open("data/rda.csv") as file:
+        lines = file.read().splitlines(keepends=True)
+    # Edit the last value of the first row after the bundle was compiled
+    header, row = lines[0].split(","), lines[1].split(",")
+    row[-1] = "12345\n"
+    with open("data/rda.csv", "w") as file:
+        file.writelines([lines[0], ",".join(row)] + lines[2:])
+    with open(Persons.REQUIREMENTS_BUNDLE, "rb") as file:
+        bundle = file.read()
+    # The stale bundle is neither used nor rewritten: the tables are compiled from the data files
+    assert not Persons.load_requirements_bundle()
+    rows, _ = Persons.reference_table("data/rda.csv", Persons.AGE_SEX_MATERNITY_KEYS)
+    assert rows[next(iter(rows))][header[-1].strip()] == 12345
+    with open(Persons.REQUIREMENTS_BUNDLE, "rb") as file:
+        assert file.read() == bundle
+    acquisitions.extract_requirements_bundle()
+    assert Persons.load_requirements_bundle()
+    assert Persons.reference_tables == compiled_from_csv()
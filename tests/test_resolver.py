@@ -0,0 +1,27 @@
+import polars as pl
+
+from resolver import MealLogResolver
+
+FOODS = pl.DataFrame({"food_id": [11, 12, 13], "food": ["Bread, whole wheat, toasted", "Apple, raw", "Milk, whole"]})
+
+
+def test_resolve_lines_from_generator():
+    lines = ["2 slices whole wheat toast", "1 apple", "a glass of whole milk"]
+    resolved = MealLogResolver(food_list=FOODS, workers=1).resolve(line for line in lines)
+    assert resolved["line"].to_list() == lines
+    assert resolved["quantity"].to_list() == ["2 slices", "1", "a glass of"]
+    assert resolved["food_id"].to_list() == [11, 12, 13]
+
+
+def test_cache_survives_rebuilt_food_list(tmp_path):
+    cache_path = str(tmp_path / "cache.parquet")
+    resolver = MealLogResolver(food_list=FOODS, workers=1, cache_path=cache_path)
+    resolver.resolve(["1 apple", "some milk"])
+    resolver.save_cache()
+    # Rows move and the milk leaves the catalogue: cached apple still resolves to its food, milk is scored again
+    rebuilt = pl.DataFrame({"food_id": [14, 12, 11], "food": ["Milk, skim", "Apple, raw", "Bread, whole wheat, toasted"]})
+    resolver = MealLogResolver(food_list=rebuilt, workers=1, cache_path=cache_path)
+    assert set(resolver.cache) == {"apple"}
+    resolved = resolver.resolve(["1 apple", "some milk"])
+    assert resolved["food_id"].to_list() == [12, 14]
+    assert resolved["food"].to_list() == ["Apple, raw", "Milk, skim"]
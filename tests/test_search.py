@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from search import FoodSearch, FuzzyRanker
+
+FOOD_LIST = pl.DataFrame(
+    {
+        "food_id": [1, 2, 3, 4, 5],
+        "food": ["Apple, raw", "Applesauce", "Pineapple", "Banana, raw", "Bread, banana"],
+    }
+)
+
+
+def test_sessions_typing_at_once_get_their_own_matches():
+    food_search = FoodSearch(food_list=FOOD_LIST)
+    apple, banana = food_search.session(), food_search.session()
+    for apple_term, banana_term in [("a", "b"), ("ap", "ba"), ("app", "ban"), ("appl", "bana")]:
+        assert_frame_equal(apple.query(apple_term), food_search.query(apple_term))
+        assert_frame_equal(banana.query(banana_term), food_search.query(banana_term))
+    assert apple.query("apples")["food"].to_list() == ["Applesauce"]
+
+
+def test_concurrent_queries_share_a_search():
+    food_search = FoodSearch(food_list=FOOD_LIST)
+    terms = ["a", "ap", "apple", "b", "ban", "banana", "bread"] * 50
+    expected = {term: food_search.query(term)["food_id"].to_list() for term in set(terms)}
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda term: food_search.query(term)["food_id"].to_list(), terms))
+    assert results == [expected[term] for term in terms]
+
+
+TYPO_FOOD_LIST = pl.DataFrame(
+    {
+        "food_id": [1, 2, 3, 4, 5, 6],
+        "food": ["Broccoli, raw", "Broccoli, cooked", "Brown rice", "Cauliflower, raw", "Apple, raw", "Aple pie"],
+    }
+)
+
+
+def test_fuzzy_ranker_finds_typos():
+    food_search = FoodSearch(food_list=TYPO_FOOD_LIST, ranker=FuzzyRanker())
+    assert sorted(food_search.query("brocoli")["food_id"]) == [1, 2]
+    assert food_search.query("xyzzy").height == 0
+    # Exact matches are enough when there are some, and the default ranker doesn't tolerate typos
+    assert sorted(food_search.query("broc")["food_id"]) == [1, 2]
+    assert FoodSearch(food_list=TYPO_FOOD_LIST).query("brocoli").height == 0
+
+
+def test_fuzzy_matches_rank_below_exact_matches():
+    # Typos are only looked for when there are fewer than min_results exact matches
+    assert FoodSearch(food_list=TYPO_FOOD_LIST, ranker=FuzzyRanker()).query("apple")["food_id"].to_list() == [5]
+    results = FoodSearch(food_list=TYPO_FOOD_LIST, ranker=FuzzyRanker(min_results=2)).query("apple")
+    assert results["food_id"].to_list() == [5, 6]
+    assert results["score"][0] >= 0.5 > results["score"][1]
+
+
+def test_fuzzy_session_matches_a_fresh_query():
+    food_search = FoodSearch(food_list=TYPO_FOOD_LIST, ranker=FuzzyRanker())
+    session = food_search.session()
+    for end in range(1, len("brocoli") + 1):
+        assert_frame_equal(session.query("brocoli"[:end]), food_search.query("brocoli"[:end]))
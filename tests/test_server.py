@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import polars as pl
+import pytest
+
+from conftest import ROOT
+from Persons import Person
+from server import respond
+
+PERSON = {"name": "server", "dob": "1990-01-01", "sex": "f", "height": 165, "weight": 60, "pal": 2}
+
+
+class StubService:
+    def search(self, text, limit, offset):
+        return {"q": text, "limit": limit, "offset": offset}
+
+    def intake(self, body):
+        if body.get("fail"):
+            raise RuntimeError("secret detail")
+        return body
+
+
+@pytest.fixture
+def call(data_dir):
+    executor = ThreadPoolExecutor(2)
+    process_executor = ProcessPoolExecutor(1)
+
+    def call(method, target, body=b""):
+        async def run():
+            return await respond(asyncio.get_running_loop(), executor, process_executor, StubService(), method, target, body)
+
+        return asyncio.run(run())
+
+    yield call
+    executor.shutdown()
+    process_executor.shutdown()
+
+
+def test_routes_pass_their_arguments(call):
+    assert call("GET", "/search?q=oat&limit=5") == (200, {"q": "oat", "limit": "5", "offset": 0})
+    assert call("POST", "/intake", json.dumps({"entries": []}).encode()) == (200, {"entries": []})
+    assert call("POST", "/requirements", json.dumps(PERSON).encode()) == (200, Person.from_dict(PERSON).diet_rqmts)
+    assert call("POST", "/requirements", b"[]")[0] == 400
+    assert call("GET", "/requirements")[0] == 405
+
+
+def test_internal_errors_are_logged_not_returned(call, caplog):
+    with caplog.at_level(logging.ERROR, logger="server"):
+        status, payload = call("POST", "/intake", json.dumps({"fail": True}).encode())
+    assert (status, payload) == (500, {"error": "Internal server error"})
+    assert "secret detail" in caplog.text
+
+
+@pytest.fixture
+def server(data_dir):
+    """
+    Runs the server on tiny food tables, with one worker process. Yields a function sending raw bytes and returning the response.
+    """
+    pl.DataFrame({"food_id": [1, 2], "food": ["Apple, raw", "Milk, whole"]}).write_parquet(str(data_dir / "sources" / "food_list.parquet"))
+    pl.DataFrame({"food_id": [1, 2], "Energy": [52.0, 61.0]}).write_parquet(str(data_dir / "sources" / "food_nutrients.parquet"))
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port), "--processes", "1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+
+    def send(data):
+        with socket.create_connection(("127.0.0.1", port), timeout=30) as connection:
+            connection.sendall(data)
+            response = b""
+            while chunk := connection.recv(65536):
+                response += chunk
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            assert process.poll() is None and time.monotonic() < deadline, process.stdout.read()
+            time.sleep(0.1)
+    yield send
+    process.terminate()
+    assert process.wait(timeout=30) == 0
+    # The shared segments are removed on exit
+    if os.path.isdir("/dev/shm"):
+        assert not [name for name in os.listdir("/dev/shm") if name.startswith(f"nutripy_{process.pid}_")]
+
+
+def post(path, body, headers=""):
+    return f"POST {path} HTTP/1.1\r\nConnection: close\r\n{headers}Content-Length: {len(body)}\r\n\r\n".encode() + body
+
+
+def test_server_intake_requirements_and_bad_lengths(server):
+    body = json.dumps({"entries": [[1, 200]], "person": PERSON}).encode()
+    status, payload = server(post("/intake", body))
+    assert status == 200
+    assert payload["totals"]["Energy"] == pytest.approx(104.0)
+    assert payload["requirements"] == json.loads(json.dumps(Person.from_dict(PERSON).diet_rqmts))
+    for length in [b"abc", b"-5"]:
+        status, payload = server(b"POST /intake HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
+        assert status == 400
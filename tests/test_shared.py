@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+
+import polars as pl
+import pytest
+
+import Persons
+from shared import SharedTables
+
+
+def read_shared(prefix):
+    """
+    Runs in a second process: attaches to the shared tables and reads them.
+    """
+    tables = SharedTables.attach(prefix)
+    return (
+        tables.food_nutrients(2),
+        [tables.food(row) for row in tables.search("apple")],
+        sorted(Persons.data_files),
+        Persons.Person.from_dict({"name": "shared", "dob": "1990-01-01", "sex": "f", "height": 165, "weight": 60, "pal": 2}).diet_rqmts,
+    )
+
+
+@pytest.fixture
+def food_tables(data_dir):
+    pl.DataFrame({"food_id": [2, 1, 3], "food": ["Apple, raw", "Pineapple", "Milk"]}).write_parquet(
+        str(data_dir / "sources" / "food_list.parquet")
+    )
+    pl.DataFrame({"food_id": [1, 2, 3], "Energy": [50.0, 52.0, 61.0], "Total Protein": [0.5, None, 3.2]}).write_parquet(
+        str(data_dir / "sources" / "food_nutrients.parquet")
+    )
+
+
+def test_second_process_attaches_and_segments_are_unlinked(food_tables, monkeypatch):
+    monkeypatch.setattr(Persons, "reference_tables", {})
+    prefix = f"nutripy_test_{os.getpid()}"
+    tables = SharedTables.create(prefix)
+    try:
+        assert tables.food_nutrients(3) == {"Energy": 61.0, "Total Protein": 3.2}
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            food_nutrients, found, files, diet_rqmts = pool.apply(read_shared, (prefix,))
+    finally:
+        tables.close(unlink=True)
+    assert food_nutrients == {"Energy": 52.0}
+    assert found == ["Apple, raw", "Pineapple"]
+    assert files == sorted(Persons.shared_data_paths())
+    assert diet_rqmts == Persons.Person.from_dict(
+        {"name": "shared", "dob": "1990-01-01", "sex": "f", "height": 165, "weight": 60, "pal": 2}
+    ).diet_rqmts
+    with pytest.raises(FileNotFoundError):
+        SharedTables.attach(prefix)
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+
+import polars as pl
+import pytest
+
+from conftest import ROOT
+
+CLI = os.path.join(ROOT, "cli.py")
+# Libraries only the data rebuild needs
+REBUILD_ONLY = ["pandas", "requests", "urllib.request", "zipfile"]
+SEARCH_ONLY = ["rapidfuzz", "curses"]
+# Milliseconds of imports allowed for the commands that only parse arguments, generous so slow machines pass
+BUDGET_MS = 250
+# (name, arguments to python, modules it mustn't import, whether its import time counts against the budget)
+CHECKS = [
+    ("help", [CLI, "--help"], ["polars", "numpy"] + REBUILD_ONLY + SEARCH_ONLY, True),
+    ("rebuild --help", [CLI, "rebuild", "--help"], ["polars", "numpy"] + REBUILD_ONLY + SEARCH_ONLY, True),
+    (
+        "requirements",
+        [CLI, "requirements", "--dob", "1990-01-01", "--sex", "f", "--height", "165", "--weight", "60", "--pal", "2"],
+        REBUILD_ONLY + SEARCH_ONLY,
+        False,
+    ),
+    ("search", [CLI, "search", "apple"], REBUILD_ONLY + ["curses"], False),
+    ("import main", ["-c", "import main"], ["polars", "numpy"] + REBUILD_ONLY + SEARCH_ONLY, False),
+    ("import acquisitions", ["-c", "import acquisitions"], REBUILD_ONLY + SEARCH_ONLY, False),
+]
+
+
+def run(arguments):
+    """
+    Runs python with -X importtime and arguments. Returns (process, {module: (cumulative microseconds, top level)}),
+    with the first import of each module, top level if it wasn't imported by another module.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + arguments,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        # Run from the data's directory, finding the modules in the repo
+        env=dict(os.environ, PYTHONPATH=ROOT),
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        # Nested imports are indented under the module importing them
+        times.setdefault(module.strip(), (int(cumulative), not module[1:].startswith(" ")))
+    return process, times
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    """
+    Modules the interpreter imports on its own startup (site, .pth files), which aren't counted.
+    """
+    return set(run(["-c", "pass"])[1])
+
+
+@pytest.fixture
+def tiny_food_tables(data_dir):
+    pl.DataFrame({"food_id": [1, 2], "food": ["Apple, raw", "Milk, whole"]}).write_parquet(str(data_dir / "sources" / "food_list.parquet"))
+    pl.DataFrame({"food_id": [1, 2], "Energy": [52.0, 61.0]}).write_parquet(str(data_dir / "sources" / "food_nutrients.parquet"))
+
+
+@pytest.mark.parametrize("name, arguments, forbidden, timed", CHECKS, ids=[check[0] for check in CHECKS])
+def test_startup_imports(tiny_food_tables, baseline, name, arguments, forbidden, timed):
+    process, times = run(arguments)
+    errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+    assert process.returncode == 0, errors[-1] if errors else ""
+    times = {module: value for module, value in times.items() if module not in baseline}
+    assert [module for module in forbidden if module in times] == []
+    if timed:
+        assert sum(cumulative for cumulative, top_level in times.values() if top_level) / 1000 <= BUDGET_MS
@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+
+from Persons import Person
+
+
+def mother(due_date):
+    return Person.from_dict(
+        {"name": "mother", "dob": "1990-03-01", "sex": "f", "height": 165, "weight": 60, "pal": 2, "due_date": due_date.isoformat()}
+    )
+
+
+def test_timeline_boundaries_around_pregnancy():
+    due_date = date.today() + timedelta(days=200)
+    person = mother(due_date)
+    start, end = due_date - timedelta(days=400), due_date + timedelta(days=400)
+    segments = person.requirement_timeline(start, end, breastfeed_after_birth=True)
+    starts = [segment["start"] for segment in segments]
+    assert starts[0] == start and segments[-1]["end"] == end
+    assert all(a["end"] == b["start"] for a, b in zip(segments, segments[1:]))
+    conception, birth, six_months = due_date - timedelta(days=280), due_date + timedelta(days=1), due_date + timedelta(days=184)
+    assert {conception, birth, six_months} <= set(starts)
+    for segment in segments:
+        day = segment["start"]
+        if day < conception:
+            expected = person.on(day).compute_diet_rqmts()
+        elif day <= due_date:
+            expected = person.on(day, due_date=due_date).compute_diet_rqmts()
+        else:
+            expected = person.on(day, breastfeeding=1 if day < six_months else 2).compute_diet_rqmts()
+        assert segment["diet_rqmts"] == expected, day
+
+
+def test_timeline_before_pregnancy_isnt_breastfeeding():
+    due_date = date.today() + timedelta(days=365)
+    person = mother(due_date)
+    first = person.requirement_timeline(due_date - timedelta(days=300), due_date, breastfeed_after_birth=True)[0]
+    assert first["end"] == due_date - timedelta(days=280)
+    assert first["diet_rqmts"]["Total Water"]["amount_lower"] == 2.7
+    assert first["diet_rqmts"]["Energy"]["amount_lower"] == person.on(first["start"]).compute_diet_rqmts()["Energy"]["amount_lower"]
+
+
+def test_on_keeps_a_due_date_relative_to_the_day():
+    person = mother(date.today() + timedelta(days=10))
+    due_date = date.today() - timedelta(days=100)
+    past = person.on(due_date - timedelta(days=50), due_date=due_date)
+    assert past.due_date == due_date
+    assert past.gestation == 1 + (280 - 50) // 7
+    assert person.due_date == date.today() + timedelta(days=10)
+
+
+def test_timeline_doesnt_query_the_user_store(monkeypatch):
+    import Persons
+
+    class CountingStore:
+        calls = 0
+
+        def name_owner(self, name):
+            CountingStore.calls += 1
+            return None
+
+        def uid_taken(self, uid):
+            CountingStore.calls += 1
+            return False
+
+    person = mother(date.today() + timedelta(days=200))
+    monkeypatch.setattr(Persons, "user_store", CountingStore())
+    person.requirement_timeline(date.today(), date.today() + timedelta(days=400), breastfeed_after_birth=True)
+    assert CountingStore.calls == 0
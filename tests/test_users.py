@@ -0,0 +1,117 @@
+import sqlite3
+import threading
+
+import polars as pl
+import pytest
+
+import Persons
+from Persons import Person, PersonBatch
+from users import UserStore
+
+
+def person_row(name, **changes):
+    return dict({"name": name, "dob": "1990-01-01", "sex": "f", "height": "165", "weight": "60", "pal": "2"}, **changes)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = UserStore(str(tmp_path / "users.db"))
+    monkeypatch.setattr(Persons, "user_store", None)
+    yield store
+    store.close()
+
+
+def test_add_get_and_update(store):
+    person = Person.from_dict(person_row("ada lovelace"))
+    store.add(person)
+    stored = store.get("ADA LOVELACE")
+    assert (stored.uid, stored.name, stored.dob, stored.height) == (person.uid, "Ada Lovelace", "1990-01-01", 165)
+    assert store.get_by_uid(person.uid).name == "Ada Lovelace"
+    assert store.name_owner("Ada Lovelace") == person.uid
+    assert store.uid_taken(person.uid)
+    assert isinstance(store.user_id(person.uid), int)
+    person.weight = "62"
+    person.name = "Ada King"
+    store.update(person)
+    assert store.get("Ada Lovelace") is None
+    assert store.get("Ada King").weight == 62
+
+
+def test_names_and_uids_stay_unique(store):
+    ada = Person.from_dict(person_row("Ada"))
+    store.add(ada)
+    with pytest.raises(ValueError, match="unique"):
+        store.add(Person.from_dict(person_row("ada")))
+    # New persons are checked against the store in use
+    Persons.user_store = store
+    with pytest.raises(ValueError, match="unique"):
+        Person.from_dict(person_row("Ada"))
+    grace = Person.from_dict(person_row("Grace"))
+    with pytest.raises(ValueError, match="unique"):
+        grace.name = "Ada"
+    # The store checks renames too, for persons made without it
+    Persons.user_store = None
+    store.add(grace)
+    grace.name = "Ada"
+    with pytest.raises(ValueError, match="unique"):
+        store.update(grace)
+    with pytest.raises(ValueError, match="No user"):
+        store.update(Person.from_dict(person_row("Nobody")))
+    with pytest.raises(ValueError, match="No user"):
+        store.user_id(Person.from_dict(person_row("Nobody")).uid)
+
+
+def test_import_batch_keeps_existing_uids(store):
+    ada = Person.from_dict(person_row("Ada"))
+    store.add(ada)
+    batch, errors = PersonBatch.from_frame(
+        pl.DataFrame([person_row("ada", weight="70"), person_row("Grace"), person_row("Joan")])
+    )
+    assert errors.height == 0
+    assert store.import_batch(batch, batch_size=2) == 3
+    assert store.get("Ada").uid == ada.uid
+    assert store.get("Ada").weight == 70
+    assert store.get("Joan") is not None
+
+
+def test_readers_arent_blocked_by_a_writer(tmp_path):
+    path = str(tmp_path / "users.db")
+    writer, reader = UserStore(path), UserStore(path)
+    writer.add(Person.from_dict(person_row("Ada")))
+    # Hold a write transaction open: in WAL mode other connections still read the last commit
+    writer.connection.execute("BEGIN IMMEDIATE")
+    writer.connection.execute("UPDATE users SET weight = 70")
+    assert reader.get("Ada").weight == 60
+    writer.connection.commit()
+    assert reader.get("Ada").weight == 70
+    assert reader.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    writer.close()
+    reader.close()
+
+
+def test_concurrent_stores_add_users(tmp_path):
+    path = str(tmp_path / "users.db")
+    UserStore(path).close()
+    errors = []
+
+    def add_users(thread):
+        store = UserStore(path)
+        store.connection.execute("PRAGMA busy_timeout = 5000")
+        try:
+            for i in range(20):
+                store.add(Person.from_dict(person_row(f"User {thread} {i}")))
+                assert store.get(f"User {thread} {i}") is not None
+        except (AssertionError, ValueError, sqlite3.Error) as error:
+            errors.append(error)
+        finally:
+            store.close()
+
+    threads = [threading.Thread(target=add_users, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    store = UserStore(path)
+    assert store.connection.execute("SELECT count(*) FROM users").fetchone() == (80,)
+    store.close()
@@ -0,0 +1,180 @@
+import sqlite3
+import uuid
+import polars as pl
+from Persons import Person, normalise_name
+
+# Profile columns stored for each user, in the order of the Person arguments
+PROFILE_COLUMNS = [
+    "name",
+    "dob",
+    "sex",
+    "height",
+    "weight",
+    "due_date",
+    "breastfeeding",
+    "pal",
+    "desired_weight",
+    "desired_bmi",
+]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    uid BLOB NOT NULL,
+    name TEXT NOT NULL,
+    dob TEXT NOT NULL,
+    sex TEXT NOT NULL,
+    height REAL NOT NULL,
+    weight REAL NOT NULL,
+    due_date TEXT,
+    breastfeeding INTEGER,
+    pal TEXT NOT NULL,
+    desired_weight REAL,
+    desired_bmi REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_uid ON users (uid);
+CREATE UNIQUE INDEX IF NOT EXISTS users_name ON users (name);
+"""
+INSERT = f"INSERT INTO users (uid, {', '.join(PROFILE_COLUMNS)}) VALUES ({', '.join('?' * (len(PROFILE_COLUMNS) + 1))})"
+# Bulk imports update the profile of users whose name is already taken, keeping their uid
+UPSERT = (
+    INSERT
+    + " ON CONFLICT (name) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in PROFILE_COLUMNS[1:])
+)
+SELECT = f"SELECT uid, {', '.join(PROFILE_COLUMNS)} FROM users"
+
+
+class UserStore:
+    """
+    Persistent store of user profiles in an SQLite database, with unique indexes on username and uid,
+    so uniqueness checks and lookups are index searches however many users there are.
+    Set Persons.user_store to a store to have new Person objects checked against it.
+    """
+
+    def __init__(self, path="data/users.db"):
+        # A store may be handed to another thread, but used by one thread at a time (e.g. the CLI or a batch job):
+        # concurrent users open a store each, WAL letting them read while another writes
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def name_owner(self, name):
+        """
+        Returns the uid of the user with a username, or None if it isn't taken.
+        """
+        row = self.connection.execute("SELECT uid FROM users WHERE name = ?", (name,)).fetchone()
+        return uuid.UUID(bytes=row[0]) if row else None
+
+    def uid_taken(self, uid):
+        return self.connection.execute("SELECT 1 FROM users WHERE uid = ?", (uid.bytes,)).fetchone() is not None
+
+    def user_id(self, uid):
+        """
+        Returns the store's integer id of the user with a uid, to reference the user in other tables (e.g. intake logs).
+        """
+        row = self.connection.execute("SELECT id FROM users WHERE uid = ?", (uid.bytes,)).fetchone()
+        if not row:
+            raise ValueError(f"No user with uid {uid}")
+        return row[0]
+
+    def add(self, person):
+        """
+        Adds a new user, raising ValueError if the username or uid is already taken.
+        """
+        try:
+            with self.connection:
+                self.connection.execute(INSERT, profile(person))
+        except sqlite3.IntegrityError:
+            raise ValueError("Username must be unique")
+
+    def update(self, person):
+        """
+        Saves changes to an existing user's profile, found by uid.
+        """
+        try:
+            with self.connection:
+                cursor = self.connection.execute(
+                    f"UPDATE users SET {', '.join(f'{column} = ?' for column in PROFILE_COLUMNS)} WHERE uid = ?",
+                    profile(person)[1:] + (person.uid.bytes,),
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError("Username must be unique")
+        if not cursor.rowcount:
+            raise ValueError(f"No user with uid {person.uid}")
+
+    def get(self, name):
+        """
+        Returns the user with a username as a Person, or None if there isn't one.
+        """
+        row = self.connection.execute(SELECT + " WHERE name = ?", (normalise_name(name),)).fetchone()
+        return to_person(row) if row else None
+
+    def get_by_uid(self, uid):
+        row = self.connection.execute(SELECT + " WHERE uid = ?", (uid.bytes,)).fetchone()
+        return to_person(row) if row else None
+
+    def import_batch(self, batch, batch_size=10000):
+        """
+        Adds the persons of a Persons.PersonBatch, updating the profiles of users whose username already exists.
+        Rows are written batch_size at a time, each batch in one transaction. Returns the number of rows written.
+        """
+        persons = batch.persons.select(
+            pl.col("name"),
+            pl.col("dob").cast(pl.Utf8),
+            pl.col("sex").cast(pl.Utf8),
+            pl.col("height"),
+            pl.col("weight"),
+            pl.col("due_date").cast(pl.Utf8),
+            pl.col("breastfeeding"),
+            pl.col("pal").cast(pl.Utf8),
+            pl.col("desired_weight"),
+            pl.col("desired_bmi"),
+        )
+        for start in range(0, persons.height, batch_size):
+            rows = persons.slice(start, batch_size).rows()
+            with self.connection:
+                self.connection.executemany(UPSERT, [(uuid.uuid1().bytes,) + row for row in rows])
+        return persons.height
+
+
+def profile(person):
+    """
+    Returns the values stored for a person: uid, then PROFILE_COLUMNS.
+    """
+    return (
+        person.uid.bytes,
+        person.name,
+        person.dob,
+        person.sex,
+        person.height,
+        person.weight,
+        person.due_date.isoformat() if person.due_date else None,
+        person.breastfeeding,
+        person.pal,
+        person.desired_weight,
+        person.desired_bmi,
+    )
+
+
+def to_person(row):
+    """
+    Returns a Person from a row of SELECT.
+    """
+    uid, name, dob, sex, height, weight, due_date, breastfeeding, pal, desired_weight, desired_bmi = row
+    return Person(
+        name,
+        dob,
+        sex,
+        str(height),
+        str(weight),
+        due_date,
+        breastfeeding,
+        pal,
+        desired_weight,
+        desired_bmi,
+        uid=uuid.UUID(bytes=uid),
+    )